@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 def calculate_path_loss(x, y, alpha):
@@ -11,6 +10,14 @@ def calculate_path_loss(x, y, alpha):
     return min(1, np.linalg.norm(y-x)**(-alpha))
 
 
+def calculate_path_loss_batch(x, y, alpha):
+    '''
+    vectorized version of calculate_path_loss, x and y are (..., 2) position arrays
+    and alpha broadcasts against the leading dimensions
+    '''
+    return np.minimum(1, np.sqrt(np.sum((y-x)**2, axis=-1))**(-alpha))
+
+
 def calculate_small_scale_fading(t, M, doppler, beta_n, theta):
     '''
     modified jakes fading is utilized
@@ -21,6 +28,22 @@ def calculate_small_scale_fading(t, M, doppler, beta_n, theta):
     return H**2
 
 
+def calculate_small_scale_fading_trace(t, M, doppler, beta_n, theta):
+    '''
+    vectorized version of calculate_small_scale_fading over a whole time vector.
+    doppler, beta_n and theta are (M,) for a single link or (num_links, M) for several links,
+    the returned power is (num_samples,) or (num_links, num_samples) respectively.
+    '''
+    t = np.asarray(t, dtype=np.float64)
+    doppler = np.asarray(doppler, dtype=np.float64)
+    beta_n = np.asarray(beta_n, dtype=np.float64)
+    theta = np.asarray(theta, dtype=np.float64)
+    phase = doppler[..., :, np.newaxis] * t + theta[..., :, np.newaxis]
+    weights = np.cos(beta_n) + 1j*np.sin(beta_n)
+    H = np.abs(np.sqrt(2/M)*np.einsum("...n,...nt->...t", weights, np.cos(phase)))
+    return H**2
+
+
 def calculate_shadowing(grf, delta, loc1, loc2, stepsize, height, width):
     grf1 = grf[int((loc1[0])/stepsize)+1][int((loc1[1])/stepsize)+1]
     grf2 = grf[int((loc2[0])/stepsize)+1][int((loc2[1])/stepsize)+1]
@@ -28,10 +51,57 @@ def calculate_shadowing(grf, delta, loc1, loc2, stepsize, height, width):
     return 10**(((1-np.exp(-dist/delta))/(np.sqrt(2)*np.sqrt(1+np.exp(-dist/delta)))*(grf1+grf2))/10)
 
 
-def createMap(width, height, sigmaS, correlationDistance, stepsize):
+def calculate_shadowing_batch(grf, delta, loc1, loc2, stepsize):
+    '''
+    vectorized version of calculate_shadowing, loc1 and loc2 are (..., 2) position arrays,
+    the grid indices are truncated towards zero like int() in the scalar version
+    '''
+    loc1_indices = (np.asarray(loc1)/stepsize).astype(np.int64) + 1
+    loc2_indices = (np.asarray(loc2)/stepsize).astype(np.int64) + 1
+    grf1 = grf[loc1_indices[..., 0], loc1_indices[..., 1]]
+    grf2 = grf[loc2_indices[..., 0], loc2_indices[..., 1]]
+    return combine_shadowing(grf1, grf2, delta, loc1, loc2)
+
+
+def combine_shadowing(grf1, grf2, delta, loc1, loc2):
+    '''
+    shadowing power attenuation of the links loc1 -> loc2 from the map values at both ends,
+    the two values are weighted by the distance between the ends
+    '''
+    dist = np.sqrt(np.sum((loc1-loc2)**2, axis=-1))
+    return shadowing_from_distance(grf1, grf2, delta, dist)
+
+
+def shadowing_from_distance(grf1, grf2, delta, dist):
+    '''
+    combine_shadowing with the link distances already known
+    '''
+    correlation = np.exp(-dist/delta)
+    return 10**(((1-correlation)/(np.sqrt(2)*np.sqrt(1+correlation))*(grf1+grf2))/10)
+
+
+def calculate_map_covariance(mapXPoints, mapYPoints, width, height, sigmaS, correlationDistance, dtype=np.float64):
+    '''
+    exponential covariance between the first grid point and every other grid point, the distance
+    is measured on the torus (wrapping around width and height) so that the FFT embedding is circulant
+    '''
+    distance_x = np.absolute(mapXPoints[0] - mapXPoints).astype(dtype)
+    distance_y = np.absolute(mapYPoints[0] - mapYPoints).astype(dtype)
+    distance_x = np.minimum(distance_x, width - distance_x)
+    distance_y = np.minimum(distance_y, height - distance_y)
+    distance = np.sqrt(distance_x[:, np.newaxis]**2 + distance_y[np.newaxis, :]**2)
+    return (sigmaS*np.exp(-1*distance/correlationDistance)).astype(dtype, copy=False)
+
+
+def createMap(width, height, sigmaS, correlationDistance, stepsize, dtype=np.float64, random_state=None):
     '''
-    Book :“Stochastic Geometry, Spatial Statistics and Random Fields:,”, page 374 
+    Book :“Stochastic Geometry, Spatial Statistics and Random Fields:,”, page 374
+    dtype=np.float32 halves the memory of the grid and the FFTs, which makes large maps feasible,
+    the random numbers are drawn in the same order so the map is the float32 rounding of the float64 map
+    random_state is a np.random.RandomState to draw from instead of the global numpy state
     '''
+    if random_state is None:
+        random_state = np.random
     num_x_points = int(width/stepsize) + 3
     num_y_points = int(height/stepsize) + 3
     mapXPoints=np.linspace(0, width, num=num_x_points, endpoint=True)
@@ -39,22 +109,20 @@ def createMap(width, height, sigmaS, correlationDistance, stepsize):
     
     N1 = len(mapXPoints)
     N2 = len(mapYPoints)
-    G = np.zeros([N1,N2],dtype=np.float64)
-    for n in range(N1):
-        for m in range(N2):
-            G[n,m]= sigmaS*np.exp(-1*np.sqrt(np.min([np.absolute(mapXPoints[0]-mapXPoints[n]),\
-                                      width-np.absolute(mapXPoints[0]-mapXPoints[n])])**2\
-            + np.min([np.absolute(mapYPoints[0]-mapYPoints[m]),height\
-                  -np.absolute(mapYPoints[0]-mapYPoints[m])])**2)/correlationDistance)
+    G = calculate_map_covariance(mapXPoints, mapYPoints, width, height, sigmaS, correlationDistance, dtype)
     Gamma = np.fft.fft2(G)
-    Z = np.random.randn(N1,N2) + 1j*np.random.randn(N1,N2)
+    Z = random_state.randn(N1,N2).astype(dtype, copy=False) + 1j*random_state.randn(N1,N2).astype(dtype, copy=False)
     mapp = np.real(np.fft.fft2(np.multiply(np.sqrt(Gamma),Z)\
                                /np.sqrt(N1*N2)))
-    return mapp
+    return mapp.astype(dtype, copy=False)
 
 
 class ChannelModel:
-    def __init__(self, path_loss_factor, number_paths, ue_speed, carrier_freq, shadowing_map, delta, step_size, map_width, map_length) -> None:
+    def __init__(self, path_loss_factor, number_paths, ue_speed, carrier_freq, shadowing_map, delta, step_size, map_width, map_length, \
+        random_state=None) -> None:
+        # random_state is a np.random.RandomState for the fading phases instead of the global numpy state
+        if random_state is None:
+            random_state = np.random
         self.path_loss_factor = path_loss_factor    # parameter for path loss
             
         self.number_paths = number_paths            # parameter for small scale fading
@@ -65,7 +133,7 @@ class ChannelModel:
         self.alpha_n = np.array([2*np.pi*(n-0.5)/self.number_paths for n in range(1,self.n_nut+1)])
         self.beta_n = [np.pi*n/(int(self.n_nut)) for n in range(1, self.n_nut+1)]
         self.doppler_spread = 2*np.pi * self.carrier_freq * self.ue_speed *np.cos(self.alpha_n) / self.light_speed
-        self.theta = np.random.uniform(0, 2*np.pi, self.n_nut)
+        self.theta = random_state.uniform(0, 2*np.pi, self.n_nut)
         
         self.shadowing_map = shadowing_map          # for shadowing
         self.map_width = map_width
@@ -74,15 +142,41 @@ class ChannelModel:
         self.step_size = step_size                  # should be the resolution for shadowing map
         
         
-    def calculate_channel(self, position1, position2, time_index):
+    def calculate_channel(self, position1, position2, time_index, small_scale_fading=None):
         path_loss = calculate_path_loss(position1, position2, self.path_loss_factor)
-        small_scale_fading = calculate_small_scale_fading(time_index, self.n_nut, self.doppler_spread, self.beta_n, self.theta)
+        if small_scale_fading is None:
+            small_scale_fading = calculate_small_scale_fading(time_index, self.n_nut, self.doppler_spread, self.beta_n, self.theta)
         shadowing = calculate_shadowing(self.shadowing_map, self.delta, position1, position2, self.step_size, self.map_length, self.map_width)
         channel_power_attenuation = path_loss * small_scale_fading * shadowing
         return channel_power_attenuation
+    
+    
+    def calculate_fading_trace(self, time_indices):
+        '''
+        small scale fading power for every time index at once, same values as calling
+        calculate_small_scale_fading per sample
+        '''
+        return calculate_small_scale_fading_trace(time_indices, self.n_nut, self.doppler_spread, self.beta_n, self.theta)
+
+
+def calculate_fading_traces(channel_models:list, time_indices):
+    '''
+    small scale fading power of several links in one broadcast computation, returns (num_links, num_samples)
+    all channel models need the same number of paths
+    '''
+    n_nut_set = {channel_model.n_nut for channel_model in channel_models}
+    if len(n_nut_set) != 1:
+        raise ValueError("All channel models must use the same number_paths to stack their fading traces.")
+    n_nut = n_nut_set.pop()
+    doppler = np.stack([channel_model.doppler_spread for channel_model in channel_models])
+    beta_n = np.stack([channel_model.beta_n for channel_model in channel_models])
+    theta = np.stack([channel_model.theta for channel_model in channel_models])
+    return calculate_small_scale_fading_trace(time_indices, n_nut, doppler, beta_n, theta)
 
 
 def channel_test():
+    import matplotlib.pyplot as plt
+    
     # parameter initialization
     path_loss_factor = 2
     number_paths = 20
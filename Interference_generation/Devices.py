@@ -1,7 +1,50 @@
 import numpy as np
 import math
 import random
-import matplotlib.pyplot as plt
+
+
+def clipped_cumsum(start:float, steps:np.ndarray, lower:float, upper:float, min_window:int=64, max_window:int=8192) -> np.ndarray:
+    """Positions of a walk that is clipped to [lower, upper] after every step.
+
+    The cumulative sum is computed over windows of steps and is exact until the walk reaches a
+    boundary, there it is clipped and restarted from the clipped value. A walk close to a wall hits
+    it very often, so the window starts at min_window steps after every hit and doubles up to
+    max_window while the walk stays inside. Every cumulative sum only covers steps that are either
+    kept or followed by a hit, so the total cost is O(len(steps) + min_window * number of hits).
+
+    Args:
+        start (float): position before the first step
+        steps (np.ndarray): 1-d array of step lengths
+        lower (float): lower boundary
+        upper (float): upper boundary
+        min_window (int, optional): number of steps summed after a boundary hit. Defaults to 64.
+        max_window (int, optional): maximum number of steps summed at a time. Defaults to 8192.
+
+    Returns:
+        np.ndarray: positions after every step, same length as steps
+    """
+    positions = np.empty(len(steps), dtype=np.float64)
+    current_index = 0
+    current_position = start
+    window_size = min_window
+    while current_index < len(steps):
+        walk = current_position + np.cumsum(steps[current_index:current_index+window_size])
+        outside = np.flatnonzero((walk <= lower) | (walk >= upper))
+        if len(outside) == 0:
+            # no hit in the window, continue from its last position with a larger window
+            positions[current_index:current_index+len(walk)] = walk
+            current_position = walk[-1]
+            current_index += len(walk)
+            window_size = min(2 * window_size, max_window)
+            continue
+        hit_index = outside[0]
+        positions[current_index:current_index+hit_index] = walk[:hit_index]
+        current_position = min(max(walk[hit_index], lower), upper)
+        positions[current_index+hit_index] = current_position
+        current_index += hit_index + 1
+        window_size = min_window
+    return positions
+
 
 class RandomMovingUserEquipment:
     def __init__(self, tx_power, init_x, init_y, speed, direction=0, x_boundary:list=[0, 20], y_boundary:list=[0,20]) -> None:
@@ -24,6 +67,30 @@ class RandomMovingUserEquipment:
         return np.array([self.position_x, self.position_y])
     
     
+    def generate_trajectory(self, num_steps:int, sampling_interval:float, rng:np.random.Generator=None) -> np.ndarray:
+        """Generate num_steps calls of random_move at once.
+
+        Args:
+            num_steps (int): number of steps
+            sampling_interval (float): time between two steps in seconds
+            rng (np.random.Generator, optional): random generator for the directions, a fresh default_rng if None
+
+        Returns:
+            np.ndarray: positions after every step, shape (num_steps, 2)
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        directions = rng.uniform(-math.pi, +math.pi, num_steps)
+        step_length = self.speed * sampling_interval
+        trajectory = np.empty((num_steps, 2), dtype=np.float64)
+        trajectory[:, 0] = clipped_cumsum(self.position_x, step_length*np.cos(directions), self.x_boundary[0], self.x_boundary[1])
+        trajectory[:, 1] = clipped_cumsum(self.position_y, step_length*np.sin(directions), self.y_boundary[0], self.y_boundary[1])
+        if num_steps > 0:
+            self.direction = directions[-1]
+            self.position_x, self.position_y = trajectory[-1, 0], trajectory[-1, 1]
+        return trajectory
+    
+    
     def check_position(self):
         if self.position_x <= self.x_boundary[0]:
             self.position_x = self.x_boundary[0]
@@ -53,8 +120,10 @@ class RouteMovingUserEquipment:
         theta = sampling_interval * self.rad_speed
         self.circle_motion_matrix = np.array([[math.cos(theta), -math.sin(theta)],
                                               [math.sin(theta), math.cos(theta)]])
+        self.route_anchor = None                # start of the route for generate_trajectory
 
     def move(self):
+        self.route_anchor = None
         if self.route_type == "circle":
             position = self.move_in_circle()
         elif self.route_type == "square":
@@ -62,6 +131,83 @@ class RouteMovingUserEquipment:
         else:
             raise ValueError("Invalid route_type. Supported types: 'circle' or 'square'.")
         return position
+    
+    
+    def generate_trajectory(self, num_steps:int, sampling_interval:float=None, rng:np.random.Generator=None) -> np.ndarray:
+        """Generate num_steps calls of move at once.
+
+        Args:
+            num_steps (int): number of steps
+            sampling_interval (float, optional): time between two steps in seconds, self.sampling_interval if None
+            rng (np.random.Generator, optional): unused, the routes are deterministic. Kept for the same signature
+                as RandomMovingUserEquipment.generate_trajectory
+
+        Returns:
+            np.ndarray: positions after every step, shape (num_steps, 2)
+        """
+        if sampling_interval is None:
+            sampling_interval = self.sampling_interval
+        if self.route_type not in ("circle", "square"):
+            raise ValueError("Invalid route_type. Supported types: 'circle' or 'square'.")
+        
+        # the route is anchored at the position of the first call and later calls continue counting steps from
+        # there, so the trajectory does not depend on how the steps are split into calls
+        if self.route_anchor is None or self.route_anchor["sampling_interval"] != sampling_interval:
+            self.route_anchor = self.calculate_route_anchor(sampling_interval)
+        step_indices = self.route_anchor["num_steps"] + np.arange(1, num_steps+1)
+        self.route_anchor["num_steps"] += num_steps
+        
+        if self.route_type == "circle":
+            trajectory = self.generate_circle_trajectory(step_indices, sampling_interval)
+        else:
+            trajectory = self.generate_square_trajectory(step_indices, sampling_interval)
+        if num_steps > 0:
+            self.position_x, self.position_y = trajectory[-1, 0], trajectory[-1, 1]
+        return trajectory
+    
+    
+    def calculate_route_anchor(self, sampling_interval:float) -> dict:
+        route_anchor = {"sampling_interval": sampling_interval, "num_steps": 0}
+        if self.route_type == "circle":
+            route_anchor["radius"] = math.hypot(self.position_x, self.position_y)
+            route_anchor["angle"] = math.atan2(self.position_y, self.position_x)
+            return route_anchor
+        
+        x1, y1, x2, y2 = self.x_boundary[0], self.y_boundary[0], self.x_boundary[1], self.y_boundary[1]
+        width, height = x2 - x1, y2 - y1
+        if y1 <= self.position_y <= y2 and self.position_x == x1 and self.position_y < y2:
+            route_anchor["distance"] = self.position_y - y1
+        elif x1 <= self.position_x <= x2 and self.position_y == y2 and self.position_x < x2:
+            route_anchor["distance"] = height + (self.position_x - x1)
+        elif y1 <= self.position_y <= y2 and self.position_x == x2 and self.position_y > y1:
+            route_anchor["distance"] = height + width + (y2 - self.position_y)
+        elif x1 <= self.position_x <= x2 and self.position_y == y1:
+            route_anchor["distance"] = 2*height + width + (x2 - self.position_x)
+        else:
+            raise ValueError("The square route requires the start position to lie on the boundary.")
+        return route_anchor
+    
+    
+    def generate_circle_trajectory(self, step_indices:np.ndarray, sampling_interval:float) -> np.ndarray:
+        # move_in_circle rotates the position around the origin by a fixed angle per step
+        theta = sampling_interval * self.rad_speed
+        radius = self.route_anchor["radius"]
+        angles = self.route_anchor["angle"] + theta * step_indices
+        return np.stack([radius*np.cos(angles), radius*np.sin(angles)], axis=1)
+    
+    
+    def generate_square_trajectory(self, step_indices:np.ndarray, sampling_interval:float) -> np.ndarray:
+        # the square is walked clockwise (left edge up, upper edge right, ...) as in move_in_square,
+        # the positions are a piecewise-linear function of the travelled distance along the edges
+        x1, y1, x2, y2 = self.x_boundary[0], self.y_boundary[0], self.x_boundary[1], self.y_boundary[1]
+        width, height = x2 - x1, y2 - y1
+        corner_distances = np.array([0, height, height + width, 2*height + width, 2*(height + width)])
+        corner_x = np.array([x1, x1, x2, x2, x1])
+        corner_y = np.array([y1, y2, y2, y1, y1])
+        
+        step = self.speed * sampling_interval
+        distances = np.mod(self.route_anchor["distance"] + step * step_indices, corner_distances[-1])
+        return np.stack([np.interp(distances, corner_distances, corner_x), np.interp(distances, corner_distances, corner_y)], axis=1)
         
         
     def move_in_circle(self):
@@ -87,7 +233,7 @@ class RouteMovingUserEquipment:
             self.position_y -= step
         
         if self.position_x > x2:
-            self.postion_x = x2
+            self.position_x = x2
         elif self.position_x < x1:
             self.position_x = x1
         
@@ -121,6 +267,8 @@ class BaseStation:
         
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    
     # Create an instance of RouteMovingUserEquipment
     user_equipment = RouteMovingUserEquipment(tx_power=1, init_x=0, init_y=10, radius=10, speed_mps=2, x_boundary=[0, 20], y_boundary=[0, 20])
 
@@ -1,4 +1,17 @@
+import numpy as np
+
+
 class MovingArea:
     def __init__(self, x_boundary, y_boundary) -> None:
         self.x_boundary = x_boundary
         self.y_boundary = y_boundary
+
+
+    def sample_positions(self, num_positions:int, rng:np.random.Generator=None) -> np.ndarray:
+        """Uniformly distributed positions inside the area, shape (num_positions, 2)."""
+        if rng is None:
+            rng = np.random.default_rng()
+        positions = np.empty((num_positions, 2), dtype=np.float64)
+        positions[:, 0] = rng.uniform(self.x_boundary[0], self.x_boundary[1], num_positions)
+        positions[:, 1] = rng.uniform(self.y_boundary[0], self.y_boundary[1], num_positions)
+        return positions
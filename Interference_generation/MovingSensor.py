@@ -1,4 +1,41 @@
+import numpy as np
+
+from Devices import RandomMovingUserEquipment
+from MovingArea import MovingArea
+
+
 class MovingSensor:
-    def __init__(self, num_users, ) -> None:
+    def __init__(self, num_users, moving_area:MovingArea, tx_power:float=20, speed:float=2, rng:np.random.Generator=None) -> None:
+        """Group of num_users randomly moving devices that start at uniform positions inside the moving area.
+
+        Every device draws its directions from its own child generator, so the trajectories do not depend on
+        how the samples are split into blocks.
+
+        Args:
+            num_users (int): number of devices
+            moving_area (MovingArea): area the devices start and move in
+            tx_power (float, optional): transmit power of every device. Defaults to 20.
+            speed (float, optional): speed of every device in m/s. Defaults to 2.
+            rng (np.random.Generator, optional): generator of the start positions and the directions. Defaults to None.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
         self.num_users = num_users
-        
\ No newline at end of file
+        self.moving_area = moving_area
+        self.tx_power = tx_power
+        start_positions = moving_area.sample_positions(num_users, rng)
+        self.user_list = [RandomMovingUserEquipment(tx_power, x, y, speed, x_boundary=moving_area.x_boundary, \
+            y_boundary=moving_area.y_boundary) for x, y in start_positions]
+        self.rng_list = rng.spawn(num_users)
+
+
+    def get_positions(self) -> np.ndarray:
+        return np.array([[user.position_x, user.position_y] for user in self.user_list])
+
+
+    def generate_trajectory(self, num_steps:int, sampling_interval:float) -> np.ndarray:
+        """Next num_steps positions of every device, shape (num_users, num_steps, 2)."""
+        trajectories = np.empty((self.num_users, num_steps, 2), dtype=np.float64)
+        for user_index, (user, rng) in enumerate(zip(self.user_list, self.rng_list)):
+            trajectories[user_index] = user.generate_trajectory(num_steps, sampling_interval, rng)
+        return trajectories
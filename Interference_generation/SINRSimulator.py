@@ -0,0 +1,89 @@
+import numpy as np
+
+from ChannelModel import ChannelModel, calculate_path_loss_batch, calculate_shadowing_batch, calculate_small_scale_fading_trace
+
+
+class SINRSimulator:
+    def __init__(self, interference_channels:list, signal_channel:ChannelModel, noise_power:float=1) -> None:
+        """Compute the SINR of one receiver for a whole trace with (num_links, num_samples) array operations.
+
+        The channel parameters of every link are stacked from existing ChannelModel objects, so the random
+        fading phases are the ones drawn when the channel models were created. The last link is the signal link.
+
+        Args:
+            interference_channels (list): one ChannelModel per interferer
+            signal_channel (ChannelModel): channel between the receiver and its base station
+            noise_power (float, optional): noise power. Defaults to 1.
+        """
+        channel_models = list(interference_channels) + [signal_channel]
+        if len({channel_model.n_nut for channel_model in channel_models}) != 1:
+            raise ValueError("All channel models must use the same number_paths.")
+        if any(channel_model.shadowing_map is not signal_channel.shadowing_map for channel_model in channel_models):
+            raise ValueError("All channel models must share the same shadowing map.")
+
+        self.num_interferers = len(interference_channels)
+        self.noise_power = noise_power
+
+        self.path_loss_factor = np.array([channel_model.path_loss_factor for channel_model in channel_models])
+        self.n_nut = signal_channel.n_nut
+        self.doppler_spread = np.stack([channel_model.doppler_spread for channel_model in channel_models])
+        self.beta_n = np.stack([channel_model.beta_n for channel_model in channel_models])
+        self.theta = np.stack([channel_model.theta for channel_model in channel_models])
+
+        self.shadowing_map = signal_channel.shadowing_map
+        self.delta = np.array([channel_model.delta for channel_model in channel_models])
+        self.step_size = signal_channel.step_size
+
+
+    def calculate_channel_gains(self, rx_position:np.ndarray, tx_positions:np.ndarray, time_indices:np.ndarray) -> np.ndarray:
+        """Channel power attenuation of every link and sample.
+
+        Args:
+            rx_position (np.ndarray): receiver position, shape (2,) or (num_samples, 2)
+            tx_positions (np.ndarray): transmitter positions, shape (num_links, num_samples, 2) or (num_links, 1, 2) for static ones
+            time_indices (np.ndarray): sampling times, shape (num_samples,)
+
+        Returns:
+            np.ndarray: channel power attenuation, shape (num_links, num_samples)
+        """
+        num_samples = len(time_indices)
+        rx_positions = np.broadcast_to(rx_position, (num_samples, 2))
+        tx_positions = np.broadcast_to(tx_positions, (len(self.path_loss_factor), num_samples, 2))
+        path_loss = calculate_path_loss_batch(rx_positions, tx_positions, self.path_loss_factor[:, np.newaxis])
+        small_scale_fading = calculate_small_scale_fading_trace(time_indices, self.n_nut, self.doppler_spread, self.beta_n, self.theta)
+        shadowing = calculate_shadowing_batch(self.shadowing_map, self.delta[:, np.newaxis], rx_positions, tx_positions, self.step_size)
+        return path_loss * small_scale_fading * shadowing
+
+
+    def simulate(self, ue_position:np.ndarray, interference_trajectories:np.ndarray, interference_tx_powers:np.ndarray, \
+        bs_position:np.ndarray, bs_tx_power:float, time_indices:np.ndarray):
+        """Simulate SINR, SINR in dB and interference power of the whole trace.
+
+        Args:
+            ue_position (np.ndarray): position of the receiving UE, shape (2,) or (num_samples, 2)
+            interference_trajectories (np.ndarray): interferer positions, shape (num_interferers, num_samples, 2)
+            interference_tx_powers (np.ndarray): transmit power of every interferer, shape (num_interferers,)
+            bs_position (np.ndarray): base station position, shape (2,)
+            bs_tx_power (float): transmit power of the base station
+            time_indices (np.ndarray): sampling times, shape (num_samples,)
+
+        Returns:
+            tuple: sinr, sinr_dB and interference power, each of shape (num_samples,)
+        """
+        interference_trajectories = np.asarray(interference_trajectories, dtype=np.float64)
+        if interference_trajectories.shape[0] != self.num_interferers:
+            raise ValueError(f"Expected trajectories of {self.num_interferers} interferers, got {interference_trajectories.shape[0]}.")
+        num_samples = len(time_indices)
+        bs_trajectory = np.broadcast_to(np.asarray(bs_position, dtype=np.float64), (1, num_samples, 2))
+        tx_positions = np.concatenate([np.broadcast_to(interference_trajectories, (self.num_interferers, num_samples, 2)), bs_trajectory])
+
+        channel_gains = self.calculate_channel_gains(np.asarray(ue_position, dtype=np.float64), tx_positions, time_indices)
+
+        # summing the links one after another keeps the same rounding as the per-sample loop
+        interference_power = np.zeros(num_samples, dtype=np.float64)
+        for link_index in range(self.num_interferers):
+            interference_power = interference_power + channel_gains[link_index] * interference_tx_powers[link_index]
+        signal_power = bs_tx_power * channel_gains[-1]
+        sinr = signal_power / (self.noise_power + interference_power)
+        sinr_dB = 10*np.log10(sinr)
+        return sinr, sinr_dB, interference_power
@@ -0,0 +1,114 @@
+import numpy as np
+import os
+
+from ChannelModel import createMap, combine_shadowing
+
+
+# maps already loaded or generated in this process, keyed by ShadowingField.key
+map_registry = dict()
+
+
+class ShadowingField:
+    def __init__(self, width:float, height:float, sigmaS:float, correlationDistance:float, stepsize:float, seed:int=None, \
+        cache_folder:str=os.path.join("Interference_generation", "interference_data", "shadowing_maps"), dtype=np.float64) -> None:
+        """Shadowing map of createMap that is generated once per parameter set and seed and then reused.
+
+        A map with a seed is drawn from its own np.random.RandomState(seed), so it is the map createMap returns after
+        np.random.seed(seed) and it does not consume the global random state. It is kept in map_registry for the
+        process and saved to cache_folder, so other processes and later experiments load it instead of paying the FFT.
+        Without a seed the map is drawn from the global state and never cached.
+
+        Args:
+            width (float): width of the map in m
+            height (float): height of the map in m
+            sigmaS (float): variance of the shadowing
+            correlationDistance (float): correlation distance in m
+            stepsize (float): resolution of the map in m
+            seed (int, optional): seed of the map. Defaults to None.
+            cache_folder (str, optional): folder of the cached maps, None for no disk cache. Defaults to "Interference_generation/interference_data/shadowing_maps".
+            dtype (optional): type of the map. Defaults to np.float64.
+        """
+        self.width = width
+        self.height = height
+        self.sigmaS = sigmaS
+        self.correlationDistance = correlationDistance
+        self.stepsize = stepsize
+        self.seed = seed
+        self.cache_folder = cache_folder
+        self.dtype = np.dtype(dtype)
+        self.key = (width, height, sigmaS, correlationDistance, stepsize, seed, self.dtype.name)
+        self.map = self.load_map()
+
+
+    def get_cache_path(self) -> str:
+        file_name = "map_width_{}_height_{}_sigma_{}_delta_{}_step_{}_seed_{}_{}.npy".format(*self.key)
+        return os.path.join(self.cache_folder, file_name)
+
+
+    def load_map(self) -> np.ndarray:
+        if self.seed is None:
+            return createMap(self.width, self.height, self.sigmaS, self.correlationDistance, self.stepsize, self.dtype)
+        if self.key in map_registry:
+            return map_registry[self.key]
+
+        cache_path = None if self.cache_folder is None else self.get_cache_path()
+        if cache_path is not None and os.path.exists(cache_path):
+            shadowing_map = np.load(cache_path)
+        else:
+            shadowing_map = createMap(self.width, self.height, self.sigmaS, self.correlationDistance, self.stepsize, self.dtype, \
+                random_state=np.random.RandomState(self.seed))
+            if cache_path is not None:
+                # write to a temporary file first, so parallel workers never read a partially written map
+                os.makedirs(self.cache_folder, exist_ok=True)
+                temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(temporary_path, "wb") as map_file:
+                    np.save(map_file, shadowing_map)
+                os.replace(temporary_path, cache_path)
+        map_registry[self.key] = shadowing_map
+        return shadowing_map
+
+
+    def lookup(self, positions:np.ndarray, interpolate:bool=False) -> np.ndarray:
+        """Map values at a batch of positions.
+
+        Without interpolation, a position gets the value of its grid cell with the indexing of calculate_shadowing.
+        With interpolation, the cell values are placed at the cell centers and interpolated bilinearly, which gives
+        a continuous field instead of jumps at the cell borders.
+
+        Args:
+            positions (np.ndarray): positions of shape (..., 2)
+            interpolate (bool, optional): interpolate bilinearly between the cell centers. Defaults to False.
+
+        Returns:
+            np.ndarray: map values of shape (...)
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        if not interpolate:
+            indices = (positions/self.stepsize).astype(np.int64) + 1
+            return self.map[indices[..., 0], indices[..., 1]]
+
+        grid_coordinates = positions/self.stepsize + 0.5
+        lower_indices = np.floor(grid_coordinates).astype(np.int64)
+        fractions = grid_coordinates - lower_indices
+        max_indices = np.array(self.map.shape) - 1
+        lower_indices = np.clip(lower_indices, 0, max_indices)
+        upper_indices = np.minimum(lower_indices + 1, max_indices)
+        x0, y0 = lower_indices[..., 0], lower_indices[..., 1]
+        x1, y1 = upper_indices[..., 0], upper_indices[..., 1]
+        fraction_x, fraction_y = fractions[..., 0], fractions[..., 1]
+        return (1 - fraction_x) * ((1 - fraction_y) * self.map[x0, y0] + fraction_y * self.map[x0, y1]) \
+            + fraction_x * ((1 - fraction_y) * self.map[x1, y0] + fraction_y * self.map[x1, y1])
+
+
+    def calculate_shadowing(self, delta, loc1:np.ndarray, loc2:np.ndarray, interpolate:bool=False) -> np.ndarray:
+        """Shadowing power attenuation of a batch of links, same as calculate_shadowing_batch without interpolation.
+
+        Args:
+            delta: decorrelation distance of the link ends, broadcasts against the leading dimensions
+            loc1 (np.ndarray): positions of one end, shape (..., 2)
+            loc2 (np.ndarray): positions of the other end, shape (..., 2)
+            interpolate (bool, optional): see lookup. Defaults to False.
+        """
+        loc1 = np.asarray(loc1, dtype=np.float64)
+        loc2 = np.asarray(loc2, dtype=np.float64)
+        return combine_shadowing(self.lookup(loc1, interpolate), self.lookup(loc2, interpolate), delta, loc1, loc2)
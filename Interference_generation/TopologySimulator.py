@@ -0,0 +1,201 @@
+import numpy as np
+
+from ChannelModel import shadowing_from_distance
+from ShadowingField import ShadowingField
+from MovingSensor import MovingSensor
+
+
+class TopologySimulator:
+    def __init__(self, num_ues:int, num_tx:int, shadowing_field:ShadowingField, delta:float=5, path_loss_factor:float=2.5, \
+        number_paths:int=10, ue_speed:float=2, carrier_freq:float=3e9, rng:np.random.Generator=None, interpolate_shadowing:bool=False) -> None:
+        """Channel gains between many receiving UEs and many transmitters (base stations and interferers) at once.
+
+        The links use the channel of ChannelModel, but they are not separate objects:
+        - path loss and link distances are (num_ues, num_tx, num_samples) array operations
+        - the shadowing map is looked up once per device instead of once per link
+        - all links share the doppler frequencies, so the Jakes sum of a link is the product of its (4*n_nut,) coefficients
+          with cos and sin of the doppler phases, which are computed once per block instead of once per link
+        The memory of a block is linear in num_ues * num_tx * num_samples.
+
+        Args:
+            num_ues (int): number of receiving UEs
+            num_tx (int): number of transmitters
+            shadowing_field (ShadowingField): shadowing map shared by all links
+            delta (float, optional): decorrelation distance of the shadowing. Defaults to 5.
+            path_loss_factor (float, optional): path loss exponent. Defaults to 2.5.
+            number_paths (int, optional): number of paths of the fading. Defaults to 10.
+            ue_speed (float, optional): speed for the doppler spread in m/s. Defaults to 2.
+            carrier_freq (float, optional): carrier frequency in Hz. Defaults to 3e9.
+            rng (np.random.Generator, optional): generator of the fading phases. Defaults to None.
+            interpolate_shadowing (bool, optional): interpolate the shadowing map bilinearly. Defaults to False.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        self.num_ues = num_ues
+        self.num_tx = num_tx
+        self.shadowing_field = shadowing_field
+        self.delta = delta
+        self.path_loss_factor = path_loss_factor
+        self.interpolate_shadowing = interpolate_shadowing
+
+        self.number_paths = number_paths
+        self.n_nut = int(number_paths / 4)
+        self.light_speed = 299792458
+        alpha_n = np.array([2*np.pi*(n-0.5)/number_paths for n in range(1, self.n_nut+1)])
+        beta_n = np.array([np.pi*n/self.n_nut for n in range(1, self.n_nut+1)])
+        self.doppler_spread = 2*np.pi * carrier_freq * ue_speed * np.cos(alpha_n) / self.light_speed
+        self.theta = rng.uniform(0, 2*np.pi, (num_ues, num_tx, self.n_nut))
+
+        # cos(doppler*t + theta) = cos(doppler*t)*cos(theta) - sin(doppler*t)*sin(theta), so the real and imaginary
+        # part of every link are linear in [cos(doppler*t), sin(doppler*t)]
+        cos_theta, sin_theta = np.cos(self.theta), np.sin(self.theta)
+        real_coefficients = np.concatenate((np.cos(beta_n)*cos_theta, -np.cos(beta_n)*sin_theta), axis=-1)
+        imag_coefficients = np.concatenate((np.sin(beta_n)*cos_theta, -np.sin(beta_n)*sin_theta), axis=-1)
+        self.fading_coefficients = np.stack((real_coefficients, imag_coefficients), axis=2).reshape(-1, 2*self.n_nut)
+
+
+    def calculate_fading(self, time_indices:np.ndarray) -> np.ndarray:
+        """Small scale fading power of every link, shape (num_ues, num_tx, num_samples)."""
+        phase = self.doppler_spread[:, np.newaxis] * np.asarray(time_indices, dtype=np.float64)
+        basis = np.concatenate((np.cos(phase), np.sin(phase)))
+        parts = (self.fading_coefficients @ basis).reshape(self.num_ues, self.num_tx, 2, len(time_indices))
+        return 2/self.n_nut * (parts[:, :, 0]**2 + parts[:, :, 1]**2)
+
+
+    def calculate_link_gains(self, ue_positions:np.ndarray, tx_positions:np.ndarray, time_indices:np.ndarray) -> np.ndarray:
+        """Channel power attenuation of every link and sample.
+
+        Args:
+            ue_positions (np.ndarray): UE positions, shape (num_ues, 2) for static or (num_ues, num_samples, 2) for moving UEs
+            tx_positions (np.ndarray): transmitter positions, shape (num_tx, 2) or (num_tx, num_samples, 2)
+            time_indices (np.ndarray): sampling times, shape (num_samples,)
+
+        Returns:
+            np.ndarray: link gains, shape (num_ues, num_tx, num_samples)
+        """
+        num_samples = len(time_indices)
+        ue_positions = np.asarray(ue_positions, dtype=np.float64)
+        tx_positions = np.asarray(tx_positions, dtype=np.float64)
+        if ue_positions.ndim == 2:
+            ue_positions = ue_positions[:, np.newaxis]
+        if tx_positions.ndim == 2:
+            tx_positions = tx_positions[:, np.newaxis]
+        if len(ue_positions) != self.num_ues or len(tx_positions) != self.num_tx:
+            raise ValueError(f"Expected positions of {self.num_ues} UEs and {self.num_tx} transmitters, "
+                             f"got {len(ue_positions)} and {len(tx_positions)}.")
+
+        distance_x = ue_positions[:, np.newaxis, :, 0] - tx_positions[np.newaxis, :, :, 0]
+        distance_y = ue_positions[:, np.newaxis, :, 1] - tx_positions[np.newaxis, :, :, 1]
+        distance = np.broadcast_to(np.sqrt(distance_x**2 + distance_y**2), (self.num_ues, self.num_tx, num_samples))
+        path_loss = np.minimum(1, distance**(-self.path_loss_factor))
+
+        ue_grf = self.shadowing_field.lookup(ue_positions, self.interpolate_shadowing)
+        tx_grf = self.shadowing_field.lookup(tx_positions, self.interpolate_shadowing)
+        shadowing = shadowing_from_distance(ue_grf[:, np.newaxis], tx_grf[np.newaxis, :], self.delta, distance)
+
+        return path_loss * self.calculate_fading(time_indices) * shadowing
+
+
+    def calculate_sinr(self, link_gains:np.ndarray, tx_powers:np.ndarray, serving_indices:np.ndarray, noise_power:float=1):
+        """SINR of every UE, all transmitters except the serving one interfere.
+
+        Args:
+            link_gains (np.ndarray): output of calculate_link_gains, shape (num_ues, num_tx, num_samples)
+            tx_powers (np.ndarray): transmit power of every transmitter, shape (num_tx,)
+            serving_indices (np.ndarray): index of the serving transmitter of every UE, shape (num_ues,)
+            noise_power (float, optional): noise power. Defaults to 1.
+
+        Returns:
+            tuple: sinr, sinr_dB and interference power, each of shape (num_ues, num_samples)
+        """
+        received_power = link_gains * np.asarray(tx_powers, dtype=np.float64)[np.newaxis, :, np.newaxis]
+        signal_power = received_power[np.arange(self.num_ues), serving_indices]
+        interference_power = received_power.sum(axis=1) - signal_power
+        sinr = signal_power / (noise_power + interference_power)
+        sinr_dB = 10*np.log10(sinr)
+        return sinr, sinr_dB, interference_power
+
+
+def get_device_positions(device_list:list, num_steps:int, sampling_interval:float, rng_list:list) -> np.ndarray:
+    """Positions of a list of devices for the next num_steps samples, static devices are broadcast.
+
+    A MovingSensor contributes all of its devices, devices with generate_trajectory move, all others are static.
+
+    Returns:
+        np.ndarray: positions of shape (num_devices, num_steps, 2)
+    """
+    position_list = list()
+    for device, rng in zip(device_list, rng_list):
+        if isinstance(device, MovingSensor):
+            position_list.append(device.generate_trajectory(num_steps, sampling_interval))
+        elif hasattr(device, "generate_trajectory"):
+            position_list.append(device.generate_trajectory(num_steps, sampling_interval, rng=rng)[np.newaxis])
+        else:
+            position = np.array([device.position_x, device.position_y], dtype=np.float64)
+            position_list.append(np.broadcast_to(position, (1, num_steps, 2)))
+    return np.concatenate(position_list)
+
+
+def count_devices(device_list:list) -> int:
+    return sum(device.num_users if isinstance(device, MovingSensor) else 1 for device in device_list)
+
+
+def get_tx_powers(device_list:list) -> np.ndarray:
+    tx_power_list = list()
+    for device in device_list:
+        if isinstance(device, MovingSensor):
+            tx_power_list.extend([device.tx_power] * device.num_users)
+        else:
+            tx_power_list.append(device.tx_power)
+    return np.array(tx_power_list, dtype=np.float64)
+
+
+def simulate_topology_blocks(ue_list:list, base_station_list:list, interferer_list:list, num_samples:int, shadowing_field:ShadowingField, \
+    sample_frequency:float=1000, block_size:int=1000, serving_indices:np.ndarray=None, noise_power:float=1, seed=None, **channel_kwargs):
+    """Simulate the link gains and the SINR of many UEs against several base stations and many interferers block by block.
+
+    The transmitters are the base stations followed by the interferers (a MovingSensor counts as its num_users devices).
+    Without serving_indices, every UE is served by the base station closest to its first position.
+
+    Args:
+        ue_list (list): receiving UEs, static or moving devices or MovingSensor groups
+        base_station_list (list): base stations
+        interferer_list (list): interfering devices or MovingSensor groups
+        num_samples (int): length of the traces
+        shadowing_field (ShadowingField): shadowing map shared by all links
+        sample_frequency (float, optional): sampling frequency in Hz. Defaults to 1000.
+        block_size (int, optional): samples per block, the memory is linear in num_ues * num_tx * block_size. Defaults to 1000.
+        serving_indices (np.ndarray, optional): index of the serving base station of every UE. Defaults to None.
+        noise_power (float, optional): noise power. Defaults to 1.
+        seed (int or np.random.SeedSequence, optional): seed of the fading phases and the mobility. Defaults to None.
+        channel_kwargs: further arguments of TopologySimulator, e.g. path_loss_factor or delta
+
+    Yields:
+        tuple: time indices (block_length,), link gains (num_ues, num_tx, block_length) and
+            sinr, sinr_dB and interference power (num_ues, block_length) of the block
+    """
+    sample_interval = 1 / sample_frequency
+    tx_list = list(base_station_list) + list(interferer_list)
+    num_ues = count_devices(ue_list)
+    num_tx = count_devices(tx_list)
+    tx_powers = get_tx_powers(tx_list)
+
+    rng = np.random.default_rng(seed)
+    simulator = TopologySimulator(num_ues, num_tx, shadowing_field, rng=rng, **channel_kwargs)
+    ue_rng_list = rng.spawn(len(ue_list))
+    tx_rng_list = rng.spawn(len(tx_list))
+
+    block_start = 0
+    while block_start < num_samples:
+        block_end = min(block_start + block_size, num_samples)
+        time_indices = np.arange(block_start, block_end, dtype=np.float64) * sample_interval
+        ue_positions = get_device_positions(ue_list, block_end - block_start, sample_interval, ue_rng_list)
+        tx_positions = get_device_positions(tx_list, block_end - block_start, sample_interval, tx_rng_list)
+        if serving_indices is None:
+            bs_positions = tx_positions[:len(base_station_list), 0]
+            bs_distance = np.linalg.norm(ue_positions[:, np.newaxis, 0] - bs_positions[np.newaxis], axis=-1)
+            serving_indices = np.argmin(bs_distance, axis=1)
+        link_gains = simulator.calculate_link_gains(ue_positions, tx_positions, time_indices)
+        sinr, sinr_dB, interference_power = simulator.calculate_sinr(link_gains, tx_powers, serving_indices, noise_power)
+        yield time_indices, link_gains, sinr, sinr_dB, interference_power
+        block_start = block_end
@@ -0,0 +1,94 @@
+import numpy as np
+import h5py
+
+from sinr_simulation import simulate_sinr_blocks
+
+
+class SINRTraceWriter:
+    def __init__(self, file_path:str, chunk_size:int=65536, compression:str="gzip", compression_opts:int=4, \
+        dtype=np.float32, attributes:dict=None) -> None:
+        """Append SINR blocks to resizable, chunked and optionally compressed HDF5 datasets.
+
+        The datasets have the names of single_UE_data_{type}.h5, so the file can be read with data_preprocessing.read_file.
+
+        Args:
+            file_path (str): path of the HDF5 file, an existing file is overwritten
+            chunk_size (int, optional): number of samples per HDF5 chunk. Defaults to 65536.
+            compression (str, optional): h5py compression filter, e.g. "gzip" or "lzf", None for no compression. Defaults to "gzip".
+            compression_opts (int, optional): level of the gzip filter, ignored by the other filters. Defaults to 4.
+            dtype (optional): storage type of the datasets. Defaults to np.float32.
+            attributes (dict, optional): file attributes, e.g. sample frequency, scenario parameters and seed. Defaults to None.
+        """
+        self.file_path = file_path
+        self.num_samples = 0
+        self.data_file = h5py.File(file_path, "w")
+        if compression != "gzip":
+            compression_opts = None
+        self.datasets = dict()
+        for name in ["SINR", "SINR_dB", "Interference_power"]:
+            self.datasets[name] = self.data_file.create_dataset(name=name, shape=(0,), maxshape=(None,), dtype=dtype, \
+                chunks=(chunk_size,), compression=compression, compression_opts=compression_opts)
+        if attributes is not None:
+            self.set_attributes(attributes)
+
+
+    def set_attributes(self, attributes:dict):
+        for key, value in attributes.items():
+            self.data_file.attrs[key] = value
+
+
+    def append(self, sinr:np.ndarray, sinr_dB:np.ndarray, interference_power:np.ndarray):
+        block_length = len(sinr)
+        for name, block in zip(["SINR", "SINR_dB", "Interference_power"], [sinr, sinr_dB, interference_power]):
+            dataset = self.datasets[name]
+            dataset.resize((self.num_samples + block_length,))
+            dataset[self.num_samples:] = block
+        self.num_samples += block_length
+
+
+    def close(self):
+        if self.data_file:
+            self.data_file.attrs["num_samples"] = self.num_samples
+            self.data_file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_sinr_trace(file_path:str, interference_type:str="random", num_samples:int=100000, sample_frequency:float=1000, \
+    interference_speed:float=2, interference_tx_power:float=20, bs_tx_power:float=1000, batch_mobility:bool=True, seed=None, \
+        block_size:int=65536, compression:str="gzip", dtype=np.float32, attributes:dict=None, map_seed:int=None) -> int:
+    """Simulate a SINR trace block by block and stream it to an HDF5 file, the memory only depends on block_size.
+    The scenario parameters and the seed are stored as file attributes together with the given attributes.
+
+    Returns:
+        int: number of written samples
+    """
+    attributes = dict() if attributes is None else dict(attributes)
+    attributes.update({
+        "interference_type": interference_type,
+        "sample_frequency": sample_frequency,
+        "interference_speed": interference_speed,
+        "interference_tx_power": interference_tx_power,
+        "bs_tx_power": bs_tx_power,
+        "batch_mobility": batch_mobility,
+    })
+    if isinstance(seed, np.random.SeedSequence):
+        attributes["seed_entropy"] = str(seed.entropy)
+        attributes["seed_spawn_key"] = list(seed.spawn_key)
+    elif seed is not None:
+        attributes["seed"] = seed
+    if map_seed is not None:
+        attributes["map_seed"] = map_seed
+
+    sinr_blocks = simulate_sinr_blocks(interference_type, num_samples, sample_frequency, interference_speed, interference_tx_power, \
+        bs_tx_power, batch_mobility, seed, show_progress=False, block_size=block_size, map_seed=map_seed)
+    with SINRTraceWriter(file_path, chunk_size=block_size, compression=compression, dtype=dtype, attributes=attributes) as trace_writer:
+        for _, sinr, sinr_dB, interference_power in sinr_blocks:
+            trace_writer.append(sinr, sinr_dB, interference_power)
+        return trace_writer.num_samples
@@ -0,0 +1,102 @@
+import numpy as np
+import os
+import json
+import itertools
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from TraceWriter import write_sinr_trace
+
+
+class SINRScenario:
+    def __init__(self, interference_type:str="random", num_samples:int=100000, sample_frequency:float=1000, \
+        interference_speed:float=2, interference_tx_power:float=20, bs_tx_power:float=1000, repetition:int=0) -> None:
+        self.interference_type = interference_type
+        self.num_samples = num_samples
+        self.sample_frequency = sample_frequency
+        self.interference_speed = interference_speed
+        self.interference_tx_power = interference_tx_power
+        self.bs_tx_power = bs_tx_power
+        self.repetition = repetition            # index of independent realizations of the same parameters
+
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def build_scenario_grid(interference_types:list=["random", "route"], interference_speeds:list=[2], interference_tx_powers:list=[20], \
+    bs_tx_powers:list=[1000], num_repetitions:int=1, num_samples:int=100000, sample_frequency:float=1000) -> list:
+    """Cartesian product of the scenario parameters, every combination is repeated num_repetitions times."""
+    scenario_list = list()
+    for interference_type, speed, tx_power, bs_tx_power, repetition in itertools.product(interference_types, interference_speeds, \
+        interference_tx_powers, bs_tx_powers, range(num_repetitions)):
+        scenario_list.append(SINRScenario(interference_type, num_samples, sample_frequency, speed, tx_power, bs_tx_power, repetition))
+    return scenario_list
+
+
+def simulate_scenario_to_shard(scenario:SINRScenario, seed_sequence:np.random.SeedSequence, shard_path:str, \
+    block_size:int=65536, compression:str="gzip", map_seed:int=None) -> dict:
+    """Worker of the scenario farm: simulate one scenario and stream it to its own HDF5 shard.
+
+    The shard uses the dataset names of single_UE_data_{type}.h5, so it can be read with data_preprocessing.read_file.
+
+    Returns:
+        dict: manifest entry of the shard
+    """
+    write_sinr_trace(shard_path, scenario.interference_type, scenario.num_samples, scenario.sample_frequency, \
+        scenario.interference_speed, scenario.interference_tx_power, scenario.bs_tx_power, batch_mobility=True, \
+            seed=seed_sequence, block_size=block_size, compression=compression, attributes=scenario.to_dict(), \
+                map_seed=map_seed)
+
+    manifest_entry = scenario.to_dict()
+    manifest_entry.update({
+        "file_name": os.path.basename(shard_path),
+        "seed_entropy": str(seed_sequence.entropy),
+        "seed_spawn_key": list(seed_sequence.spawn_key),
+    })
+    return manifest_entry
+
+
+def generate_scenario_farm(scenario_list:list, output_folder:str, seed:int=None, max_workers:int=None, \
+    block_size:int=65536, compression:str="gzip", map_seed:int=None) -> dict:
+    """Simulate many scenarios in parallel and write one HDF5 shard per scenario plus a manifest.json.
+
+    Every scenario gets its own child of np.random.SeedSequence(seed), so the traces are independent and the
+    whole farm is reproducible from seed regardless of the number of workers.
+
+    Args:
+        scenario_list (list): list of SINRScenario, e.g. from build_scenario_grid
+        output_folder (str): folder of the shards and the manifest
+        seed (int, optional): root seed, fresh entropy if None. Defaults to None.
+        max_workers (int, optional): number of processes, os.cpu_count() if None. Defaults to None.
+        block_size (int, optional): samples per simulated block and HDF5 chunk. Defaults to 65536.
+        compression (str, optional): h5py compression filter of the shards. Defaults to "gzip".
+        map_seed (int, optional): share one cached shadowing map between all scenarios, a map per scenario if None. Defaults to None.
+
+    Returns:
+        dict: the manifest that has been written to output_folder/manifest.json
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    root_seed_sequence = np.random.SeedSequence(seed)
+    child_seed_sequences = root_seed_sequence.spawn(len(scenario_list))
+    shard_paths = [os.path.join(output_folder, f"shard_{index:05d}.h5") for index in range(len(scenario_list))]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        worker = partial(simulate_scenario_to_shard, block_size=block_size, compression=compression, map_seed=map_seed)
+        shard_list = list(executor.map(worker, scenario_list, child_seed_sequences, shard_paths))
+
+    manifest = {
+        "root_seed_entropy": str(root_seed_sequence.entropy),
+        "map_seed": map_seed,
+        "datasets": ["SINR", "SINR_dB", "Interference_power"],
+        "shards": shard_list,
+    }
+    with open(os.path.join(output_folder, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    return manifest
+
+
+if __name__ == "__main__":
+    scenario_list = build_scenario_grid(interference_types=["random", "route"], interference_speeds=[1, 2, 5], \
+        interference_tx_powers=[10, 20], num_repetitions=4)
+    generate_scenario_farm(scenario_list, os.path.join("Interference_generation", "interference_data", "scenario_farm"), seed=0)
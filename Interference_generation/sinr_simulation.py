@@ -0,0 +1,198 @@
+import numpy as np
+import random
+from tqdm import tqdm
+
+from ChannelModel import ChannelModel, createMap
+from ShadowingField import ShadowingField
+from Devices import RandomMovingUserEquipment, StaticUserEquipment, BaseStation, RouteMovingUserEquipment
+from SINRSimulator import SINRSimulator
+
+
+def move_sensor(sensor, sample_interval:float):
+    if isinstance(sensor, RandomMovingUserEquipment):
+        return sensor.random_move(sampling_interval=sample_interval)
+    return sensor.move()
+
+
+def collect_trajectories(sensors:list, num_samples:int, sample_interval:float, show_progress:bool=True) -> np.ndarray:
+    """Move the sensors step by step, in the same order as the per-sample simulation loop.
+
+    Returns:
+        np.ndarray: positions of shape (num_sensors, num_samples, 2)
+    """
+    trajectories = np.empty((len(sensors), num_samples, 2), dtype=np.float64)
+    for i in tqdm(range(num_samples), disable=not show_progress):
+        for sensor_index, sensor in enumerate(sensors):
+            trajectories[sensor_index, i] = move_sensor(sensor, sample_interval)
+    return trajectories
+
+
+def generate_trajectories(sensors:list, num_samples:int, sample_interval:float, rng_list:list) -> np.ndarray:
+    """Whole-trajectory version of collect_trajectories, the random directions are drawn from one generator
+    per sensor instead of the random module, so the trajectories differ from the step-by-step ones. With a
+    generator per sensor, consecutive calls give the same trajectories no matter how the samples are split.
+
+    Returns:
+        np.ndarray: positions of shape (num_sensors, num_samples, 2)
+    """
+    return np.stack([sensor.generate_trajectory(num_samples, sample_interval, rng) for sensor, rng in zip(sensors, rng_list)])
+
+
+def create_random_states(seed):
+    """Random states of the simulation derived from seed, the global numpy and random states are never reseeded.
+
+    The np.random.RandomState draws the same numbers as the global numpy state after np.random.seed with the
+    same seed, so the traces of a seed do not change.
+
+    Args:
+        seed (int or np.random.SeedSequence): seed of the simulation, None draws from the global states
+
+    Returns:
+        tuple: random state for createMap and ChannelModel (np.random if seed is None), seed of the random module
+            for the step-by-step mobility (None if seed is None) and a generator for the whole-trajectory mobility
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return np.random.RandomState(seed.generate_state(4)), int(seed.generate_state(1, np.uint64)[0]), np.random.default_rng(seed)
+    if seed is None:
+        return np.random, None, np.random.default_rng()
+    return np.random.RandomState(seed), seed, np.random.default_rng(seed)
+
+
+def linspace_block(stop:float, num:int, start_index:int, end_index:int) -> np.ndarray:
+    """Elements start_index:end_index of np.linspace(0, stop, num), computed without the full array."""
+    time_indices = np.arange(start_index, end_index, dtype=np.float64)
+    if num > 1:
+        time_indices *= stop / (num - 1)
+        if end_index == num:
+            time_indices[-1] = stop
+    return time_indices
+
+
+def simulate_sinr_blocks(interference_type:str="random", num_samples:int=100000, sample_frequency:float=1000, \
+    interference_speed:float=2, interference_tx_power:float=20, bs_tx_power:float=1000, batch_mobility:bool=False, \
+        seed=None, show_progress:bool=True, block_size:int=None, map_seed:int=None):
+    """Simulate the SINR trace of the single UE scenario block by block without plotting or writing files.
+
+    The mobility continues from one block to the next, so the concatenated blocks are the trace of
+    simulate_sinr_trace with the same seed, while the memory only depends on block_size.
+
+    Args:
+        interference_type (str, optional): "random" for randomly moving or "route" for route-moving interferers. Defaults to "random".
+        num_samples (int, optional): length of the trace, an infinite trace if None. Defaults to 100000.
+        sample_frequency (float, optional): sampling frequency in Hz. Defaults to 1000.
+        interference_speed (float, optional): speed of the interferers in m/s. Defaults to 2.
+        interference_tx_power (float, optional): transmit power of every interferer. Defaults to 20.
+        bs_tx_power (float, optional): transmit power of the base station. Defaults to 1000.
+        batch_mobility (bool, optional): use the whole-trajectory generators instead of moving step by step. Defaults to False.
+        seed (int or np.random.SeedSequence, optional): seed of the simulation. Defaults to None.
+        show_progress (bool, optional): show a progress bar for the step-by-step mobility. Defaults to True.
+        block_size (int, optional): number of samples per block, the whole trace in one block if None. Defaults to None.
+        map_seed (int, optional): take the shadowing map from a cached ShadowingField with this seed instead of drawing
+            it from the random state of seed, so several traces share one map. Defaults to None.
+
+    Yields:
+        tuple: time indices, sinr, sinr_dB and interference power of the block, each of shape (block_length,)
+    """
+    random_state, random_seed, rng = create_random_states(seed)
+    if not batch_mobility and random_seed is not None:
+        # random_move of the step-by-step mobility draws from the random module
+        random.seed(random_seed)
+
+    # initialze the moving area
+    x_boundary = np.array([0, 20])
+    y_boundary = np.array([0, 20])
+    sample_interval = 1 / sample_frequency
+
+    # initialize the randomly moving sensors
+    interference_sensor_1 = RandomMovingUserEquipment(tx_power=interference_tx_power, init_x=5, init_y=5, speed=interference_speed, direction=0, x_boundary=x_boundary, y_boundary=y_boundary)
+    interference_sensor_2 = RandomMovingUserEquipment(tx_power=interference_tx_power, init_x=10, init_y=10, speed=interference_speed, direction=0, x_boundary=x_boundary, y_boundary=y_boundary)
+    interference_sensor_3 = RandomMovingUserEquipment(tx_power=interference_tx_power, init_x=10, init_y=10, speed=interference_speed, direction=0, x_boundary=x_boundary, y_boundary=y_boundary)
+
+    # intialize the route-movubg sensors
+    interference_sensor_4 = RouteMovingUserEquipment(tx_power=interference_tx_power, init_x=0, init_y=0, speed_mps=interference_speed, route_type="square", sampling_interval=sample_interval)
+    interference_sensor_5 = RouteMovingUserEquipment(tx_power=interference_tx_power, init_x=0, init_y=10, speed_mps=interference_speed, route_type="circle", sampling_interval=sample_interval)
+
+    # define the UE position (dont move)
+    UE_1 = StaticUserEquipment(tx_power=0, pos_x=25, pos_y=10)
+
+    # define Base station
+    base_station = BaseStation(tx_power=bs_tx_power, pos_x=30, pos_y=15)
+
+    # initialize the channel (unified)
+    map_sigma = 3
+    map_delta = 5
+    map_length = 40
+    map_width = 40
+    map_step_size = 1/20
+    if map_seed is None:
+        shadowing_map = createMap(map_width, map_length, map_sigma, map_delta, map_step_size, random_state=random_state)
+    else:
+        shadowing_map = ShadowingField(map_width, map_length, map_sigma, map_delta, map_step_size, seed=map_seed).map
+
+    # all six channels are created in every case so that the random fading phases do not depend on interference_type
+    channel_1 = ChannelModel(path_loss_factor=2.5, number_paths=10, ue_speed=2, carrier_freq=3e9, shadowing_map=shadowing_map,\
+        delta=map_delta, step_size=map_step_size, map_width=map_width, map_length=map_length, random_state=random_state)
+    channel_2 = ChannelModel(path_loss_factor=2.5, number_paths=10, ue_speed=2, carrier_freq=3e9, shadowing_map=shadowing_map,\
+        delta=map_delta, step_size=map_step_size, map_width=map_width, map_length=map_length, random_state=random_state)
+    channel_3 = ChannelModel(path_loss_factor=2.5, number_paths=10, ue_speed=2, carrier_freq=3e9, shadowing_map=shadowing_map,\
+        delta=map_delta, step_size=map_step_size, map_width=map_width, map_length=map_length, random_state=random_state)
+    channel_4 = ChannelModel(path_loss_factor=2.5, number_paths=10, ue_speed=2, carrier_freq=3e9, shadowing_map=shadowing_map,\
+        delta=map_delta, step_size=map_step_size, map_width=map_width, map_length=map_length, random_state=random_state)
+    channel_5 = ChannelModel(path_loss_factor=2.5, number_paths=10, ue_speed=2, carrier_freq=3e9, shadowing_map=shadowing_map,\
+        delta=map_delta, step_size=map_step_size, map_width=map_width, map_length=map_length, random_state=random_state)
+    channel_BS = ChannelModel(path_loss_factor=2.5, number_paths=10, ue_speed=2, carrier_freq=3e9, shadowing_map=shadowing_map,\
+        delta=map_delta, step_size=map_step_size, map_width=map_width, map_length=map_length, random_state=random_state)
+
+    if num_samples is not None:
+        durarion = num_samples * sample_interval
+
+    UE_position = np.array([UE_1.position_x, UE_1.position_y])
+    BS_position = np.array([base_station.position_x, base_station.position_y])
+
+    if interference_type == "random":
+        interference_sensors = [interference_sensor_1, interference_sensor_2, interference_sensor_3]
+        interference_channels = [channel_1, channel_2, channel_3]
+    elif interference_type == "route":
+        interference_sensors = [interference_sensor_4, interference_sensor_5]
+        interference_channels = [channel_4, channel_5]
+    else:
+        raise ValueError("Invalid interference_type. Supported types: 'random' or 'route'.")
+    tx_powers = np.array([sensor.tx_power for sensor in interference_sensors])
+    sensor_rng_list = rng.spawn(len(interference_sensors))
+
+    noise_power = 1
+    simulator = SINRSimulator(interference_channels, channel_BS, noise_power)
+
+    if block_size is None:
+        if num_samples is None:
+            raise ValueError("block_size is required for an infinite trace.")
+        block_size = num_samples
+    block_start = 0
+    while num_samples is None or block_start < num_samples:
+        if num_samples is None:
+            block_end = block_start + block_size
+            time_indicies = np.arange(block_start, block_end, dtype=np.float64) * sample_interval
+        else:
+            block_end = min(block_start + block_size, num_samples)
+            time_indicies = linspace_block(durarion, num_samples, block_start, block_end)
+        if batch_mobility:
+            trajectories = generate_trajectories(interference_sensors, block_end - block_start, sample_interval, sensor_rng_list)
+        else:
+            trajectories = collect_trajectories(interference_sensors, block_end - block_start, sample_interval, show_progress)
+        sinr, sinr_dB, interference_power = simulator.simulate(UE_position, trajectories, tx_powers, BS_position, \
+            base_station.tx_power, time_indicies)
+        yield time_indicies, sinr, sinr_dB, interference_power
+        block_start = block_end
+
+
+def simulate_sinr_trace(interference_type:str="random", num_samples:int=100000, sample_frequency:float=1000, \
+    interference_speed:float=2, interference_tx_power:float=20, bs_tx_power:float=1000, batch_mobility:bool=False, \
+        seed=None, show_progress:bool=True, map_seed:int=None):
+    """Simulate the whole SINR trace of the single UE scenario at once, see simulate_sinr_blocks for the arguments.
+
+    Returns:
+        tuple: time indices, sinr, sinr_dB and interference power, each of shape (num_samples,)
+    """
+    block_list = list(simulate_sinr_blocks(interference_type, num_samples, sample_frequency, interference_speed, \
+        interference_tx_power, bs_tx_power, batch_mobility, seed, show_progress, map_seed=map_seed))
+    return tuple(np.concatenate(arrays) for arrays in zip(*block_list))
@@ -1,5 +1,66 @@
 import numpy as np
+import tensorflow as tf
 import h5py
+import os
+import shutil
+import hashlib
+
+
+# on-disk cache of prepare_data with a seed, and the splits already loaded in this process
+PREPARED_DATA_CACHE_FOLDER = os.path.join("Interference_generation", "interference_data", "prepared_data_cache")
+PREPARED_DATA_NAMES = ["x_train", "y_train", "x_test", "y_test", "test_sinr_sequence"]
+prepared_data_registry = dict()
+
+
+class SINRFileReader:
+    def __init__(self, file_path:str, use_memmap:bool=True) -> None:
+        """Lazy reader of the SINR, SINR_dB and Interference_power datasets of a data file.
+
+        Nothing is read when the file is opened. A contiguous, uncompressed dataset is mapped with np.memmap,
+        so only the touched pages are loaded and the map stays valid after the file is closed. Chunked or
+        compressed datasets (e.g. written by TraceWriter) are read by h5py slice by slice. Use the reader as
+        a context manager or call close to release the file handle.
+
+        Args:
+            file_path (str): path of the data file
+            use_memmap (bool, optional): map contiguous uncompressed datasets with np.memmap. Defaults to True.
+        """
+        self.file_path = file_path
+        self.use_memmap = use_memmap
+        self.data_file = h5py.File(file_path, "r")
+
+
+    def get_dataset(self, name:str):
+        """Lazy dataset, a np.memmap if the dataset can be mapped and the h5py dataset otherwise, both support slicing."""
+        dataset = self.data_file[name]
+        if self.use_memmap and dataset.chunks is None and dataset.compression is None and dataset.id.get_offset() is not None:
+            return np.memmap(self.file_path, mode="r", dtype=dataset.dtype, shape=dataset.shape, offset=dataset.id.get_offset())
+        return dataset
+
+
+    def __getitem__(self, name:str):
+        return self.get_dataset(name)
+
+
+    def get_length(self, name:str="SINR_dB") -> int:
+        return self.data_file[name].shape[0]
+
+
+    def read(self, name:str, start:int=None, stop:int=None) -> np.ndarray:
+        """Samples start:stop of a dataset, a view into the memory map or an array read from the file."""
+        return self.get_dataset(name)[start:stop]
+
+
+    def close(self):
+        self.data_file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 def read_file(file_path:str):
@@ -10,90 +71,246 @@ def read_file(file_path:str):
         file_path (str): the path of file containing interfernce and sinr data
 
     Returns:
+        tuple: sinr, sinr in dB and interference power sequences
     """
     
     # start of the code
-    data_file = h5py.File(file_path, "r")
-    sinr_data = np.array(data_file.get("SINR"))
-    sinr_dB_data = np.array(data_file.get("SINR_dB"))
-    interference_data = np.array(data_file.get("Interference_power"))
+    with SINRFileReader(file_path) as reader:
+        sinr_data = np.array(reader.read("SINR"))
+        sinr_dB_data = np.array(reader.read("SINR_dB"))
+        interference_data = np.array(reader.read("Interference_power"))
     return sinr_data, sinr_dB_data, interference_data
 
 
-def preprocess_train(original_data:np.array, num_inputs:int, num_outputs:int, shuffle_samples:bool=False) -> np.ndarray:
-    """ start of the code"""
-    
+def sliding_windows(original_data:np.array, window_length:int, stride:int=1) -> np.ndarray:
+    """Read-only view of the windows original_data[i*stride : i*stride + window_length], no sample is copied.
+
+    Returns:
+        np.ndarray: view of shape (num_windows, window_length) into original_data
+    """
+    original_data = np.asarray(original_data)
+    if np.shape(original_data)[0] < window_length:
+        return np.empty((0, window_length), dtype=original_data.dtype)
+    return np.lib.stride_tricks.sliding_window_view(original_data, window_length)[::stride]
+
+
+def select_samples(data_sample:np.ndarray, shuffle_samples:bool, materialize:bool, random_state=None):
+    if not shuffle_samples:
+        return np.array(data_sample) if materialize else data_sample
+    if random_state is None:
+        random_state = np.random
+    random_indices = random_state.permutation(data_sample.shape[0])
+    if materialize:
+        # gathering the windows in permutation order is the only copy
+        return data_sample[random_indices]
+    return data_sample, random_indices
+
+
+def preprocess_train(original_data:np.array, num_inputs:int, num_outputs:int, shuffle_samples:bool=False, materialize:bool=False, \
+    random_state=None):
+    """Every window of num_inputs + num_outputs consecutive samples, shape (num_samples, num_inputs + num_outputs).
+
+    The windows are a read-only strided view into original_data, so windowing needs no memory beyond the sequence
+    itself. With shuffle_samples the view is returned together with a np.random.permutation of the window indices,
+    windows[permutation[i]] is the i-th shuffled window, e.g. to gather the windows per batch like make_dataset.
+    Set materialize to get a writable copy instead, the windows in permutation order with shuffle_samples, e.g.
+    before modifying them in place or passing them to fit. random_state is a np.random.RandomState for the
+    permutation instead of the global numpy state.
+
+    Returns:
+        np.ndarray or tuple: the windows, or the view of the windows and the permutation for shuffle_samples without materialize
+    """
     sliding_window_length = num_inputs + num_outputs
-    data_length = np.shape(original_data)[0]
-    num_samples = data_length - sliding_window_length + 1
-    data_sample_list = list()
-    for i in range(num_samples):
-        data_sample_list.append(original_data[i:i+sliding_window_length])
-    data_sample = np.array(data_sample_list)
-    if shuffle_samples:
-        random_indices = np.random.permutation(data_sample.shape[0])
-        data_sample = data_sample[random_indices]
-    return data_sample
+    data_sample = sliding_windows(original_data, sliding_window_length)
+    return select_samples(data_sample, shuffle_samples, materialize, random_state)
 
 
-def preprocess_test(original_data:np.array, num_inputs:int, num_outputs:int, shuffle_samples:bool=False) -> np.ndarray:     
+def preprocess_test(original_data:np.array, num_inputs:int, num_outputs:int, shuffle_samples:bool=False, materialize:bool=False):
+    """Windows of num_inputs + num_outputs samples that start every num_outputs samples, so the targets of
+    consecutive windows do not overlap. Views, shuffling and materialize work as in preprocess_train.
+    """
     sliding_window_length = num_inputs + num_outputs
     data_length = np.shape(original_data)[0]
-    num_samples = int((data_length - num_inputs)/num_outputs)
-    data_sample_list = list()
-    for i in range(num_samples):
-        data_sample_list.append(original_data[i*num_outputs: i*num_outputs + sliding_window_length])
-    data_sample = np.array(data_sample_list)
-    if shuffle_samples:
-        random_indices = np.random.permutation(data_sample.shape[0])
-        data_sample = data_sample[random_indices]
-    return data_sample
+    num_samples = max(int((data_length - num_inputs)/num_outputs), 0)
+    data_sample = sliding_windows(original_data, sliding_window_length, stride=num_outputs)[:num_samples]
+    return select_samples(data_sample, shuffle_samples, materialize)
     
 
 def preprocess_encoder_decoder_test(data_sample:np.array, starting_buffer:np.array, num_input:int, num_output:int):
-    num_samples = np.shape(data_sample)[0]
-    new_samples = list()
-    for i in range(num_samples):
-        if i == 0:
-            extend_part = starting_buffer
-        else:
-            extend_part = data_sample[i-1,-(num_output-1):]
-        extended_sample = np.concatenate((extend_part, data_sample[i,:]), axis=0)
-        new_samples.append(extended_sample)
-    return np.array(new_samples)
+    """Prepend the last num_output - 1 samples of the previous window (starting_buffer for the first one) to every window."""
+    previous_parts = np.concatenate((np.asarray(starting_buffer)[np.newaxis], data_sample[:-1, -(num_output-1):]), axis=0)
+    return np.concatenate((previous_parts, data_sample), axis=1)
 
     
-def prepare_data(num_inputs, num_outputs, data_type:str="default"):
+def get_data_file_path(data_type:str="default") -> str:
     if data_type == "default":
-        data_file_path = "Interference_generation/interference_data/single_UE_data.h5"
+        return "Interference_generation/interference_data/single_UE_data.h5"
     elif data_type == "route":
-        data_file_path = "Interference_generation/interference_data/single_UE_data_route.h5"
+        return "Interference_generation/interference_data/single_UE_data_route.h5"
     elif data_type == "random":
-        data_file_path = "Interference_generation/interference_data/single_UE_data_random.h5"
-    
-    
-    sinr_sequence, sinr_dB_sequence, interference_sequence = read_file(data_file_path)
-    
-    # Use sinr sequence to train model
-    sequence_length = np.shape(sinr_dB_sequence)[0]
-    num_train = int(0.8*sequence_length)
-    
-    train_sinr_sequence, test_sinr_sequence = sinr_dB_sequence[:num_train], sinr_dB_sequence[num_train:]
-    train_samples = preprocess_train(train_sinr_sequence, num_inputs=num_inputs, num_outputs=num_outputs, shuffle_samples=True)
-    x_train, y_train = train_samples[:, :num_inputs], train_samples[:, num_inputs:]
-    x_train = np.expand_dims(x_train, axis=-1)
+        return "Interference_generation/interference_data/single_UE_data_random.h5"
+    raise ValueError("Invalid data_type. Supported types: 'default', 'route' or 'random'.")
+
+
+def load_sinr_sequences(data_type:str="default"):
+    """SINR_dB sequence of the data file split into the first 80% for training and the rest for testing.
+    Only SINR_dB is read, for a contiguous dataset both parts are views into a read-only memory map."""
+    with SINRFileReader(get_data_file_path(data_type)) as reader:
+        sequence_length = reader.get_length("SINR_dB")
+        num_train = int(0.8*sequence_length)
+        return reader.read("SINR_dB", stop=num_train), reader.read("SINR_dB", start=num_train)
+
+
+def prepare_test_data(num_inputs, num_outputs, data_type:str="default", test_sinr_sequence:np.ndarray=None):
+    """Test windows of prepare_data without building the training windows, x_test and y_test are views."""
+    if test_sinr_sequence is None:
+        _, test_sinr_sequence = load_sinr_sequences(data_type)
     test_samples = preprocess_test(test_sinr_sequence, num_inputs=num_inputs, num_outputs=num_outputs, shuffle_samples=False)
     x_test, y_test = test_samples[:, :num_inputs], test_samples[:, num_inputs:]
     x_test = np.expand_dims(x_test, axis=-1)
+    return x_test, y_test, test_sinr_sequence
+
+
+def window_variance(sinr_sequence:np.ndarray, num_inputs:int, num_outputs:int) -> float:
+    """np.var of the input windows of preprocess_train, computed from the sequence with the number of windows
+    every sample appears in, so the windows are never built."""
+    num_samples = np.shape(sinr_sequence)[0] - (num_inputs + num_outputs) + 1
+    counts = np.convolve(np.ones(num_samples), np.ones(num_inputs))
+    covered_sequence = np.asarray(sinr_sequence, dtype=np.float64)[:len(counts)]
+    mean = np.sum(counts*covered_sequence) / np.sum(counts)
+    return np.sum(counts*(covered_sequence - mean)**2) / np.sum(counts)
+
+
+def make_dataset(num_inputs:int, num_outputs:int, data_type:str="default", batch_size:int=64, validation_split:float=0.0, \
+    shuffle_samples:bool=True, targets:str="outputs", expand_dims:bool=True, seed:int=None, sinr_sequence:np.ndarray=None):
+    """Windowed, shuffled, batched and prefetched tf.data pipeline over the training part of a SINR sequence.
+
+    The dataset holds the raw sequence and the start index of every window, each batch gathers its windows from
+    the sequence, so the windows of all samples are never in memory at the same time. Like validation_split in fit
+    on the arrays of prepare_data, the validation set is the last part of the shuffled windows; it is split off
+    as a second dataset, and only the training dataset is reshuffled every epoch.
+
+    Args:
+        num_inputs (int): length of the input window x
+        num_outputs (int): length of the target window y
+        data_type (str, optional): data file, see prepare_data. Defaults to "default".
+        batch_size (int, optional): number of windows per batch. Defaults to 64.
+        validation_split (float, optional): fraction of the windows in the validation dataset. Defaults to 0.0.
+        shuffle_samples (bool, optional): shuffle the windows. Defaults to True.
+        targets (str, optional): "outputs" for (x, y), "inputs" for (x, x) of autoencoders or None for x only. Defaults to "outputs".
+        expand_dims (bool, optional): add the trailing feature axis of prepare_data to x. Defaults to True.
+        seed (int, optional): seed of the split and the shuffling. Defaults to None.
+        sinr_sequence (np.ndarray, optional): training sequence to use instead of the one of data_type. Defaults to None.
+
+    Returns:
+        tuple: training dataset and validation dataset, the latter is None without validation_split
+    """
+    if targets not in ["outputs", "inputs", None]:
+        raise ValueError("Invalid targets. Supported targets: 'outputs', 'inputs' or None.")
+    if sinr_sequence is None:
+        sinr_sequence, _ = load_sinr_sequences(data_type)
+    sliding_window_length = num_inputs + num_outputs
+    num_samples = max(np.shape(sinr_sequence)[0] - sliding_window_length + 1, 0)
+
+    if shuffle_samples:
+        sample_indices = np.random.default_rng(seed).permutation(num_samples)
+    else:
+        sample_indices = np.arange(num_samples)
+    num_train = num_samples - int(validation_split*num_samples)
+
+    # fit casts float64 arrays to floatx, a dataset has to be cast here
+    sequence = tf.constant(sinr_sequence, dtype=tf.keras.backend.floatx())
+    window_offsets = tf.range(sliding_window_length, dtype=tf.int64)
+
+    def gather_windows(indices):
+        windows = tf.gather(sequence, indices[:, tf.newaxis] + window_offsets)
+        x, y = windows[:, :num_inputs], windows[:, num_inputs:]
+        if expand_dims:
+            x = x[..., tf.newaxis]
+        if targets == "outputs":
+            return x, y
+        if targets == "inputs":
+            return x, x
+        return x
+
+    def build_dataset(indices, shuffle):
+        dataset = tf.data.Dataset.from_tensor_slices(indices.astype(np.int64))
+        if shuffle:
+            dataset = dataset.shuffle(len(indices), seed=seed, reshuffle_each_iteration=True)
+        return dataset.batch(batch_size).map(gather_windows, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+    train_dataset = build_dataset(sample_indices[:num_train], shuffle_samples)
+    validation_dataset = build_dataset(sample_indices[num_train:], False) if num_train < num_samples else None
+    return train_dataset, validation_dataset
+
+
+def build_prepared_data(num_inputs, num_outputs, data_type:str="default", seed:int=None, shuffle_samples:bool=True):
+    train_sinr_sequence, test_sinr_sequence = load_sinr_sequences(data_type)
+    random_state = None if seed is None else np.random.RandomState(seed)
+    # the shuffled training windows are the arrays fit needs, only they are copied, unshuffled ones stay views
+    train_samples = preprocess_train(train_sinr_sequence, num_inputs=num_inputs, num_outputs=num_outputs, shuffle_samples=shuffle_samples, \
+        materialize=shuffle_samples, random_state=random_state)
+    x_train, y_train = train_samples[:, :num_inputs], train_samples[:, num_inputs:]
+    x_train = np.expand_dims(x_train, axis=-1)
+    x_test, y_test, _ = prepare_test_data(num_inputs, num_outputs, test_sinr_sequence=test_sinr_sequence)
     return x_train, y_train, x_test, y_test, test_sinr_sequence
 
 
+def get_prepared_data_key(data_file_path:str, num_inputs, num_outputs, data_type:str, seed:int) -> str:
+    file_stat = os.stat(data_file_path)
+    key = (os.path.abspath(data_file_path), file_stat.st_size, file_stat.st_mtime_ns, num_inputs, num_outputs, data_type, seed)
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+
+def prepare_data(num_inputs, num_outputs, data_type:str="default", seed:int=None, cache_folder:str=PREPARED_DATA_CACHE_FOLDER, \
+    shuffle_samples:bool=True):
+    """Windows of the data file: shuffled training windows, test windows and the test sequence.
+
+    The shuffled training windows are the one copy of the windows, for fit on arrays. With shuffle_samples=False
+    x_train and y_train are views in sequence order and nothing is cached, for callers that only need the test data
+    or shuffle themselves; make_dataset feeds fit without building the training windows at all.
+
+    Without a seed the training windows are shuffled with the global numpy state on every call. With a seed the
+    result is memoized: the first call for a (file, file size and mtime, num_inputs, num_outputs, data_type, seed)
+    writes the arrays as .npy files to cache_folder, later calls of any process return read-only memory-mapped
+    arrays of these files, which share their pages, and repeated calls in a process return the same arrays.
+    A changed data file gets a new key, so a stale cache is never read.
+
+    Returns:
+        tuple: x_train, y_train, x_test, y_test and test_sinr_sequence
+    """
+    if seed is None or cache_folder is None or not shuffle_samples:
+        return build_prepared_data(num_inputs, num_outputs, data_type, seed, shuffle_samples)
+
+    key = get_prepared_data_key(get_data_file_path(data_type), num_inputs, num_outputs, data_type, seed)
+    if key in prepared_data_registry:
+        return prepared_data_registry[key]
+
+    cache_path = os.path.join(cache_folder, f"prepared_data_{key}")
+    if not os.path.isdir(cache_path):
+        prepared_data = build_prepared_data(num_inputs, num_outputs, data_type, seed)
+        # write to a temporary folder and rename it, so other processes never see a partial cache
+        temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+        os.makedirs(temporary_path, exist_ok=True)
+        for name, array in zip(PREPARED_DATA_NAMES, prepared_data):
+            np.save(os.path.join(temporary_path, f"{name}.npy"), array)
+        try:
+            os.replace(temporary_path, cache_path)
+        except OSError:
+            # another process has written the same cache in the meantime
+            shutil.rmtree(temporary_path, ignore_errors=True)
+
+    prepared_data = tuple(np.load(os.path.join(cache_path, f"{name}.npy"), mmap_mode="r") for name in PREPARED_DATA_NAMES)
+    prepared_data_registry[key] = prepared_data
+    return prepared_data
+
+
 def prepare_data_for_encoder_decoder_test(num_inputs, num_outputs):
     data_file_path = "Interference_generation/interference_data/single_UE_data.h5"
-    _, sinr_dB_sequence, _ = read_file(data_file_path)
-    test_sinr_sequence = sinr_dB_sequence[8000:]
+    with SINRFileReader(data_file_path) as reader:
+        test_sinr_sequence = reader.read("SINR_dB", start=8000)
+        previous_cache = reader.read("SINR_dB", start=8000 - (num_outputs - 1), stop=8000)
     normal_data_samples = preprocess_test(test_sinr_sequence, num_inputs=num_inputs, num_outputs=num_outputs, shuffle_samples=False)
-    previous_cache = sinr_dB_sequence[8000 - (num_outputs - 1): 8000]
     extended_data_samples = preprocess_encoder_decoder_test(normal_data_samples, previous_cache, num_inputs, num_outputs)
     return extended_data_samples
     
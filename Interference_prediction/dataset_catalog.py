@@ -0,0 +1,248 @@
+import numpy as np
+import tensorflow as tf
+import json
+import os
+
+from Interference_prediction.data_preprocessing import SINRFileReader, get_data_file_path
+from Interference_prediction.window_sampler import create_split_samplers
+
+
+class DatasetCatalog:
+    def __init__(self, shard_list:list) -> None:
+        """Index of many SINR data files (shards) that are used together without concatenating them.
+
+        Every shard is a dict with the file_path, the length of its sequences, the sample_frequency (None if unknown)
+        and a dict of scenario tags, e.g. interference_type and interference_speed. The index is built once with
+        from_files, from_manifest or from_data_types and can be saved to and loaded from a json file.
+
+        Args:
+            shard_list (list): list of shard dicts
+        """
+        self.shard_list = list(shard_list)
+
+
+    @classmethod
+    def from_files(cls, file_paths:list, tag_list:list=None):
+        """Index data files, the length is read from the file and the file attributes (e.g. of TraceWriter) become the tags.
+
+        Args:
+            file_paths (list): paths of the data files
+            tag_list (list, optional): additional tags of every file. Defaults to None.
+        """
+        if tag_list is None:
+            tag_list = [dict() for _ in file_paths]
+        shard_list = list()
+        for file_path, tags in zip(file_paths, tag_list):
+            with SINRFileReader(file_path) as reader:
+                length = reader.get_length()
+                attributes = {key: value.tolist() if isinstance(value, (np.generic, np.ndarray)) else value for key, value in reader.data_file.attrs.items()}
+            attributes.pop("num_samples", None)
+            attributes.update(tags)
+            sample_frequency = attributes.pop("sample_frequency", None)
+            shard_list.append(dict(file_path=file_path, length=length, sample_frequency=sample_frequency, tags=attributes))
+        return cls(shard_list)
+
+
+    @classmethod
+    def from_manifest(cls, folder:str):
+        """Index the shards of a scenario farm from its manifest.json, the scenario parameters become the tags."""
+        with open(os.path.join(folder, "manifest.json"), "r") as manifest_file:
+            manifest = json.load(manifest_file)
+        shard_list = list()
+        for manifest_entry in manifest["shards"]:
+            tags = dict(manifest_entry)
+            file_path = os.path.join(folder, tags.pop("file_name"))
+            length = tags.pop("num_samples")
+            sample_frequency = tags.pop("sample_frequency")
+            shard_list.append(dict(file_path=file_path, length=length, sample_frequency=sample_frequency, tags=tags))
+        return cls(shard_list)
+
+
+    @classmethod
+    def from_data_types(cls, data_types:list=["default", "route", "random"]):
+        """Index the data files of prepare_data, tagged with their data_type."""
+        return cls.from_files([get_data_file_path(data_type) for data_type in data_types], \
+            [dict(data_type=data_type) for data_type in data_types])
+
+
+    @classmethod
+    def load(cls, file_path:str):
+        with open(file_path, "r") as catalog_file:
+            return cls(json.load(catalog_file)["shards"])
+
+
+    def save(self, file_path:str):
+        with open(file_path, "w") as catalog_file:
+            json.dump({"shards": self.shard_list}, catalog_file, indent=4)
+
+
+    def __len__(self) -> int:
+        return len(self.shard_list)
+
+
+    def select(self, **tag_values):
+        """Shards whose tags match all given values, a list of values matches any of them.
+
+        Example: catalog.select(interference_type="route", interference_speed=[1, 2])
+        """
+        def matches(shard:dict) -> bool:
+            for key, value in tag_values.items():
+                accepted_values = value if isinstance(value, (list, tuple, set)) else [value]
+                if shard["tags"].get(key) not in accepted_values:
+                    return False
+            return True
+        return DatasetCatalog([shard for shard in self.shard_list if matches(shard)])
+
+
+    def create_split_samplers(self, num_inputs:int, num_outputs:int, weights:list=None, train_fraction:float=0.8, batch_size:int=64, \
+        seed=None, **sampler_kwargs):
+        """Mixed samplers of the training and the test parts, every shard is split into train and test separately.
+
+        Args:
+            num_inputs (int): length of the input window x
+            num_outputs (int): length of the target window y
+            weights (list, optional): mixing weight of every shard, proportional to the number of windows if None. Defaults to None.
+            train_fraction (float, optional): training part of every shard. Defaults to 0.8.
+            batch_size (int, optional): number of windows per mixed batch. Defaults to 64.
+            seed (int, optional): seed of the shuffling and the mixing. Defaults to None.
+            sampler_kwargs: further arguments of BlockShuffleWindowSampler, e.g. block_size or blocks_per_chunk
+
+        Returns:
+            tuple: MixedWindowSampler of the training parts and of the test parts
+        """
+        if len(self.shard_list) == 0:
+            raise ValueError("The catalog has no shards.")
+        train_seed, test_seed, *shard_seeds = np.random.SeedSequence(seed).spawn(2 + len(self.shard_list))
+        train_samplers, test_samplers = list(), list()
+        for shard, shard_seed in zip(self.shard_list, shard_seeds):
+            train_sampler, test_sampler = create_split_samplers(shard["file_path"], num_inputs, num_outputs, train_fraction, \
+                batch_size=batch_size, seed=shard_seed, **sampler_kwargs)
+            train_samplers.append(train_sampler)
+            test_samplers.append(test_sampler)
+        return MixedWindowSampler(train_samplers, weights, batch_size, train_seed), MixedWindowSampler(test_samplers, weights, batch_size, test_seed)
+
+
+class MixedWindowSampler:
+    def __init__(self, samplers:list, weights:list=None, batch_size:int=64, seed=None) -> None:
+        """Batches that mix the windows of several BlockShuffleWindowSampler shards with fixed weights.
+
+        The number of windows a batch takes from every shard is drawn from a multinomial distribution with the
+        weights. Every shard keeps its own reader and background thread and restarts its epoch when it runs out,
+        so all shards are read in parallel and interleaved. Without weights, a shard is weighted with its number of
+        windows, which is the distribution of one concatenated sequence. An epoch has as many windows as all shards.
+
+        Args:
+            samplers (list): BlockShuffleWindowSampler of every shard
+            weights (list, optional): mixing weight of every shard. Defaults to None.
+            batch_size (int, optional): number of windows per batch. Defaults to 64.
+            seed (int, optional): seed of the mixing. Defaults to None.
+        """
+        self.samplers = samplers
+        self.num_inputs = samplers[0].num_inputs
+        self.num_outputs = samplers[0].num_outputs
+        self.window_length = self.num_inputs + self.num_outputs
+        self.num_windows = sum(sampler.num_windows for sampler in samplers)
+        if weights is None:
+            weights = [sampler.num_windows for sampler in samplers]
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(weights) != len(samplers) or np.any(weights < 0) or weights.sum() == 0:
+            raise ValueError("Expected one non-negative weight per shard with a positive sum.")
+        if any(weight > 0 and sampler.num_windows == 0 for weight, sampler in zip(weights, samplers)):
+            raise ValueError("Shards without windows must have the weight 0.")
+        self.weights = weights / weights.sum()
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.shard_streams = [None] * len(samplers)
+        self.pending_windows = [np.empty((0, self.window_length), dtype=sampler.dtype) for sampler in samplers]
+
+
+    def __len__(self) -> int:
+        """Number of batches per epoch."""
+        return -(-self.num_windows // self.batch_size)
+
+
+    def generate_shard_windows(self, sampler):
+        while True:
+            for x_batch, y_batch in sampler.iter_windows():
+                yield np.concatenate((x_batch, y_batch), axis=1)
+
+
+    def take_shard_windows(self, shard_index:int, num_windows:int) -> np.ndarray:
+        if self.shard_streams[shard_index] is None:
+            self.shard_streams[shard_index] = self.generate_shard_windows(self.samplers[shard_index])
+        window_list = [self.pending_windows[shard_index]]
+        num_available = len(window_list[0])
+        while num_available < num_windows:
+            window_list.append(next(self.shard_streams[shard_index]))
+            num_available += len(window_list[-1])
+        windows = np.concatenate(window_list)
+        self.pending_windows[shard_index] = windows[num_windows:]
+        return windows[:num_windows]
+
+
+    def take_mixed_windows(self, num_windows:int) -> np.ndarray:
+        shard_counts = self.rng.multinomial(num_windows, self.weights)
+        windows = np.concatenate([self.take_shard_windows(shard_index, count) for shard_index, count in enumerate(shard_counts) if count > 0])
+        return windows[self.rng.permutation(num_windows)]
+
+
+    def iter_windows(self):
+        """One epoch of mixed (x, y) batches, x of shape (batch_size, num_inputs) and y of shape (batch_size, num_outputs)."""
+        for batch_start in range(0, self.num_windows, self.batch_size):
+            windows = self.take_mixed_windows(min(self.batch_size, self.num_windows - batch_start))
+            yield windows[:, :self.num_inputs], windows[:, self.num_inputs:]
+
+
+    def __iter__(self):
+        return self.iter_windows()
+
+
+    def take_windows(self, num_windows:int):
+        """Next num_windows mixed windows.
+
+        Returns:
+            tuple: x of shape (num_windows, num_inputs) and y of shape (num_windows, num_outputs)
+        """
+        windows = self.take_mixed_windows(num_windows)
+        return windows[:, :self.num_inputs], windows[:, self.num_inputs:]
+
+
+    def as_dataset(self, inputs_only:bool=False, expand_dims:bool=False) -> tf.data.Dataset:
+        """tf.data.Dataset of the mixed batches, every iteration is a new epoch, see BlockShuffleWindowSampler.as_dataset."""
+        dtype = tf.as_dtype(self.samplers[0].dtype)
+        x_shape = (None, self.num_inputs, 1) if expand_dims else (None, self.num_inputs)
+        x_spec = tf.TensorSpec(shape=x_shape, dtype=dtype)
+        y_spec = tf.TensorSpec(shape=(None, self.num_outputs), dtype=dtype)
+
+        def generate_batches():
+            for x_batch, y_batch in self.iter_windows():
+                if expand_dims:
+                    x_batch = x_batch[..., np.newaxis]
+                yield x_batch if inputs_only else (x_batch, y_batch)
+
+        output_signature = x_spec if inputs_only else (x_spec, y_spec)
+        return tf.data.Dataset.from_generator(generate_batches, output_signature=output_signature).prefetch(tf.data.AUTOTUNE)
+
+
+    def calculate_input_variance(self) -> float:
+        """Variance of the inputs under the mixing weights, from the exact moments of every shard."""
+        moments = np.array([sampler.calculate_input_moments() if weight > 0 else (0.0, 0.0) \
+            for sampler, weight in zip(self.samplers, self.weights)])
+        mean, mean_square = self.weights @ moments
+        return mean_square - mean**2
+
+
+    def read_test_windows(self, num_windows:int) -> np.ndarray:
+        """Leading test windows of every shard (see BlockShuffleWindowSampler.read_test_windows), num_windows are split
+        over the shards by the weights."""
+        shard_counts = np.floor(self.weights * num_windows).astype(np.int64)
+        shard_counts[np.argsort(-self.weights)[:num_windows - shard_counts.sum()]] += 1
+        return np.concatenate([sampler.read_test_windows(count) for sampler, count in zip(self.samplers, shard_counts) if count > 0])
+
+
+    def close(self):
+        for shard_stream in self.shard_streams:
+            if shard_stream is not None:
+                shard_stream.close()
+        for sampler in self.samplers:
+            sampler.close()
@@ -0,0 +1,207 @@
+import numpy as np
+import tensorflow as tf
+import threading
+import queue
+import os
+import sys
+
+from Interference_prediction.data_preprocessing import load_sinr_sequences, make_dataset, prepare_test_data, window_variance
+
+
+def prefetch_in_background(iterable, num_prefetch:int=1):
+    """Iterate over iterable in a daemon thread that keeps up to num_prefetch items ready.
+
+    Exceptions of the thread are raised by the consumer, closing the returned generator stops the thread.
+    """
+    item_queue = queue.Queue(maxsize=num_prefetch)
+    stop_event = threading.Event()
+    end_of_data = object()
+
+    def put(item):
+        while not stop_event.is_set():
+            try:
+                item_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((end_of_data, None))
+        except Exception as error:
+            put((None, error))
+
+    def consumer():
+        try:
+            while True:
+                item, error = item_queue.get()
+                if error is not None:
+                    raise error
+                if item is end_of_data:
+                    return
+                yield item
+        finally:
+            stop_event.set()
+
+    # the thread starts right away, so the first items are ready before they are requested
+    threading.Thread(target=producer, daemon=True).start()
+    return consumer()
+
+
+class OnlineSINRWindowSource:
+    def __init__(self, num_inputs:int, num_outputs:int, interference_type:str="random", seed=None, block_size:int=65536, \
+        shuffle:bool=True, num_prefetch:int=1, sample_frequency:float=1000, interference_speed:float=2, \
+            interference_tx_power:float=20, bs_tx_power:float=1000, dtype=np.float32) -> None:
+        """Endless source of (x, y) SINR_dB windows simulated on the fly, as an alternative to the data files
+        that needs no pre-generated file and never repeats a window.
+
+        The single UE scenario of sinr_simulation is simulated block by block with the whole-trajectory mobility,
+        every block is cut into sliding windows (the last num_inputs + num_outputs - 1 samples are carried to the
+        next block) and optionally shuffled within the block. The next blocks are simulated in a background thread,
+        so the memory only depends on block_size and num_prefetch.
+
+        Args:
+            num_inputs (int): length of the input window x
+            num_outputs (int): length of the target window y
+            interference_type (str, optional): "random" or "route", see simulate_sinr_blocks. Defaults to "random".
+            seed (int or np.random.SeedSequence, optional): seed of the simulation and the shuffling. Defaults to None.
+            block_size (int, optional): number of simulated samples per block. Defaults to 65536.
+            shuffle (bool, optional): shuffle the windows within every block. Defaults to True.
+            num_prefetch (int, optional): number of blocks simulated ahead. Defaults to 1.
+            dtype (optional): type of the windows. Defaults to np.float32.
+        """
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        self.window_length = num_inputs + num_outputs
+        self.shuffle = shuffle
+        self.dtype = dtype
+
+        # the simulation stack is only loaded when an online source is used, importing this module does not need it
+        simulation_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Interference_generation")
+        if simulation_folder not in sys.path:
+            sys.path.append(simulation_folder)
+        from sinr_simulation import simulate_sinr_blocks
+
+        # the simulation draws from its own random states spawned from seed, the global numpy and random states are
+        # never touched, so the blocks can be simulated in the background thread from the first one on
+        simulation_seed, shuffle_seed = np.random.SeedSequence(seed).spawn(2)
+        self.shuffle_rng = np.random.default_rng(shuffle_seed)
+        sinr_blocks = simulate_sinr_blocks(interference_type, None, sample_frequency, interference_speed, interference_tx_power, \
+            bs_tx_power, batch_mobility=True, seed=simulation_seed, show_progress=False, block_size=block_size)
+        self.window_blocks = prefetch_in_background(self.generate_window_blocks(sinr_blocks), num_prefetch)
+
+        self.x_pending = np.empty((0, num_inputs), dtype=dtype)
+        self.y_pending = np.empty((0, num_outputs), dtype=dtype)
+
+
+    def generate_window_blocks(self, sinr_blocks):
+        tail = np.empty(0, dtype=self.dtype)
+        for _, _, sinr_dB, _ in sinr_blocks:
+            sequence = np.concatenate((tail, sinr_dB.astype(self.dtype)))
+            windows = np.lib.stride_tricks.sliding_window_view(sequence, self.window_length)
+            tail = sequence[len(windows):]
+            if self.shuffle:
+                windows = windows[self.shuffle_rng.permutation(len(windows))]
+            else:
+                windows = windows.copy()
+            yield windows[:, :self.num_inputs], windows[:, self.num_inputs:]
+
+
+    def take_windows(self, num_windows:int):
+        """Next num_windows windows of the stream.
+
+        Returns:
+            tuple: x of shape (num_windows, num_inputs) and y of shape (num_windows, num_outputs)
+        """
+        while len(self.x_pending) < num_windows:
+            x_block, y_block = next(self.window_blocks)
+            self.x_pending = np.concatenate((self.x_pending, x_block))
+            self.y_pending = np.concatenate((self.y_pending, y_block))
+        x, y = self.x_pending[:num_windows], self.y_pending[:num_windows]
+        self.x_pending, self.y_pending = self.x_pending[num_windows:], self.y_pending[num_windows:]
+        return x, y
+
+
+    def __iter__(self):
+        while True:
+            x_batch, y_batch = self.take_windows(1024)
+            yield from zip(x_batch, y_batch)
+
+
+    def as_dataset(self, batch_size:int=64, inputs_only:bool=False, expand_dims:bool=False) -> tf.data.Dataset:
+        """Infinite, batched tf.data.Dataset of the stream, use it with steps_per_epoch in fit.
+
+        Args:
+            batch_size (int, optional): number of windows per batch. Defaults to 64.
+            inputs_only (bool, optional): yield only x, e.g. for the VQ-VAE trainers. Defaults to False.
+            expand_dims (bool, optional): add a trailing feature axis to x like prepare_data. Defaults to False.
+        """
+        x_shape = (batch_size, self.num_inputs, 1) if expand_dims else (batch_size, self.num_inputs)
+        x_spec = tf.TensorSpec(shape=x_shape, dtype=tf.as_dtype(self.dtype))
+        y_spec = tf.TensorSpec(shape=(batch_size, self.num_outputs), dtype=tf.as_dtype(self.dtype))
+
+        def generate_batches():
+            while True:
+                x_batch, y_batch = self.take_windows(batch_size)
+                if expand_dims:
+                    x_batch = x_batch[..., np.newaxis]
+                yield x_batch if inputs_only else (x_batch, y_batch)
+
+        output_signature = x_spec if inputs_only else (x_spec, y_spec)
+        return tf.data.Dataset.from_generator(generate_batches, output_signature=output_signature).prefetch(tf.data.AUTOTUNE)
+
+
+    def close(self):
+        self.window_blocks.close()
+
+
+def prepare_vq_vae_data(batch_size:int=64, online_source:OnlineSINRWindowSource=None, steps_per_epoch:int=1000, \
+    num_reference_windows:int=80000, window_samplers:tuple=None):
+    """Training data of the VQ-VAE trainers, either the tf.data pipeline of make_dataset, an online source or
+    out-of-core window samplers.
+
+    With the data file, 20% of the training windows are split off for validation like validation_split in fit,
+    and the reference data for the re-initialization of the embeddings is the training dataset. With an online
+    source, a fixed reference sample of the stream is used for the variance and the re-initialization, the next
+    num_reference_windows // 4 windows replace x_test and are also used for validation, and fit runs on the endless
+    stream with steps_per_epoch batches per epoch.
+    window_samplers are the training and test samplers of create_split_samplers for files larger than the memory, or of
+    DatasetCatalog.create_split_samplers to mix many files: fit runs on block-shuffled epochs of the training part, the variance is computed from the file, the
+    reference data is a random sample of num_reference_windows training windows and the first num_reference_windows // 4
+    test windows replace x_test and are used for validation. The batch size of the samplers is used.
+
+    Returns:
+        tuple: reference data for encoder predictions, x_test, variance of the inputs and the data arguments of fit
+    """
+    if window_samplers is not None:
+        train_sampler, test_sampler = window_samplers
+        x_train, _ = train_sampler.take_windows(num_reference_windows)
+        x_test = test_sampler.read_test_windows(num_reference_windows // 4)[:, :train_sampler.num_inputs]
+        fit_arguments = dict(x=train_sampler.as_dataset(inputs_only=True), validation_data=(x_test,))
+        return x_train, x_test, train_sampler.calculate_input_variance(), fit_arguments
+
+    if online_source is None:
+        train_sinr_sequence, test_sinr_sequence = load_sinr_sequences()
+        variance = window_variance(train_sinr_sequence, num_inputs=40, num_outputs=10)
+        train_dataset, validation_dataset = make_dataset(num_inputs=40, num_outputs=10, batch_size=batch_size, validation_split=0.2, \
+            targets=None, expand_dims=False, sinr_sequence=train_sinr_sequence)
+        x_test, _, _ = prepare_test_data(num_inputs=40, num_outputs=10, test_sinr_sequence=test_sinr_sequence)
+        x_test = np.array(np.squeeze(x_test))
+        return train_dataset, x_test, variance, dict(x=train_dataset, validation_data=validation_dataset)
+
+    x_train, _ = online_source.take_windows(num_reference_windows)
+    x_test, _ = online_source.take_windows(num_reference_windows // 4)
+    fit_arguments = dict(x=online_source.as_dataset(batch_size=batch_size, inputs_only=True), steps_per_epoch=steps_per_epoch, \
+        validation_data=(x_test,))
+    return x_train, x_test, np.var(x_train), fit_arguments
+
+
+if __name__ == "__main__":
+    online_source = OnlineSINRWindowSource(num_inputs=40, num_outputs=10, seed=0)
+    x, y = online_source.take_windows(100000)
+    print(x.shape, y.shape, x.mean(), x.std())
+    online_source.close()
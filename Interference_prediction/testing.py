@@ -9,7 +9,7 @@ from Interference_prediction.data_preprocessing import prepare_data, prepare_dat
 def test_model(model_path:str, plot_result:bool=False):
     model = load_model(model_path)
     
-    _, _, x_test, y_test, test_sequence = prepare_data(num_inputs=40, num_outputs=10)
+    _, _, x_test, y_test, test_sequence = prepare_data(num_inputs=40, num_outputs=10, shuffle_samples=False)
     
     y_prediction = model.predict(x_test)
     
@@ -28,6 +28,34 @@ def test_model(model_path:str, plot_result:bool=False):
     return y_prediction_to_plot, y_test_to_plot
     
 
+def decode_autoregressive(model, extended_data_samples:np.ndarray, num_inputs:int, num_outputs:int) -> np.ndarray:
+    """Autoregressive prediction of all test samples together, one batched predict call per output step.
+
+    At step j the encoder input is extended_data_samples[:, j:j+num_inputs], and the decoder input is a zero
+    followed by the last num_outputs - 1 values of the sequence: true samples at first, then the predictions
+    of the previous steps. The last output of every step is its prediction.
+
+    Args:
+        model: encoder decoder model of build_encoder_decoder_model
+        extended_data_samples (np.ndarray): samples of preprocess_encoder_decoder_test, shape (num_samples, num_outputs - 1 + num_inputs + num_outputs)
+        num_inputs (int): length of the encoder input
+        num_outputs (int): number of predicted steps
+
+    Returns:
+        np.ndarray: predictions of shape (num_samples, num_outputs)
+    """
+    num_test_samples = np.shape(extended_data_samples)[0]
+    prediction_matrix = np.zeros((num_test_samples, num_outputs))
+    decoder_history = np.array(extended_data_samples[:, num_inputs - (num_outputs-1):num_inputs], dtype=np.float64)
+    for j in range(num_outputs):
+        encoder_input = extended_data_samples[:, j:j+num_inputs, np.newaxis]
+        decoder_input = np.concatenate((np.zeros((num_test_samples, 1)), decoder_history), axis=1)[..., np.newaxis]
+        current_prediction = model.predict([encoder_input, decoder_input], verbose=0)
+        prediction_matrix[:, j] = current_prediction[:, -1]     # save the last element of prediction to matrix
+        decoder_history = np.concatenate((decoder_history[:, 1:], current_prediction[:, -1:]), axis=1)
+    return prediction_matrix
+
+
 def test_encoder_decoder_model(plot_result:bool=False):
     num_inputs = 40
     num_outputs = 10
@@ -35,23 +63,7 @@ def test_encoder_decoder_model(plot_result:bool=False):
     extended_data_samples = prepare_data_for_encoder_decoder_test(num_inputs=num_inputs, num_outputs=num_outputs)
     y_test = extended_data_samples[:, -num_outputs:]
     
-    num_test_samples = np.shape(extended_data_samples)[0]
-    prediction_matrix = np.zeros((num_test_samples, num_outputs)) 
-    for i in range(num_test_samples):
-        data_sample_pool = extended_data_samples[i,:]
-        decoder_input_non_zero_list = data_sample_pool[num_inputs - (num_outputs-1):num_inputs].tolist()   
-        for j in range(num_outputs):  # todo: in the for loop try to finish the test phase.
-            encoder_input = np.expand_dims(data_sample_pool[j:j+num_inputs], axis=-1)
-            decoder_input_list = [0] + decoder_input_non_zero_list
-            decoder_input = np.array(decoder_input_list)
-            
-            encoder_input = np.expand_dims(encoder_input, axis=0)
-            decoder_input = np.expand_dims(decoder_input, axis=0)
-            
-            current_prediction = model.predict([encoder_input, decoder_input])
-            prediction_matrix[i,j] = current_prediction[:,-1]     # save the last element of prediction to matrix
-            decoder_input_non_zero_list.append(current_prediction[0,-1])
-            decoder_input_non_zero_list.pop(0)
+    prediction_matrix = decode_autoregressive(model, extended_data_samples, num_inputs, num_outputs)
     prediction_sequence = prediction_matrix.flatten()
     y_test_sequence = y_test.flatten()
     
@@ -72,7 +84,7 @@ def test_encoder_decoder_model_simple(plot_result:bool=False):
     num_outputs = 10
     model = load_model("Interference_prediction/models/encoder_decoder.h5")
 
-    _, _, x_test, y_test, test_sequence = prepare_data(num_inputs=40, num_outputs=10)
+    _, _, x_test, y_test, test_sequence = prepare_data(num_inputs=40, num_outputs=10, shuffle_samples=False)
     
     num_samples = np.shape(x_test)[0]
     x_test_decoder_input = np.zeros((num_samples, num_outputs))
@@ -0,0 +1,189 @@
+import numpy as np
+import tensorflow as tf
+
+from Interference_prediction.data_preprocessing import SINRFileReader
+from Interference_prediction.online_data import prefetch_in_background
+
+
+class BlockShuffleWindowSampler:
+    def __init__(self, file_path:str, num_inputs:int, num_outputs:int, start:int=0, stop:int=None, batch_size:int=64, \
+        block_size:int=65536, blocks_per_chunk:int=16, shuffle:bool=True, seed=None, dataset_name:str="SINR_dB", dtype=np.float32) -> None:
+        """Shuffled batches of sliding windows over an on-disk sequence that does not fit into memory.
+
+        The window start offsets of [start, stop) are split into blocks of block_size consecutive offsets. Every epoch
+        visits the blocks in random order, blocks_per_chunk blocks at a time: each block of the chunk is read with one
+        bulk read of block_size + window - 1 samples, and the windows of the whole chunk are shuffled together before
+        they are gathered batch by batch. Every window is used once per epoch, the memory only depends on
+        block_size * blocks_per_chunk, and the next chunk is read in a background thread.
+
+        Args:
+            file_path (str): data file, read with SINRFileReader
+            num_inputs (int): length of the input window x
+            num_outputs (int): length of the target window y
+            start (int, optional): first sample of the used range. Defaults to 0.
+            stop (int, optional): end of the used range, the end of the dataset if None. Defaults to None.
+            batch_size (int, optional): number of windows per batch. Defaults to 64.
+            block_size (int, optional): number of window offsets per block. Defaults to 65536.
+            blocks_per_chunk (int, optional): number of blocks shuffled together. Defaults to 16.
+            shuffle (bool, optional): shuffle the blocks and the windows, sequential windows otherwise. Defaults to True.
+            seed (int, optional): seed of the shuffling. Defaults to None.
+            dataset_name (str, optional): dataset of the file. Defaults to "SINR_dB".
+            dtype (optional): type of the windows. Defaults to np.float32.
+        """
+        self.reader = SINRFileReader(file_path)
+        self.sequence = self.reader.get_dataset(dataset_name)
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        self.window_length = num_inputs + num_outputs
+        self.start = start
+        self.stop = self.reader.get_length(dataset_name) if stop is None else stop
+        self.num_windows = max(self.stop - self.start - self.window_length + 1, 0)
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.num_blocks = -(-self.num_windows // block_size)
+        self.blocks_per_chunk = blocks_per_chunk
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.dtype = dtype
+
+
+    def __len__(self) -> int:
+        """Number of batches per epoch."""
+        return -(-self.num_windows // self.batch_size)
+
+
+    def read_chunk(self, block_indices:np.ndarray):
+        """Samples of the given blocks in one buffer and the buffer positions of all their window starts."""
+        span_list = list()
+        start_list = list()
+        buffer_position = 0
+        for block_index in np.sort(block_indices):
+            first_window = block_index * self.block_size
+            num_block_windows = min(self.block_size, self.num_windows - first_window)
+            span_start = self.start + first_window
+            span_list.append(np.asarray(self.sequence[span_start:span_start + num_block_windows + self.window_length - 1], dtype=self.dtype))
+            start_list.append(buffer_position + np.arange(num_block_windows))
+            buffer_position += len(span_list[-1])
+        return np.concatenate(span_list), np.concatenate(start_list)
+
+
+    def generate_chunks(self, block_order:np.ndarray):
+        for chunk_start in range(0, self.num_blocks, self.blocks_per_chunk):
+            buffer, window_starts = self.read_chunk(block_order[chunk_start:chunk_start + self.blocks_per_chunk])
+            if self.shuffle:
+                window_starts = self.rng.permutation(window_starts)
+            yield buffer, window_starts
+
+
+    def iter_windows(self):
+        """One epoch of (x, y) batches, x of shape (batch_size, num_inputs) and y of shape (batch_size, num_outputs)."""
+        block_order = self.rng.permutation(self.num_blocks) if self.shuffle else np.arange(self.num_blocks)
+        window_offsets = np.arange(self.window_length)
+        pending_windows = np.empty((0, self.window_length), dtype=self.dtype)
+        for buffer, window_starts in prefetch_in_background(self.generate_chunks(block_order), 1):
+            position = 0
+            while position < len(window_starts):
+                batch_starts = window_starts[position:position + self.batch_size - len(pending_windows)]
+                position += len(batch_starts)
+                windows = buffer[batch_starts[:, np.newaxis] + window_offsets]
+                if len(pending_windows) > 0:
+                    windows = np.concatenate((pending_windows, windows))
+                if len(windows) < self.batch_size:
+                    # the rest of the chunk is completed by the next chunk
+                    pending_windows = windows
+                    break
+                pending_windows = pending_windows[:0]
+                yield windows[:, :self.num_inputs], windows[:, self.num_inputs:]
+        if len(pending_windows) > 0:
+            yield pending_windows[:, :self.num_inputs], pending_windows[:, self.num_inputs:]
+
+
+    def __iter__(self):
+        return self.iter_windows()
+
+
+    def take_windows(self, num_windows:int):
+        """Random sample of num_windows windows, the first batches of a new epoch, so only the first chunks are read.
+
+        Returns:
+            tuple: x of shape (num_windows, num_inputs) and y of shape (num_windows, num_outputs)
+        """
+        x_list, y_list = list(), list()
+        num_taken = 0
+        batches = self.iter_windows()
+        for x_batch, y_batch in batches:
+            x_list.append(x_batch)
+            y_list.append(y_batch)
+            num_taken += len(x_batch)
+            if num_taken >= num_windows:
+                break
+        batches.close()
+        return np.concatenate(x_list)[:num_windows], np.concatenate(y_list)[:num_windows]
+
+
+    def as_dataset(self, inputs_only:bool=False, expand_dims:bool=False) -> tf.data.Dataset:
+        """tf.data.Dataset of the batches, every iteration is a new epoch with a new order.
+
+        Args:
+            inputs_only (bool, optional): yield only x, e.g. for the VQ-VAE trainers. Defaults to False.
+            expand_dims (bool, optional): add a trailing feature axis to x like prepare_data. Defaults to False.
+        """
+        x_shape = (None, self.num_inputs, 1) if expand_dims else (None, self.num_inputs)
+        x_spec = tf.TensorSpec(shape=x_shape, dtype=tf.as_dtype(self.dtype))
+        y_spec = tf.TensorSpec(shape=(None, self.num_outputs), dtype=tf.as_dtype(self.dtype))
+
+        def generate_batches():
+            for x_batch, y_batch in self.iter_windows():
+                if expand_dims:
+                    x_batch = x_batch[..., np.newaxis]
+                yield x_batch if inputs_only else (x_batch, y_batch)
+
+        output_signature = x_spec if inputs_only else (x_spec, y_spec)
+        return tf.data.Dataset.from_generator(generate_batches, output_signature=output_signature).prefetch(tf.data.AUTOTUNE)
+
+
+    def calculate_input_moments(self):
+        """Mean and mean square over the input windows of all offsets, computed block by block from the sequence."""
+        if self.num_windows == 0:
+            return 0.0, 0.0
+        # sample i of the range appears in the input windows w with max(0, i-num_inputs+1) <= w <= min(i, num_windows-1)
+        num_covered = self.num_windows + self.num_inputs - 1
+        weighted_sums = np.zeros(3)
+        for block_start in range(0, num_covered, self.block_size):
+            block_stop = min(block_start + self.block_size, num_covered)
+            sample_indices = np.arange(block_start, block_stop)
+            counts = np.minimum(sample_indices, self.num_windows - 1) - np.maximum(0, sample_indices - self.num_inputs + 1) + 1
+            samples = np.asarray(self.sequence[self.start + block_start:self.start + block_stop], dtype=np.float64)
+            weighted_sums += [np.sum(counts), np.sum(counts*samples), np.sum(counts*samples**2)]
+        return weighted_sums[1] / weighted_sums[0], weighted_sums[2] / weighted_sums[0]
+
+
+    def calculate_input_variance(self) -> float:
+        """np.var over the input windows of all offsets."""
+        mean, mean_square = self.calculate_input_moments()
+        return mean_square - mean**2
+
+
+    def read_test_windows(self, num_windows:int) -> np.ndarray:
+        """First num_windows windows of preprocess_test over the range (stride num_outputs), read with one bulk read.
+
+        Returns:
+            np.ndarray: windows of shape (num_windows, num_inputs + num_outputs)
+        """
+        num_windows = min(num_windows, max((self.stop - self.start - self.num_inputs) // self.num_outputs, 0))
+        span = np.asarray(self.sequence[self.start:self.start + (num_windows - 1) * self.num_outputs + self.window_length], dtype=self.dtype)
+        return np.lib.stride_tricks.sliding_window_view(span, self.window_length)[::self.num_outputs][:num_windows].copy()
+
+
+    def close(self):
+        self.reader.close()
+
+
+def create_split_samplers(file_path:str, num_inputs:int, num_outputs:int, train_fraction:float=0.8, **sampler_kwargs):
+    """Samplers of the training part (shuffled) and the test part (sequential) of a data file, split like prepare_data."""
+    with SINRFileReader(file_path) as reader:
+        num_train = int(train_fraction * reader.get_length(sampler_kwargs.get("dataset_name", "SINR_dB")))
+    train_sampler = BlockShuffleWindowSampler(file_path, num_inputs, num_outputs, stop=num_train, **sampler_kwargs)
+    sampler_kwargs["shuffle"] = False
+    test_sampler = BlockShuffleWindowSampler(file_path, num_inputs, num_outputs, start=num_train, **sampler_kwargs)
+    return train_sampler, test_sampler
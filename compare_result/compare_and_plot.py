@@ -1,4 +1,5 @@
 import sys
+import os
 sys.path.append("/home/zhu/Codes/Fed_Link_Adaptation")
 
 from sklearn.metrics import mean_squared_error
@@ -11,9 +12,10 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from Interference_prediction import data_preprocessing
-from compress_recover.vq_vae import create_quantized_autoencoder
-from compress_recover.vq_vae_ema import create_quantized_autoencoder_EMA
+from compress_recover.vq_vae import VectorQuantizer, create_quantized_autoencoder
+from compress_recover.vq_vae_ema import VectorQuantizer_EMA, create_quantized_autoencoder_EMA
 from compress_recover.auto_encoder_quant_latent import create_uniform_quantized_autoencoder
+from compress_recover.codeword_index import create_codeword_index, get_index_path, save_codeword_index
 
 from tabulate import tabulate
 
@@ -110,9 +112,27 @@ def ae_uniform_quant_test(x_test, input_dims, latent_dims, num_quant_bits, weigh
     return x_test_recover, x_test_recover_1d, abs_deviation, nmse
     
 
-def vq_vae_test(x_test, input_dims, latent_dims, num_embeddings, weights_path, layer_type:str="dense"):
+def use_search_index(quantizer, weights_path:str, search_backend:str):
+    """Quantize with the codeword index saved next to the weights. The index is built from the loaded embeddings and
+    saved if there is no index file yet, or if the saved index has another backend or was built from other embeddings.
+    Only single-codebook quantizers have a search index."""
+    if not isinstance(quantizer, (VectorQuantizer, VectorQuantizer_EMA)):
+        raise ValueError(f"{type(quantizer).__name__} has no search index, only VectorQuantizer and VectorQuantizer_EMA.")
+    index_path = get_index_path(weights_path)
+    if os.path.exists(index_path):
+        quantizer.load_search_index(index_path)
+        codewords = tf.transpose(quantizer.embeddings).numpy()
+        search_index = quantizer.search_index
+        if search_index.index_type == search_backend and np.array_equal(search_index.codewords, codewords):
+            return
+    save_codeword_index(quantizer.build_search_index(search_backend), index_path)
+
+
+def vq_vae_test(x_test, input_dims, latent_dims, num_embeddings, weights_path, layer_type:str="dense", search_backend:str=None):
     vq_vae = create_quantized_autoencoder(layer_type, input_dims, latent_dims, input_dims, num_embeddings)
     vq_vae.load_weights(weights_path)
+    if search_backend is not None:
+        use_search_index(vq_vae.layers[2], weights_path, search_backend)
     x_test_recover = vq_vae.predict(x_test)
     x_test_recover_1d = x_test_recover.flatten()
     x_test_1d = x_test.flatten()
@@ -122,12 +142,14 @@ def vq_vae_test(x_test, input_dims, latent_dims, num_embeddings, weights_path, l
     return x_test_recover, x_test_recover_1d, abs_deviation, nmse
 
 
-def vq_vae_ema_test(x_test, input_dims, latent_dims, num_embeddings, weights_path, layer_type:str="dense"):
+def vq_vae_ema_test(x_test, input_dims, latent_dims, num_embeddings, weights_path, layer_type:str="dense", search_backend:str=None):
     vq_vae_ema = create_quantized_autoencoder_EMA(layer_type, input_dims, latent_dims, input_dims, num_embeddings)
     vq_vae_ema.load_weights(weights_path)
     
     vq_ema_layer = vq_vae_ema.layers[2]
     vq_ema_layer.disable_training_ema()
+    if search_backend is not None:
+        use_search_index(vq_ema_layer, weights_path, search_backend)
     x_test_recover = vq_vae_ema.predict(x_test)
     x_test_recover_1d = x_test_recover.flatten()
     x_test_1d = x_test.flatten()
@@ -137,7 +159,7 @@ def vq_vae_ema_test(x_test, input_dims, latent_dims, num_embeddings, weights_pat
     return x_test_recover, x_test_recover_1d, abs_deviation, nmse
 
 
-def lloyd_max_test(x_train, x_test, num_embedings, initialization, AE_test=False):
+def lloyd_max_test(x_train, x_test, num_embedings, initialization, AE_test=False, search_backend:str=None):
     # Prepare data for K-Means training
     data_train = np.squeeze(x_train)
     
@@ -157,8 +179,11 @@ def lloyd_max_test(x_train, x_test, num_embedings, initialization, AE_test=False
         kmeans.fit(data_train)
     
     # Prepare data and test K-Means model
-    labels_test = kmeans.predict(x_test)
     centroids = kmeans.cluster_centers_
+    if search_backend is None:
+        labels_test = kmeans.predict(x_test)
+    else:
+        labels_test = create_codeword_index(centroids, search_backend).search(x_test)
     quantized_sequence  = [centroids[label] for label in labels_test]
     
     # Change the output format
@@ -171,7 +196,7 @@ def lloyd_max_test(x_train, x_test, num_embedings, initialization, AE_test=False
 
 
 def compare_recover_performance(plotter_list:list):
-    x_train, y_train, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+    x_train, y_train, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, seed=0)
     x_test = np.squeeze(x_test)
     # input_dims = 40
     # latent_dims = 20
@@ -239,7 +264,7 @@ def compare_recover_performance(plotter_list:list):
     
 
 def compare_recover_prediction():
-    _, _, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+    _, _, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, seed=0, shuffle_samples=False)
     x_test = np.squeeze(x_test)
     input_dims = 40
     latent_dims = 20
@@ -337,7 +362,7 @@ def parameter_compare():
     
     input_dim = 40
     latent_dim = 20
-    _, _, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+    _, _, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, seed=0, shuffle_samples=False)
     
     vq_vae_mse_list = list()
     vq_vae_kmpp_mse_list = list()
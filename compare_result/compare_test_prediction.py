@@ -28,7 +28,7 @@ def predict_sinr_sequence(model_params:VQVAEParams, model_type:ModelType):
     """
     file_index=0
     file_path = get_file_path(model_params, file_index, return_list=False)
-    _, _, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+    _, _, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, seed=0, shuffle_samples=False)
     
     num_quant_bits = 6
     input_dims = 40
@@ -41,7 +41,7 @@ def get_file_path(params:VQVAEParams, file_index:int=None, return_list:bool=True
 
 
 def evaluate_multiple_models(params:VQVAEParams):
-    x_train, y_train, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+    x_train, y_train, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, seed=0)
     file_path_list = get_file_path(params)
     mse_list = list()
     mse_prediction_list = list()
@@ -103,23 +103,21 @@ class VQVAE_Pred_Trainer(Model):
 
 
 def train_vq_vae_predict(input_dim:int, latent_dim:int, output_dim:int, num_embeddings:int, with_batch_norm:bool=False, optimizer:str="adam", plot_figure:bool=True):
-    x_train, y_train, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
-    x_train = np.squeeze(x_train)
-    y_train = np.squeeze(y_train)
-    x_test = np.squeeze(x_test)
+    train_sinr_sequence, test_sinr_sequence = data_preprocessing.load_sinr_sequences()
+    train_dataset, _ = data_preprocessing.make_dataset(num_inputs=40, num_outputs=10, batch_size=64, expand_dims=False, \
+        sinr_sequence=train_sinr_sequence)
+    x_test, y_test, _ = data_preprocessing.prepare_test_data(num_inputs=40, num_outputs=10, test_sinr_sequence=test_sinr_sequence)
+    x_test = np.array(np.squeeze(x_test))
     y_test = np.squeeze(y_test)
     
-    x_train = np.array(x_train)
-    x_test = np.array(x_test)
-    
-    variance = np.var(x_train)
+    variance = data_preprocessing.window_variance(train_sinr_sequence, num_inputs=40, num_outputs=10)
     
     vq_vae_trainer = VQVAE_Pred_Trainer(variance, input_dim, latent_dim, num_embeddings=num_embeddings, with_bn_layer=with_batch_norm)
     vq_vae_trainer.compile(optimizer=optimizer)
     
     vq_vae_trainer.build((None, input_dim))
             
-    history = vq_vae_trainer.fit(x=x_train, y=y_train, epochs=200, batch_size=64)
+    history = vq_vae_trainer.fit(train_dataset, epochs=200)
     
     file_name = f"vq_vae_input_{input_dim}_latent_{latent_dim}_num_embeddings_{num_embeddings}_with_BN_{with_batch_norm}_{optimizer}.h5"
     history_path = os.path.join("training_history", "vq_vae_predict", file_name)
@@ -5,7 +5,8 @@ class VQVAEParams:
     def __init__(self, autoencoder_type:str, vq_update_type:str, init_embedding_method:str, \
         input_dims:int, latent_dims:int, num_embeddings:int, optimizer:str, num_epochs:int, init_epochs:int, \
             re_init_interval:int, beta:float=0.25, ema_decay:float=0.99, plot_figure:bool=False, \
-            num_models:int=None) -> None:
+            num_models:int=None, jit_compile:bool=False, laplace_epsilon:float=None, num_stages:int=1, \
+            num_subspaces:int=1) -> None:
         
         # define model type
         self.autoencoder_type = autoencoder_type
@@ -16,6 +17,8 @@ class VQVAEParams:
         self.latent_dims = latent_dims
         self.num_embeddings = num_embeddings
         self.embedding_init_method = init_embedding_method
+        self.num_stages = num_stages            # number of residual quantization stages, 1 for a single codebook
+        self.num_subspaces = num_subspaces      # number of product quantization sub-spaces, 1 for a single codebook
         
         # define training parameters
         self.optimizer = optimizer
@@ -28,7 +31,9 @@ class VQVAEParams:
         # for EMA algorithm
         self.beta = beta        # beta is the commitment factor
         self.ema_decay = ema_decay
+        self.laplace_epsilon = laplace_epsilon  # Laplace smoothing of the EMA counts, None for no smoothing
         
         # others
         self.plot_figure = plot_figure
-        self.num_models = num_models 
\ No newline at end of file
+        self.num_models = num_models
+        self.jit_compile = jit_compile          # compile the train steps with XLA
\ No newline at end of file
@@ -94,14 +94,14 @@ def train_autoencoder_input_compression(inputs_dims:int, latent_dims:int, optimi
         autoencoder = create_dense_autoencoder(inputs_dims, latent_dims, optimizer)
     elif type == "lstm":
         autoencoder = create_lstm_autoencoder(inputs_dims, latent_dims, optimizer)
-    x_train, _, x_test, _, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, data_type=data_type)
-    
-    if type == "dense":
-        x_train = np.squeeze(x_train)
+    # the lstm autoencoder keeps the trailing feature axis of the inputs
+    train_dataset, _ = data_preprocessing.make_dataset(num_inputs=40, num_outputs=10, data_type=data_type, batch_size=64, \
+        targets="inputs", expand_dims=(type == "lstm"))
+    x_test, _, _ = data_preprocessing.prepare_test_data(num_inputs=40, num_outputs=10, data_type=data_type)
     
     x_test = np.squeeze(x_test)
         
-    history = autoencoder.fit(x_train, x_train, epochs=300, batch_size=64)
+    history = autoencoder.fit(train_dataset, epochs=300)
     file_name = f"AE_{type}_input_{inputs_dims}_latent_{latent_dims}_optimizer_{optimizer}_data_{data_type}.h5"
     history_save_path = os.path.join("experiment_01_route_random_compare", "training_history", "ae", file_name)
     with h5py.File(history_save_path, "w") as hf:
@@ -0,0 +1,170 @@
+import numpy as np
+import tensorflow as tf
+import time
+
+
+def calculate_embedding_norms(embeddings):
+    """Squared norm ||e||^2 of every codeword of a (embedding_dim, num_embeddings) codebook."""
+    return tf.reduce_sum(embeddings**2, axis=0)
+
+
+def find_nearest_codewords(flattened_inputs, embeddings, embedding_norms=None, tile_size:int=None):
+    """Index of the nearest codeword of every input vector, the squared distances are expanded as
+    ||x||^2 + ||e||^2 - 2 x.e, embedding_norms can be passed to reuse ||e||^2 of the same codebook.
+
+    With tile_size, the codebook is scanned in tiles of tile_size codewords with a running minimum and argmin, so
+    only a (num_inputs, tile_size) block of distances exists at a time instead of (num_inputs, num_embeddings).
+    The distances are computed with the same expression and ties go to the smaller index, so the indices are the
+    ones of the full search. The codebook is padded to a multiple of tile_size with codewords of infinite norm, so
+    every tile slice stays inside the codebook, XLA clamps the start of a slice that runs past the end.
+    """
+    if embedding_norms is None:
+        embedding_norms = calculate_embedding_norms(embeddings)
+    input_norms = tf.reduce_sum(flattened_inputs**2, axis=1, keepdims=True)
+    num_embeddings = embeddings.shape[1]
+    if tile_size is None or tile_size >= num_embeddings:
+        distances = input_norms + embedding_norms - 2 * tf.matmul(flattened_inputs, embeddings)
+        return tf.argmin(distances, axis=1)
+
+    num_padding = -num_embeddings % tile_size
+    padded_embeddings = tf.pad(embeddings, [[0, 0], [0, num_padding]])
+    padded_norms = tf.concat([embedding_norms, tf.fill([num_padding], tf.constant(np.inf, dtype=embedding_norms.dtype))], axis=0)
+
+    def search_tile(tile_start, min_distances, min_indices):
+        tile_distances = (
+            input_norms
+            + padded_norms[tile_start:tile_start + tile_size]
+            - 2 * tf.matmul(flattened_inputs, padded_embeddings[:, tile_start:tile_start + tile_size])
+        )
+        tile_min_distances = tf.reduce_min(tile_distances, axis=1)
+        tile_min_indices = tf.argmin(tile_distances, axis=1) + tf.cast(tile_start, tf.int64)
+        # strictly closer only, an equal distance of a later tile keeps the earlier index like tf.argmin
+        is_closer = tile_min_distances < min_distances
+        return tile_start + tile_size, tf.where(is_closer, tile_min_distances, min_distances), tf.where(is_closer, tile_min_indices, min_indices)
+
+    num_inputs = tf.shape(flattened_inputs)[0]
+    initial_distances = tf.fill([num_inputs], tf.constant(np.inf, dtype=flattened_inputs.dtype))
+    initial_indices = tf.zeros([num_inputs], dtype=tf.int64)
+    # one tile at a time, so the memory of the scan stays at one tile of distances
+    _, _, encoding_indices = tf.while_loop(lambda tile_start, *_: tile_start < num_embeddings, search_tile, \
+        (tf.constant(0), initial_distances, initial_indices), parallel_iterations=1)
+    return encoding_indices
+
+
+def find_nearest_subspace_codewords(subspace_inputs, embeddings, tile_size:int=None):
+    """Nearest codeword of every sub-vector in the codebook of its sub-space, all sub-spaces are searched with one
+    batched matmul.
+
+    Args:
+        subspace_inputs: sub-vectors of shape (num_subspaces, num_inputs, subspace_dim)
+        embeddings: codebooks of shape (num_subspaces, subspace_dim, num_embeddings)
+        tile_size (int, optional): search every sub-space with the tiled find_nearest_codewords. Defaults to None.
+
+    Returns:
+        indices of shape (num_subspaces, num_inputs)
+    """
+    if tile_size is not None:
+        return tf.stack([find_nearest_codewords(subspace_inputs[subspace], embeddings[subspace], tile_size=tile_size) \
+            for subspace in range(embeddings.shape[0])])
+    input_norms = tf.reduce_sum(subspace_inputs**2, axis=2, keepdims=True)
+    embedding_norms = tf.reduce_sum(embeddings**2, axis=1, keepdims=True)
+    distances = input_norms + embedding_norms - 2 * tf.matmul(subspace_inputs, embeddings)
+    return tf.argmin(distances, axis=2)
+
+
+def lookup_codewords(embeddings, encoding_indices):
+    """Codewords of the indices, shape (num_indices, embedding_dim).
+
+    Same values as tf.matmul(tf.one_hot(encoding_indices, num_embeddings), embeddings, transpose_b=True),
+    but the cost is linear in the number of indices instead of num_indices x num_embeddings.
+    """
+    return tf.gather(tf.transpose(embeddings), encoding_indices)
+
+
+def count_codeword_usage(encoding_indices, num_embeddings:int, dtype=tf.float32):
+    """Number of inputs assigned to every codeword, shape (num_embeddings,).
+
+    Same values as tf.reduce_sum(tf.one_hot(encoding_indices, num_embeddings), 0) as a scatter-add over the indices.
+    """
+    return tf.math.unsorted_segment_sum(tf.ones_like(encoding_indices, dtype=dtype), encoding_indices, num_embeddings)
+
+
+def sum_codeword_inputs(flattened_inputs, encoding_indices, num_embeddings:int):
+    """Sum of the inputs assigned to every codeword, shape (embedding_dim, num_embeddings) like the codebook.
+
+    Replaces tf.matmul(flattened_inputs, tf.one_hot(encoding_indices, num_embeddings), transpose_a=True), the
+    scatter-add costs O(num_inputs x embedding_dim) instead of O(num_inputs x num_embeddings x embedding_dim).
+    """
+    return tf.transpose(tf.math.unsorted_segment_sum(flattened_inputs, encoding_indices, num_embeddings))
+
+
+def laplace_smoothing(counts, epsilon:float):
+    """Additive (Laplace) smoothing of codeword counts, every count gets epsilon and the total stays the same."""
+    total = tf.reduce_sum(counts)
+    num_embeddings = tf.cast(tf.size(counts), counts.dtype)
+    return (counts + epsilon) / (total + num_embeddings * epsilon) * total
+
+
+def check_tiled_search(num_embeddings:int=70, tile_size:int=16, num_inputs:int=1000, embedding_dim:int=20, seed:int=0):
+    """Compare the indices of the full search, the tiled search and the tiled search compiled with XLA, num_embeddings
+    should not be a multiple of tile_size so the last tile is a partial one. Raises a ValueError if they differ."""
+    rng = np.random.default_rng(seed)
+    flattened_inputs = tf.constant(rng.standard_normal((num_inputs, embedding_dim)), dtype=tf.float32)
+    embeddings = tf.constant(rng.uniform(-1, 1, (embedding_dim, num_embeddings)), dtype=tf.float32)
+
+    full_indices = find_nearest_codewords(flattened_inputs, embeddings).numpy()
+    tiled_indices = find_nearest_codewords(flattened_inputs, embeddings, tile_size=tile_size).numpy()
+    search_xla = tf.function(lambda inputs: find_nearest_codewords(inputs, embeddings, tile_size=tile_size), jit_compile=True)
+    xla_indices = search_xla(flattened_inputs).numpy()
+    for name, indices in [("tiled", tiled_indices), ("tiled XLA", xla_indices)]:
+        if not np.array_equal(full_indices, indices):
+            raise ValueError(f"The {name} search differs from the full search for {np.sum(full_indices != indices)} of "
+                             f"{num_inputs} inputs with {num_embeddings} embeddings and tile_size {tile_size}.")
+
+
+def benchmark_codebook_lookup(num_embeddings_list:list=[16, 64, 256, 1024, 4096], batch_size:int=1024, embedding_dim:int=20, \
+    num_repetitions:int=50, seed:int=0) -> dict:
+    """Throughput of quantizing one batch (search and codeword lookup) with the one-hot matmul lookup and with
+    tf.gather and precomputed codeword norms, both compiled with tf.function.
+
+    Returns:
+        dict: for every codebook size the batches per second of both paths and the speed-up
+    """
+    rng = np.random.default_rng(seed)
+    flattened_inputs = tf.constant(rng.standard_normal((batch_size, embedding_dim)), dtype=tf.float32)
+
+    results = dict()
+    for num_embeddings in num_embeddings_list:
+        embeddings = tf.Variable(rng.uniform(-1, 1, (embedding_dim, num_embeddings)), dtype=tf.float32)
+        embedding_norms = calculate_embedding_norms(embeddings)
+
+        @tf.function
+        def quantize_one_hot(inputs):
+            encoding_indices = find_nearest_codewords(inputs, embeddings)
+            encodings = tf.one_hot(encoding_indices, num_embeddings)
+            return tf.matmul(encodings, embeddings, transpose_b=True)
+
+        @tf.function
+        def quantize_gather(inputs):
+            encoding_indices = find_nearest_codewords(inputs, embeddings, embedding_norms)
+            return lookup_codewords(embeddings, encoding_indices)
+
+        if not np.array_equal(quantize_one_hot(flattened_inputs).numpy(), quantize_gather(flattened_inputs).numpy()):
+            raise ValueError(f"The quantized vectors of both paths differ for {num_embeddings} embeddings.")
+
+        batches_per_second = dict()
+        for name, quantize in [("one_hot", quantize_one_hot), ("gather", quantize_gather)]:
+            start_time = time.perf_counter()
+            for _ in range(num_repetitions):
+                quantize(flattened_inputs).numpy()
+            batches_per_second[name] = num_repetitions / (time.perf_counter() - start_time)
+        batches_per_second["speed_up"] = batches_per_second["gather"] / batches_per_second["one_hot"]
+        results[num_embeddings] = batches_per_second
+        print(f"K = {num_embeddings:5d}: one-hot {batches_per_second['one_hot']:9.1f} batches/s, "
+              f"gather {batches_per_second['gather']:9.1f} batches/s, speed-up {batches_per_second['speed_up']:.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    check_tiled_search()
+    benchmark_codebook_lookup()
@@ -0,0 +1,259 @@
+import numpy as np
+import tensorflow as tf
+import h5py
+import time
+import os
+
+from sklearn.cluster import KMeans
+from sklearn.neighbors import BallTree, KDTree
+
+
+class BruteForceCodewordIndex:
+    index_type = "brute_force"
+
+    def __init__(self, codewords:np.ndarray, chunk_size:int=4096) -> None:
+        """Exact nearest codeword search with numpy, ||e||^2 - 2 x.e for chunk_size queries at a time.
+
+        Args:
+            codewords (np.ndarray): codewords of shape (num_embeddings, embedding_dim), the transposed embeddings of a quantizer
+            chunk_size (int, optional): number of queries per distance matrix. Defaults to 4096.
+        """
+        self.codewords = np.asarray(codewords, dtype=np.float32)
+        self.codeword_norms = np.sum(self.codewords**2, axis=1)
+        self.chunk_size = chunk_size
+
+
+    def search(self, queries:np.ndarray) -> np.ndarray:
+        queries = np.asarray(queries, dtype=np.float32)
+        indices = np.empty(len(queries), dtype=np.int64)
+        for chunk_start in range(0, len(queries), self.chunk_size):
+            chunk = queries[chunk_start:chunk_start + self.chunk_size]
+            # ||x||^2 is the same for all codewords of a query and does not change the argmin
+            indices[chunk_start:chunk_start + len(chunk)] = np.argmin(self.codeword_norms - 2 * chunk @ self.codewords.T, axis=1)
+        return indices
+
+
+    def to_h5(self, hf:h5py.File):
+        hf.create_dataset("codewords", data=self.codewords)
+        hf.attrs["chunk_size"] = self.chunk_size
+
+
+    @classmethod
+    def from_h5(cls, hf:h5py.File):
+        return cls(hf["codewords"][:], int(hf.attrs["chunk_size"]))
+
+
+class TreeCodewordIndex:
+    index_type = "tree"
+
+    def __init__(self, codewords:np.ndarray, tree_type:str="kd", leaf_size:int=40) -> None:
+        """Exact nearest codeword search with a KD-tree or a ball tree of scikit-learn over the codewords.
+
+        Args:
+            codewords (np.ndarray): codewords of shape (num_embeddings, embedding_dim)
+            tree_type (str, optional): "kd" or "ball". Defaults to "kd".
+            leaf_size (int, optional): number of codewords per leaf. Defaults to 40.
+        """
+        if tree_type not in ["kd", "ball"]:
+            raise ValueError("Invalid tree_type. Supported types: 'kd' or 'ball'.")
+        self.codewords = np.asarray(codewords, dtype=np.float32)
+        self.tree_type = tree_type
+        self.leaf_size = leaf_size
+        tree_class = KDTree if tree_type == "kd" else BallTree
+        self.tree = tree_class(self.codewords, leaf_size=leaf_size)
+
+
+    def search(self, queries:np.ndarray) -> np.ndarray:
+        return self.tree.query(np.asarray(queries, dtype=np.float32), k=1, return_distance=False)[:, 0].astype(np.int64)
+
+
+    def to_h5(self, hf:h5py.File):
+        # only the codewords and the parameters are stored, the tree is rebuilt when it is loaded
+        hf.create_dataset("codewords", data=self.codewords)
+        hf.attrs["tree_type"] = self.tree_type
+        hf.attrs["leaf_size"] = self.leaf_size
+
+
+    @classmethod
+    def from_h5(cls, hf:h5py.File):
+        return cls(hf["codewords"][:], str(hf.attrs["tree_type"]), int(hf.attrs["leaf_size"]))
+
+
+class IVFCodewordIndex:
+    index_type = "ivf"
+
+    def __init__(self, codewords:np.ndarray, num_lists:int=None, num_probes:int=8, seed:int=0, coarse_centroids:np.ndarray=None, \
+        list_assignments:np.ndarray=None) -> None:
+        """Inverted-file index, the codewords are clustered with a coarse k-means and every codeword is stored as the
+        residual to its coarse centroid in the list of that centroid.
+
+        A query is compared with the num_probes nearest coarse centroids and only with the codewords of their lists,
+        the distances are computed between the query residual x - c and the codeword residuals. The search is
+        approximate, more probes give a higher recall at a higher latency.
+
+        Args:
+            codewords (np.ndarray): codewords of shape (num_embeddings, embedding_dim)
+            num_lists (int, optional): number of coarse centroids, sqrt(num_embeddings) if None. Defaults to None.
+            num_probes (int, optional): number of lists searched per query. Defaults to 8.
+            seed (int, optional): seed of the coarse k-means. Defaults to 0.
+            coarse_centroids (np.ndarray, optional): already trained coarse centroids, e.g. loaded from a file. Defaults to None.
+            list_assignments (np.ndarray, optional): list of every codeword for coarse_centroids. Defaults to None.
+        """
+        codewords = np.asarray(codewords, dtype=np.float32)
+        if coarse_centroids is None:
+            if num_lists is None:
+                num_lists = int(np.sqrt(len(codewords)))
+            coarse_kmeans = KMeans(n_clusters=num_lists, n_init=1, random_state=seed).fit(codewords)
+            coarse_centroids = coarse_kmeans.cluster_centers_
+            list_assignments = coarse_kmeans.labels_
+        self.coarse_centroids = np.asarray(coarse_centroids, dtype=np.float32)
+        self.num_lists = len(self.coarse_centroids)
+        self.num_probes = min(num_probes, self.num_lists)
+
+        # the codewords sorted by list, list l holds codeword_ids[list_offsets[l]:list_offsets[l+1]]
+        self.codeword_ids = np.argsort(list_assignments, kind="stable").astype(np.int64)
+        self.list_offsets = np.searchsorted(list_assignments[self.codeword_ids], np.arange(self.num_lists + 1))
+        self.residuals = codewords[self.codeword_ids] - self.coarse_centroids[list_assignments[self.codeword_ids]]
+        self.residual_norms = np.sum(self.residuals**2, axis=1)
+        self.coarse_norms = np.sum(self.coarse_centroids**2, axis=1)
+        self.list_assignments = np.asarray(list_assignments, dtype=np.int64)
+        self.codewords = codewords
+
+
+    def search(self, queries:np.ndarray, num_probes:int=None) -> np.ndarray:
+        queries = np.asarray(queries, dtype=np.float32)
+        num_probes = self.num_probes if num_probes is None else min(num_probes, self.num_lists)
+        coarse_distances = self.coarse_norms - 2 * queries @ self.coarse_centroids.T
+        probe_lists = np.argpartition(coarse_distances, num_probes - 1, axis=1)[:, :num_probes]
+
+        # all (query, probe) pairs are grouped by their list, so every list that is probed at all is searched once
+        # with one matmul, the number of iterations is at most num_lists whatever num_probes and the batch size
+        pair_lists = probe_lists.ravel()
+        pair_order = np.argsort(pair_lists, kind="stable")
+        probed_lists, pair_offsets = np.unique(pair_lists[pair_order], return_index=True)
+        pair_offsets = np.append(pair_offsets, len(pair_order))
+        pair_distances = np.full(len(pair_lists), np.inf, dtype=np.float32)
+        pair_indices = np.zeros(len(pair_lists), dtype=np.int64)
+        for list_index, pair_start, pair_stop in zip(probed_lists, pair_offsets[:-1], pair_offsets[1:]):
+            list_start, list_stop = self.list_offsets[list_index], self.list_offsets[list_index + 1]
+            if list_start == list_stop:
+                continue
+            list_pairs = pair_order[pair_start:pair_stop]
+            query_residuals = queries[list_pairs // num_probes] - self.coarse_centroids[list_index]
+            distances = (np.sum(query_residuals**2, axis=1, keepdims=True) + self.residual_norms[list_start:list_stop]
+                         - 2 * query_residuals @ self.residuals[list_start:list_stop].T)
+            best = np.argmin(distances, axis=1)
+            pair_distances[list_pairs] = distances[np.arange(len(list_pairs)), best]
+            pair_indices[list_pairs] = self.codeword_ids[list_start + best]
+
+        # the nearest candidate over the probes of every query
+        best_probes = np.argmin(pair_distances.reshape(len(queries), num_probes), axis=1)
+        return pair_indices.reshape(len(queries), num_probes)[np.arange(len(queries)), best_probes]
+
+
+    def to_h5(self, hf:h5py.File):
+        hf.create_dataset("codewords", data=self.codewords)
+        hf.create_dataset("coarse_centroids", data=self.coarse_centroids)
+        hf.create_dataset("list_assignments", data=self.list_assignments)
+        hf.attrs["num_probes"] = self.num_probes
+
+
+    @classmethod
+    def from_h5(cls, hf:h5py.File):
+        return cls(hf["codewords"][:], num_probes=int(hf.attrs["num_probes"]), coarse_centroids=hf["coarse_centroids"][:], \
+            list_assignments=hf["list_assignments"][:])
+
+
+CODEWORD_INDEX_TYPES = {index_class.index_type: index_class for index_class in [BruteForceCodewordIndex, TreeCodewordIndex, IVFCodewordIndex]}
+
+
+def create_codeword_index(codewords:np.ndarray, backend:str="brute_force", **index_kwargs):
+    """Nearest codeword index of the given backend, "brute_force", "tree" (KD-tree or ball tree) or "ivf"."""
+    if backend not in CODEWORD_INDEX_TYPES:
+        raise ValueError(f"Invalid backend {backend}. Supported types: {list(CODEWORD_INDEX_TYPES)}.")
+    return CODEWORD_INDEX_TYPES[backend](codewords, **index_kwargs)
+
+
+def search_codeword_index(codeword_index, flattened_inputs):
+    """Nearest codeword indices of a tensor of inputs with a numpy index, for inference, the search has no gradient
+    and does not run under XLA."""
+    encoding_indices = tf.numpy_function(codeword_index.search, [flattened_inputs], tf.int64, stateful=False)
+    encoding_indices.set_shape(flattened_inputs.shape[:1])
+    return encoding_indices
+
+
+def reset_compiled_functions(model):
+    """Drop the traced train, test and predict functions of a Keras model, so the next fit, evaluate or predict traces
+    them again and picks up a changed search index."""
+    model.train_function = None
+    model.test_function = None
+    model.predict_function = None
+
+
+def get_index_path(weights_path:str) -> str:
+    """File of the codeword index next to the weights file, e.g. model.h5 -> model_codeword_index.h5."""
+    root, extension = os.path.splitext(weights_path)
+    return root + "_codeword_index" + (extension or ".h5")
+
+
+def save_codeword_index(codeword_index, file_path:str):
+    with h5py.File(file_path, "w") as hf:
+        hf.attrs["index_type"] = codeword_index.index_type
+        codeword_index.to_h5(hf)
+
+
+def load_codeword_index(file_path:str):
+    with h5py.File(file_path, "r") as hf:
+        return CODEWORD_INDEX_TYPES[hf.attrs["index_type"]].from_h5(hf)
+
+
+def benchmark_codeword_indices(codewords:np.ndarray=None, queries:np.ndarray=None, index_configs:list=None, num_embeddings:int=16384, \
+    embedding_dim:int=20, num_queries:int=4096, seed:int=0) -> dict:
+    """Recall@1 and latency of the index backends against the exact search.
+
+    Without codewords and queries, the codewords are random and the queries are codewords with Gaussian noise, like
+    latents close to a trained codebook. Pass the transposed embeddings of a trained quantizer and encoder outputs
+    to measure a real model.
+
+    Args:
+        index_configs (list, optional): (name, backend, index kwargs, search kwargs) tuples, the IVF probes and both trees if None
+
+    Returns:
+        dict: for every configuration the build time in s, the search latency in us per query and the Recall@1
+    """
+    rng = np.random.default_rng(seed)
+    if codewords is None:
+        codewords = rng.standard_normal((num_embeddings, embedding_dim)).astype(np.float32)
+    if queries is None:
+        queries = codewords[rng.integers(len(codewords), size=num_queries)] + 0.3 * rng.standard_normal((num_queries, codewords.shape[1]))
+    queries = np.asarray(queries, dtype=np.float32)
+    if index_configs is None:
+        num_lists = int(np.sqrt(len(codewords)))
+        index_configs = [("brute_force", "brute_force", dict(), dict()), ("kd_tree", "tree", dict(tree_type="kd"), dict()), \
+            ("ball_tree", "tree", dict(tree_type="ball"), dict())]
+        index_configs += [(f"ivf_{num_lists}_probes_{num_probes}", "ivf", dict(num_lists=num_lists, seed=seed), dict(num_probes=num_probes)) \
+            for num_probes in [1, 4, 16, 64] if num_probes <= num_lists]
+
+    exact_indices = BruteForceCodewordIndex(codewords).search(queries)
+    results = dict()
+    built_indices = dict()
+    for name, backend, index_kwargs, search_kwargs in index_configs:
+        # configurations with the same index only differ in the search arguments, the index is built once
+        index_key = (backend, tuple(sorted(index_kwargs.items())))
+        if index_key not in built_indices:
+            start_time = time.perf_counter()
+            codeword_index = create_codeword_index(codewords, backend, **index_kwargs)
+            built_indices[index_key] = (codeword_index, time.perf_counter() - start_time)
+        codeword_index, build_time = built_indices[index_key]
+
+        start_time = time.perf_counter()
+        indices = codeword_index.search(queries, **search_kwargs)
+        latency = (time.perf_counter() - start_time) / len(queries) * 1e6
+        recall = np.mean(indices == exact_indices)
+        results[name] = dict(build_time=build_time, latency=latency, recall=recall)
+        print(f"{name:>20s}: build {build_time:7.3f} s, {latency:8.2f} us/query, Recall@1 {recall:.4f}")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_codeword_indices()
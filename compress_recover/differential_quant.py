@@ -75,7 +75,7 @@ def differential_quantization_single_sequence(sequence, initial_state, quantizat
 
 
 # Example usage
-_, _, _, _, sequence = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+_, _, _, _, sequence = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, shuffle_samples=False)
 initial_state = sequence[0]  # Use the first element of the sequence as the initial value
 num_bits = 1 # Number of quantization bits
 quantization_step = 1     # 
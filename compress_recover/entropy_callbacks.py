@@ -19,10 +19,12 @@ class LatentEntropyCallback(Callback):
         
         # Calculate the counts (number of embeddings assigned to each centroid)
         counts_tf = self.model.vqvae.layers[2].calculate_data_points_number_per_centorid(encoder_output)
-        counts = counts_tf.numpy()
+        # residual and product quantizers count every stage or sub-space, shape (num_stages, num_embeddings), and the
+        # entropy of the code is the sum of their entropies (an upper bound of the joint entropy)
+        counts = np.atleast_2d(counts_tf.numpy())
 
         # Normalize counts to obtain probabilities
-        probabilities = counts / np.sum(counts)
+        probabilities = counts / np.sum(counts, axis=1, keepdims=True)
 
         # Calculate the entropy for each centroid
         entropy_per_centroid = -np.sum(probabilities * np.log2(probabilities + 1e-10))
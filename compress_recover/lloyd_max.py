@@ -3,6 +3,7 @@ import sys
 sys.path.append("/home/zhu/Codes/Fed_Link_Adaptation")
 
 from Interference_prediction import data_preprocessing
+from compress_recover.codeword_index import BruteForceCodewordIndex
 
 import h5py
 import numpy as np
@@ -35,8 +36,12 @@ def lloyd_max_vq_train(data, num_clusters, initialization:str="random"):
 
 
 # Function to recover the original sequences from quantized data
-def recover_sequences(quantized_sequences, centroids):
-    recovered_sequences = [centroids[np.argmin(np.linalg.norm(centroids - seq, axis=1))] for seq in quantized_sequences]
+def recover_sequences(quantized_sequences, centroids, codeword_index=None):
+    # one vectorized search for all sequences, codeword_index (see create_codeword_index) can replace the exact search
+    if codeword_index is None:
+        codeword_index = BruteForceCodewordIndex(centroids)
+    labels = codeword_index.search(np.asarray(quantized_sequences))
+    recovered_sequences = list(np.asarray(centroids)[labels])
 
     return recovered_sequences
 
@@ -56,7 +61,7 @@ def lloyd_max_vq_test(test_data, model_path, num_clusters):
         
 
 if __name__ == "__main__":
-    x_train, y_train, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+    x_train, y_train, x_test, y_test, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, seed=0)
     data = np.squeeze(x_train)
     
     # Number of clusters for vector quantization
@@ -0,0 +1,48 @@
+import numpy as np
+import h5py
+
+
+class LUTDecoder:
+    def __init__(self, reconstruction_table:np.ndarray, num_embeddings:int=None, num_components:int=1) -> None:
+        """Decoder of the receiver, the reconstruction of every codeword is looked up in a precomputed table, so
+        decoding a batch of indices is a single array gather with numpy only, no TensorFlow is needed.
+
+        The table is exported from a trained VQ-VAE with export_reconstruction_table. For residual and product
+        quantizers the table has a row for every combination of the num_components indices.
+
+        Args:
+            reconstruction_table (np.ndarray): decoded windows of all codewords, shape (num_codewords, input_dim)
+            num_embeddings (int, optional): codewords per stage or sub-space, num_codewords if None. Defaults to None.
+            num_components (int, optional): number of stages or sub-spaces of the indices. Defaults to 1.
+        """
+        self.reconstruction_table = np.ascontiguousarray(reconstruction_table)
+        self.num_embeddings = len(reconstruction_table) if num_embeddings is None else num_embeddings
+        self.num_components = num_components
+        if self.num_embeddings ** num_components != len(reconstruction_table):
+            raise ValueError(f"The table has {len(reconstruction_table)} rows, expected {self.num_embeddings}**{num_components}.")
+
+
+    def flatten_indices(self, encoding_indices) -> np.ndarray:
+        """Row of the table of (num_vectors,) indices or (num_vectors, num_components) index tuples."""
+        encoding_indices = np.asarray(encoding_indices)
+        if encoding_indices.ndim == 2:
+            return np.ravel_multi_index(tuple(encoding_indices.T), (self.num_embeddings,) * self.num_components)
+        return encoding_indices
+
+
+    def decode(self, encoding_indices) -> np.ndarray:
+        """Reconstructed windows of the received indices, shape (num_vectors, input_dim)."""
+        return np.take(self.reconstruction_table, self.flatten_indices(encoding_indices), axis=0)
+
+
+    def save(self, file_path:str):
+        with h5py.File(file_path, "w") as hf:
+            hf.create_dataset("reconstruction_table", data=self.reconstruction_table)
+            hf.attrs["num_embeddings"] = self.num_embeddings
+            hf.attrs["num_components"] = self.num_components
+
+
+    @classmethod
+    def load(cls, file_path:str):
+        with h5py.File(file_path, "r") as hf:
+            return cls(hf["reconstruction_table"][:], int(hf.attrs["num_embeddings"]), int(hf.attrs["num_components"]))
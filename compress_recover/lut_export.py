@@ -0,0 +1,103 @@
+import numpy as np
+import tensorflow as tf
+import time
+
+from compress_recover.lut_decoder import LUTDecoder
+from compress_recover.product_vq import ProductVectorQuantizer
+from compress_recover.residual_vq import ResidualVectorQuantizer
+
+
+def get_num_components(quantizer) -> int:
+    """Number of indices per vector, the stages of residual and the sub-spaces of product quantizers."""
+    if isinstance(quantizer, ResidualVectorQuantizer):
+        return quantizer.num_stages
+    if isinstance(quantizer, ProductVectorQuantizer):
+        return quantizer.num_subspaces
+    return 1
+
+
+def get_table_codewords(quantizer, max_table_size:int=2**20) -> np.ndarray:
+    """Codewords of every row of the reconstruction table, shape (num_codewords, embedding_dim).
+
+    Residual and product quantizers get a row for every combination of the indices of their stages or sub-spaces, in
+    the order of np.ravel_multi_index.
+    """
+    num_components = get_num_components(quantizer)
+    if num_components > 1:
+        num_codewords = quantizer.num_embeddings ** num_components
+        if num_codewords > max_table_size:
+            raise ValueError(f"{quantizer.num_embeddings}**{num_components} index combinations exceed max_table_size {max_table_size}.")
+        combinations = np.stack(np.unravel_index(np.arange(num_codewords), (quantizer.num_embeddings,) * num_components), axis=1)
+        if isinstance(quantizer, ProductVectorQuantizer):
+            return quantizer.decode_indices(tuple(tf.constant(combinations.T))).numpy()
+        return quantizer.decode_indices(tf.constant(combinations)).numpy()
+    return tf.transpose(quantizer.embeddings).numpy()
+
+
+def export_reconstruction_table(vq_vae_trainer, file_path:str=None, batch_size:int=4096, max_table_size:int=2**20) -> LUTDecoder:
+    """Precompute the decoder output of every codeword of a trained VQVAETrainer or VQVAETrainerEMA.
+
+    The decoder only ever sees the codewords, so decoder(embeddings[:, k]) is the reconstruction of index k and the
+    receiver can decode with LUTDecoder.decode instead of the Keras decoder.
+
+    Args:
+        vq_vae_trainer: trained VQVAETrainer or VQVAETrainerEMA
+        file_path (str, optional): h5 file the table is saved to, not saved if None. Defaults to None.
+        batch_size (int, optional): number of codewords decoded at a time. Defaults to 4096.
+        max_table_size (int, optional): maximum number of rows for residual and product quantizers. Defaults to 2**20.
+
+    Returns:
+        LUTDecoder: decoder with the (num_codewords, input_dim) table
+    """
+    quantizer = vq_vae_trainer.vqvae.layers[2]
+    decoder = vq_vae_trainer.vqvae.layers[3]
+    codewords = get_table_codewords(quantizer, max_table_size)
+    reconstruction_table = np.concatenate([decoder(codewords[batch_start:batch_start + batch_size], training=False).numpy() \
+        for batch_start in range(0, len(codewords), batch_size)])
+    lut_decoder = LUTDecoder(reconstruction_table, quantizer.num_embeddings, get_num_components(quantizer))
+    if file_path is not None:
+        lut_decoder.save(file_path)
+    return lut_decoder
+
+
+def encode_indices(vq_vae_trainer, x) -> np.ndarray:
+    """Codeword indices of the transmitter for windows x, (num_windows,) or (num_windows, num_components) for
+    residual and product quantizers, the input of LUTDecoder.decode."""
+    quantizer = vq_vae_trainer.vqvae.layers[2]
+    latents = tf.reshape(vq_vae_trainer.get_latent_vector(x), [-1, quantizer.embedding_dim])
+    encoding_indices = quantizer.get_code_indices(latents)
+    if isinstance(encoding_indices, tuple):
+        return np.stack([indices.numpy() for indices in encoding_indices], axis=1)
+    return encoding_indices.numpy()
+
+
+def benchmark_lut_decoding(vq_vae_trainer, x, lut_decoder:LUTDecoder=None, batch_size:int=128, num_repetitions:int=100) -> dict:
+    """Decoding time of one batch of indices with the Keras decoder (predict on the codewords) and with the table.
+
+    Returns:
+        dict: time per batch in us of both decoders, the speed-up and the largest deviation of the reconstructions
+    """
+    if lut_decoder is None:
+        lut_decoder = export_reconstruction_table(vq_vae_trainer)
+    quantizer = vq_vae_trainer.vqvae.layers[2]
+    decoder = vq_vae_trainer.vqvae.layers[3]
+    encoding_indices = encode_indices(vq_vae_trainer, x[:batch_size])
+    codewords = get_table_codewords(quantizer)[lut_decoder.flatten_indices(encoding_indices)]
+
+    keras_reconstructions = decoder.predict(codewords, verbose=0)
+    start_time = time.perf_counter()
+    for _ in range(num_repetitions):
+        decoder.predict(codewords, verbose=0)
+    keras_time = (time.perf_counter() - start_time) / num_repetitions * 1e6
+
+    lut_reconstructions = lut_decoder.decode(encoding_indices)
+    start_time = time.perf_counter()
+    for _ in range(num_repetitions):
+        lut_decoder.decode(encoding_indices)
+    lut_time = (time.perf_counter() - start_time) / num_repetitions * 1e6
+
+    results = dict(keras_time=keras_time, lut_time=lut_time, speed_up=keras_time / lut_time, \
+        max_deviation=float(np.max(np.abs(keras_reconstructions - lut_reconstructions))))
+    print(f"Keras decoder {keras_time:10.1f} us/batch, lookup table {lut_time:8.1f} us/batch, speed-up {results['speed_up']:.0f}, "
+          f"max deviation {results['max_deviation']:.2e}")
+    return results
@@ -0,0 +1,208 @@
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.keras.layers import Layer
+
+from compress_recover.codebook_search import find_nearest_subspace_codewords, laplace_smoothing
+
+
+class ProductVectorQuantizer(Layer):
+    def __init__(self, num_embeddings, embedding_dim, num_subspaces=2, codebook_update="loss", beta=0.25, ema_decay=0.99, \
+        search_tile_size=None, laplace_epsilon=None, **kwargs):
+        """Product vector quantizer, the latent vector is split into num_subspaces sub-vectors of
+        embedding_dim // num_subspaces dimensions and every sub-vector is quantized with the codebook of its sub-space.
+
+        All sub-spaces are searched together with one batched matmul, the cost per vector is
+        num_embeddings * embedding_dim instead of num_embeddings**num_subspaces * embedding_dim of a single codebook with
+        the same num_subspaces * log2(num_embeddings) bits. The encoding indices are a tuple with the indices of every sub-space.
+
+        Args:
+            num_embeddings (int): number of codewords per sub-space
+            embedding_dim (int): dimension of the latent vectors, a multiple of num_subspaces
+            num_subspaces (int, optional): number of sub-spaces. Defaults to 2.
+            codebook_update (str, optional): "loss" trains the codebooks with the codebook loss like VectorQuantizer,
+                "ema" updates them with exponential moving averages like VectorQuantizer_EMA. Defaults to "loss".
+            beta (float, optional): commitment factor of the "loss" update. Defaults to 0.25.
+            ema_decay (float, optional): decay of the "ema" update. Defaults to 0.99.
+            search_tile_size (int, optional): number of codewords per tile, searches the sub-spaces one after the other. Defaults to None.
+            laplace_epsilon (float, optional): Laplace smoothing of the EMA counts, None for no smoothing. Defaults to None.
+        """
+        super().__init__(**kwargs)
+        if codebook_update not in ["loss", "ema"]:
+            raise ValueError("Invalid codebook_update. Supported types: 'loss' or 'ema'.")
+        if embedding_dim % num_subspaces != 0:
+            raise ValueError(f"embedding_dim {embedding_dim} is not a multiple of num_subspaces {num_subspaces}.")
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.num_subspaces = num_subspaces
+        self.subspace_dim = embedding_dim // num_subspaces
+        self.codebook_update = codebook_update
+        self.beta = beta
+        self.ema_decay = ema_decay
+        self.search_tile_size = search_tile_size
+        self.laplace_epsilon = laplace_epsilon
+        self.latents = None
+        self.encoding_indices = None
+        self.is_training_ema = True
+
+        w_init = tf.random_uniform_initializer(-1, 1)
+        self.embeddings = tf.Variable(
+            initial_value=w_init(shape=(num_subspaces, self.subspace_dim, num_embeddings), dtype="float32"),
+            trainable=True,
+            name="embeddings_pq")
+        self.embedding_sample_count = tf.Variable(
+            initial_value=tf.zeros(shape=(num_subspaces, num_embeddings), dtype="float32"),
+            trainable=False,
+            name="embedding_sample_count")
+        self.embedding_sample_accumulative_count = tf.Variable(
+            initial_value=tf.zeros(shape=(num_subspaces, num_embeddings), dtype="float32"),
+            trainable=False,
+            name="embedding_sample_accumulative_count")
+
+        if codebook_update == "ema":
+            self.ema_count = tf.Variable(
+                initial_value=tf.zeros(shape=(num_subspaces, num_embeddings), dtype="float32"),
+                trainable=False,
+                name="ema_count_pq")
+            self.count = tf.Variable(
+                initial_value=tf.zeros(shape=(num_subspaces, num_embeddings), dtype="float32"),
+                trainable=False,
+                name="count_pq")
+            self.embeddings_sum = tf.Variable(
+                initial_value=self.embeddings.numpy(),
+                trainable=False,
+                name="embeddings_sum_pq")
+
+
+    def enable_training_ema(self):
+        self.is_training_ema = True
+
+
+    def disable_training_ema(self):
+        self.is_training_ema = False
+
+
+    def split_subspaces(self, flattened_inputs):
+        """(num_vectors, embedding_dim) -> (num_subspaces, num_vectors, subspace_dim)"""
+        return tf.transpose(tf.reshape(flattened_inputs, [-1, self.num_subspaces, self.subspace_dim]), [1, 0, 2])
+
+
+    def calculate_data_points_number_per_centorid(self, x):
+        """Number of inputs assigned to every codeword of every sub-space, shape (num_subspaces, num_embeddings)."""
+        flattened = tf.reshape(x, [-1, self.embedding_dim])
+        return self.count_subspace_usage(self.get_code_indices(flattened))
+
+
+    def count_subspace_usage(self, encoding_indices):
+        # one scatter-add for all sub-spaces, the codewords of sub-space s are the segments s*num_embeddings + index
+        segment_ids = self.offset_indices(encoding_indices)
+        counts = tf.math.unsorted_segment_sum(tf.ones_like(segment_ids, dtype=tf.float32), segment_ids, \
+            self.num_subspaces * self.num_embeddings)
+        return tf.reshape(counts, [self.num_subspaces, self.num_embeddings])
+
+
+    def offset_indices(self, encoding_indices):
+        return tf.stack(encoding_indices) + tf.range(self.num_subspaces, dtype=tf.int64)[:, tf.newaxis] * self.num_embeddings
+
+
+    def call(self, x):
+        input_shape = tf.shape(x)
+        flattened = tf.reshape(x, [-1, self.embedding_dim])
+
+        encoding_indices = self.get_code_indices(flattened)
+        quantized = self.decode_indices(encoding_indices)
+
+        # keep the latents and indices of the forward pass for the trainers
+        self.latents = flattened
+        self.encoding_indices = encoding_indices
+
+        quantized = tf.reshape(quantized, input_shape)
+        if self.codebook_update == "loss":
+            # losses in the order of VectorQuantizer
+            self.add_loss(tf.reduce_mean((quantized - tf.stop_gradient(x)) ** 2))
+            self.add_loss(self.beta * tf.reduce_mean((tf.stop_gradient(quantized) - x) ** 2))
+        else:
+            # the codebooks are updated by update_ema_embeddings, only the commitment loss like VectorQuantizer_EMA
+            self.add_loss(tf.reduce_mean((tf.stop_gradient(quantized) - x) ** 2))
+
+        # Straight-through estimator.
+        return x + tf.stop_gradient(quantized - x)
+
+
+    def track_embedding_space(self, x=None, encoding_indices=None):
+        if encoding_indices is None:
+            encoding_indices = self.get_code_indices(tf.reshape(x, [-1, self.embedding_dim]))
+        count = self.count_subspace_usage(encoding_indices)
+        self.embedding_sample_count.assign(count)
+        self.embedding_sample_accumulative_count.assign(self.embedding_sample_accumulative_count + count)
+
+
+    def update_ema_embeddings(self, inputs, encoding_indices=None):
+        """EMA update of the codebooks of all sub-spaces at once, see VectorQuantizer_EMA.update_ema_embeddings."""
+        flattened_inputs = tf.reshape(inputs, [-1, self.embedding_dim])
+        if encoding_indices is None:
+            encoding_indices = self.get_code_indices(flattened_inputs)
+
+        count = self.count_subspace_usage(encoding_indices)
+        non_zero_mask = tf.not_equal(count, 0)
+        updated_ema_count = tf.where(non_zero_mask, self.ema_decay * self.ema_count + (1-self.ema_decay) * count, self.ema_count)
+
+        # sums of the sub-vectors per codeword, (num_subspaces, subspace_dim, num_embeddings) like the codebooks
+        subspace_sums = tf.math.unsorted_segment_sum(self.split_subspaces(flattened_inputs), self.offset_indices(encoding_indices), \
+            self.num_subspaces * self.num_embeddings)
+        current_embeddings_sum = tf.transpose(tf.reshape(subspace_sums, [self.num_subspaces, self.num_embeddings, self.subspace_dim]), [0, 2, 1])
+        codeword_mask = non_zero_mask[:, tf.newaxis, :]
+        updated_embeddings_sum = tf.where(codeword_mask, \
+            self.ema_decay * self.embeddings_sum + (1-self.ema_decay) * current_embeddings_sum, self.embeddings_sum)
+
+        normalizing_count = updated_ema_count
+        if self.laplace_epsilon is not None:
+            normalizing_count = tf.stack([laplace_smoothing(updated_ema_count[subspace], self.laplace_epsilon) \
+                for subspace in range(self.num_subspaces)])
+        updated_embeddings = tf.where(codeword_mask, updated_embeddings_sum / normalizing_count[:, tf.newaxis, :], self.embeddings)
+
+        self.count.assign(count)
+        self.ema_count.assign(updated_ema_count)
+        self.embeddings_sum.assign(updated_embeddings_sum)
+        self.embeddings.assign(updated_embeddings)
+        self.embedding_sample_accumulative_count.assign(self.embedding_sample_accumulative_count + count)
+
+
+    def initialize_embeddings(self, latent_space, initialization_function):
+        """Fit the codebook of every sub-space with initialization_function(data, k), e.g. kmeans_plusplus_initialization,
+        to the sub-vectors of the latents."""
+        latent_space = np.asarray(latent_space, dtype=np.float32)
+        embeddings = np.stack([initialization_function(data=latent_space[:, subspace*self.subspace_dim:(subspace+1)*self.subspace_dim], \
+            k=self.num_embeddings) for subspace in range(self.num_subspaces)]).astype(np.float32)
+        self.embeddings.assign(embeddings)
+        if self.codebook_update == "ema":
+            # keep embeddings = embeddings_sum / ema_count for the codewords that have a count
+            ema_count = self.ema_count.numpy()[:, np.newaxis, :]
+            self.embeddings_sum.assign(embeddings * np.where(ema_count > 0, ema_count, 1))
+
+
+    def get_code_indices(self, flattened_inputs):
+        """Tuple with the codeword indices of every sub-space, each of shape (num_vectors,)."""
+        subspace_indices = find_nearest_subspace_codewords(self.split_subspaces(flattened_inputs), self.embeddings, self.search_tile_size)
+        return tuple(tf.unstack(subspace_indices, num=self.num_subspaces))
+
+
+    def decode_indices(self, encoding_indices):
+        """Quantized vectors of the tuple of sub-space indices, the concatenated codewords of all sub-spaces."""
+        subspace_codewords = tf.gather(tf.transpose(self.embeddings, [0, 2, 1]), tf.stack(encoding_indices), batch_dims=1)
+        return tf.reshape(tf.transpose(subspace_codewords, [1, 0, 2]), [-1, self.embedding_dim])
+
+
+    def get_config(self):
+        config = super(ProductVectorQuantizer, self).get_config()
+        config.update({
+            'num_embeddings': self.num_embeddings,
+            'embedding_dim': self.embedding_dim,
+            'num_subspaces': self.num_subspaces,
+            'codebook_update': self.codebook_update,
+            'beta': self.beta,
+            'ema_decay': self.ema_decay,
+            'search_tile_size': self.search_tile_size,
+            'laplace_epsilon': self.laplace_epsilon
+        })
+        return config
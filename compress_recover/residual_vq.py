@@ -0,0 +1,228 @@
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.keras.layers import Layer
+
+from compress_recover.codebook_search import count_codeword_usage, find_nearest_codewords, laplace_smoothing, lookup_codewords, \
+    sum_codeword_inputs
+
+
+class ResidualVectorQuantizer(Layer):
+    def __init__(self, num_embeddings, embedding_dim, num_stages=2, codebook_update="loss", beta=0.25, ema_decay=0.99, \
+        search_tile_size=None, laplace_epsilon=None, **kwargs):
+        """Residual vector quantizer, num_stages codebooks of num_embeddings codewords where every stage quantizes
+        the residual left by the previous stages and the quantized vector is the sum of the selected codewords.
+
+        This gives num_embeddings**num_stages effective codewords and num_stages * log2(num_embeddings) bits per
+        vector at the search cost of num_stages * num_embeddings codewords. The encoding indices have the shape
+        (num_vectors, num_stages).
+
+        Args:
+            num_embeddings (int): number of codewords per stage
+            embedding_dim (int): dimension of the latent vectors
+            num_stages (int, optional): number of codebooks. Defaults to 2.
+            codebook_update (str, optional): "loss" trains the codebooks with a codebook loss per stage like
+                VectorQuantizer, "ema" updates them with exponential moving averages like VectorQuantizer_EMA. Defaults to "loss".
+            beta (float, optional): commitment factor of the "loss" update. Defaults to 0.25.
+            ema_decay (float, optional): decay of the "ema" update. Defaults to 0.99.
+            search_tile_size (int, optional): number of codewords per tile of the nearest codeword search. Defaults to None.
+            laplace_epsilon (float, optional): Laplace smoothing of the EMA counts, None for no smoothing. Defaults to None.
+        """
+        super().__init__(**kwargs)
+        if codebook_update not in ["loss", "ema"]:
+            raise ValueError("Invalid codebook_update. Supported types: 'loss' or 'ema'.")
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.num_stages = num_stages
+        self.codebook_update = codebook_update
+        self.beta = beta
+        self.ema_decay = ema_decay
+        self.search_tile_size = search_tile_size
+        self.laplace_epsilon = laplace_epsilon
+        self.latents = None
+        self.encoding_indices = None
+        self.is_training_ema = True
+
+        # the residuals shrink from stage to stage, so the codewords of stage m start in [-2^-m, 2^-m]
+        w_init = tf.random_uniform_initializer(-1, 1)
+        stage_scales = (0.5 ** np.arange(num_stages)).reshape(-1, 1, 1).astype(np.float32)
+        self.embeddings = tf.Variable(
+            initial_value=w_init(shape=(num_stages, embedding_dim, num_embeddings), dtype="float32") * stage_scales,
+            trainable=True,
+            name="embeddings_rvq")
+        self.embedding_sample_count = tf.Variable(
+            initial_value=tf.zeros(shape=(num_stages, num_embeddings), dtype="float32"),
+            trainable=False,
+            name="embedding_sample_count")
+        self.embedding_sample_accumulative_count = tf.Variable(
+            initial_value=tf.zeros(shape=(num_stages, num_embeddings), dtype="float32"),
+            trainable=False,
+            name="embedding_sample_accumulative_count")
+
+        if codebook_update == "ema":
+            self.ema_count = tf.Variable(
+                initial_value=tf.zeros(shape=(num_stages, num_embeddings), dtype="float32"),
+                trainable=False,
+                name="ema_count_rvq")
+            self.count = tf.Variable(
+                initial_value=tf.zeros(shape=(num_stages, num_embeddings), dtype="float32"),
+                trainable=False,
+                name="count_rvq")
+            self.embeddings_sum = tf.Variable(
+                initial_value=self.embeddings.numpy(),
+                trainable=False,
+                name="embeddings_sum_rvq")
+
+
+    def enable_training_ema(self):
+        self.is_training_ema = True
+
+
+    def disable_training_ema(self):
+        self.is_training_ema = False
+
+
+    def quantize_residuals(self, flattened_inputs):
+        """Stage by stage search, returns the indices of all stages, the codewords of every stage and the residual every stage quantized."""
+        residual = flattened_inputs
+        indices_list, stage_quantized_list, residual_list = list(), list(), list()
+        for stage in range(self.num_stages):
+            stage_embeddings = self.embeddings[stage]
+            stage_indices = find_nearest_codewords(residual, stage_embeddings, tile_size=self.search_tile_size)
+            stage_quantized = lookup_codewords(stage_embeddings, stage_indices)
+            indices_list.append(stage_indices)
+            stage_quantized_list.append(stage_quantized)
+            residual_list.append(residual)
+            residual = residual - stage_quantized
+        return tf.stack(indices_list, axis=1), stage_quantized_list, residual_list
+
+
+    def calculate_data_points_number_per_centorid(self, x):
+        """Number of inputs assigned to every codeword of every stage, shape (num_stages, num_embeddings)."""
+        flattened = tf.reshape(x, [-1, self.embedding_dim])
+        encoding_indices = self.get_code_indices(flattened)
+        return self.count_stage_usage(encoding_indices)
+
+
+    def count_stage_usage(self, encoding_indices):
+        return tf.stack([count_codeword_usage(encoding_indices[:, stage], self.num_embeddings) for stage in range(self.num_stages)])
+
+
+    def call(self, x):
+        input_shape = tf.shape(x)
+        flattened = tf.reshape(x, [-1, self.embedding_dim])
+
+        encoding_indices, stage_quantized_list, residual_list = self.quantize_residuals(flattened)
+        quantized = tf.add_n(stage_quantized_list)
+
+        # keep the latents and indices of the forward pass for the trainers
+        self.latents = flattened
+        self.encoding_indices = encoding_indices
+
+        if self.codebook_update == "loss":
+            # every codebook is pulled towards the residual of its stage, the losses are added in the order of VectorQuantizer
+            codebook_loss = 0.0
+            for stage_quantized, residual in zip(stage_quantized_list, residual_list):
+                codebook_loss += tf.reduce_mean((stage_quantized - tf.stop_gradient(residual)) ** 2)
+            quantized = tf.reshape(quantized, input_shape)
+            self.add_loss(codebook_loss)
+            self.add_loss(self.beta * tf.reduce_mean((tf.stop_gradient(quantized) - x) ** 2))
+        else:
+            # the codebooks are updated by update_ema_embeddings, only the commitment loss like VectorQuantizer_EMA
+            quantized = tf.reshape(quantized, input_shape)
+            self.add_loss(tf.reduce_mean((tf.stop_gradient(quantized) - x) ** 2))
+
+        # Straight-through estimator.
+        return x + tf.stop_gradient(quantized - x)
+
+
+    def track_embedding_space(self, x=None, encoding_indices=None):
+        if encoding_indices is None:
+            encoding_indices = self.get_code_indices(tf.reshape(x, [-1, self.embedding_dim]))
+        count = self.count_stage_usage(encoding_indices)
+        self.embedding_sample_count.assign(count)
+        self.embedding_sample_accumulative_count.assign(self.embedding_sample_accumulative_count + count)
+
+
+    def update_ema_embeddings(self, inputs, encoding_indices=None):
+        """EMA update of every stage with the residuals of its stage, see VectorQuantizer_EMA.update_ema_embeddings.
+
+        The residuals are rebuilt from the indices with the codebooks before the update, so they are the ones of the forward pass.
+        """
+        flattened_inputs = tf.reshape(inputs, [-1, self.embedding_dim])
+        if encoding_indices is None:
+            encoding_indices = self.get_code_indices(flattened_inputs)
+
+        residual = flattened_inputs
+        count_list, ema_count_list, embeddings_sum_list, embeddings_list = list(), list(), list(), list()
+        for stage in range(self.num_stages):
+            stage_indices = encoding_indices[:, stage]
+            count = count_codeword_usage(stage_indices, self.num_embeddings)
+            non_zero_mask = tf.not_equal(count, 0)
+
+            updated_ema_count = tf.where(non_zero_mask, self.ema_decay * self.ema_count[stage] + (1-self.ema_decay) * count, \
+                self.ema_count[stage])
+            current_embeddings_sum = sum_codeword_inputs(residual, stage_indices, self.num_embeddings)
+            updated_embeddings_sum = tf.where(non_zero_mask, \
+                self.ema_decay * self.embeddings_sum[stage] + (1-self.ema_decay) * current_embeddings_sum, self.embeddings_sum[stage])
+
+            normalizing_count = updated_ema_count
+            if self.laplace_epsilon is not None:
+                normalizing_count = laplace_smoothing(updated_ema_count, self.laplace_epsilon)
+            embeddings_list.append(tf.where(non_zero_mask, updated_embeddings_sum / normalizing_count, self.embeddings[stage]))
+
+            residual = residual - lookup_codewords(self.embeddings[stage], stage_indices)
+            count_list.append(count)
+            ema_count_list.append(updated_ema_count)
+            embeddings_sum_list.append(updated_embeddings_sum)
+
+        count = tf.stack(count_list)
+        self.count.assign(count)
+        self.ema_count.assign(tf.stack(ema_count_list))
+        self.embeddings_sum.assign(tf.stack(embeddings_sum_list))
+        self.embeddings.assign(tf.stack(embeddings_list))
+        self.embedding_sample_accumulative_count.assign(self.embedding_sample_accumulative_count + count)
+
+
+    def initialize_embeddings(self, latent_space, initialization_function):
+        """Fit the codebooks stage by stage with initialization_function(data, k), e.g. kmeans_plusplus_initialization,
+        every stage on the residuals of the latents left by the already initialized stages."""
+        residual = np.asarray(latent_space, dtype=np.float32)
+        stage_embeddings_list = list()
+        for _ in range(self.num_stages):
+            stage_embeddings = np.asarray(initialization_function(data=residual, k=self.num_embeddings), dtype=np.float32)
+            stage_indices = find_nearest_codewords(residual, stage_embeddings).numpy()
+            residual = residual - stage_embeddings.T[stage_indices]
+            stage_embeddings_list.append(stage_embeddings)
+        embeddings = np.stack(stage_embeddings_list)
+        self.embeddings.assign(embeddings)
+        if self.codebook_update == "ema":
+            # keep embeddings = embeddings_sum / ema_count for the codewords that have a count
+            ema_count = self.ema_count.numpy()[:, np.newaxis, :]
+            self.embeddings_sum.assign(embeddings * np.where(ema_count > 0, ema_count, 1))
+
+
+    def get_code_indices(self, flattened_inputs):
+        """Indices of the codewords of all stages, shape (num_vectors, num_stages)."""
+        encoding_indices, _, _ = self.quantize_residuals(flattened_inputs)
+        return encoding_indices
+
+
+    def decode_indices(self, encoding_indices):
+        """Quantized vectors of (num_vectors, num_stages) indices, the sum of the codewords of all stages."""
+        return tf.add_n([lookup_codewords(self.embeddings[stage], encoding_indices[:, stage]) for stage in range(self.num_stages)])
+
+
+    def get_config(self):
+        config = super(ResidualVectorQuantizer, self).get_config()
+        config.update({
+            'num_embeddings': self.num_embeddings,
+            'embedding_dim': self.embedding_dim,
+            'num_stages': self.num_stages,
+            'codebook_update': self.codebook_update,
+            'beta': self.beta,
+            'ema_decay': self.ema_decay,
+            'search_tile_size': self.search_tile_size,
+            'laplace_epsilon': self.laplace_epsilon
+        })
+        return config
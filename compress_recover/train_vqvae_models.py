@@ -24,11 +24,13 @@ def train_vqvae_models(params:VQVAEParams):
                 optimizer=params.optimizer,
                 init_epochs=params.init_epochs,
                 re_init_interval=params.re_init_interval,
-                simulation_index=index
+                simulation_index=index,
+                jit_compile=params.jit_compile,
+                num_stages=params.num_stages,
+                num_subspaces=params.num_subspaces
                 )
             
     elif params.vq_update_type == "ema": 
-        tf.config.run_functions_eagerly(True)
         for index in range(params.num_models):
             train_vq_vae_ema(
                 model_type=params.autoencoder_type,
@@ -43,7 +45,11 @@ def train_vqvae_models(params:VQVAEParams):
                 optimizer=params.optimizer,
                 init_epochs=params.init_epochs,
                 re_init_interval=params.re_init_interval,
-                simulation_index=index
+                simulation_index=index,
+                jit_compile=params.jit_compile,
+                laplace_epsilon=params.laplace_epsilon,
+                num_stages=params.num_stages,
+                num_subspaces=params.num_subspaces
                 )
 
 
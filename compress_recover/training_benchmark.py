@@ -0,0 +1,53 @@
+import sys
+sys.path.append("/home/zhu/Codes/Fed_Link_Adaptation")
+
+import numpy as np
+import tensorflow as tf
+import time
+
+from tensorflow.keras.optimizers import Adam
+
+from compress_recover.vq_vae import VQVAETrainer
+from compress_recover.vq_vae_ema import VQVAETrainerEMA
+
+
+def create_trainer(trainer_type:str, model_type:str, input_dim:int, latent_dim:int, num_embeddings:int):
+    if trainer_type == "embedding_loss":
+        return VQVAETrainer(model_type, 1.0, input_dim, latent_dim, num_embeddings=num_embeddings)
+    elif trainer_type == "ema":
+        return VQVAETrainerEMA(model_type, 1.0, input_dim, latent_dim, num_embeddings=num_embeddings)
+    raise ValueError("Invalid trainer_type. Supported types: 'embedding_loss' or 'ema'.")
+
+
+def benchmark_training_modes(trainer_types:list=["embedding_loss", "ema"], model_types:list=["dense", "lstm"], \
+    modes:list=["eager", "graph", "xla"], input_dim:int=40, latent_dim:int=20, num_embeddings:int=128, batch_size:int=128, \
+        num_steps:int=100, seed:int=0) -> dict:
+    """Training steps per second of the VQ-VAE trainers when train_step runs eagerly, as a tf.function graph and
+    compiled with XLA (jit_compile=True).
+
+    The windows are random, the first epoch traces and compiles the step and is not timed.
+
+    Returns:
+        dict: steps per second for every (trainer_type, model_type, mode)
+    """
+    x_train = np.random.default_rng(seed).uniform(-1, 1, (num_steps * batch_size, input_dim)).astype(np.float32)
+    results = dict()
+    for trainer_type in trainer_types:
+        for model_type in model_types:
+            for mode in modes:
+                tf.keras.utils.set_random_seed(seed)
+                vq_vae_trainer = create_trainer(trainer_type, model_type, input_dim, latent_dim, num_embeddings)
+                vq_vae_trainer.compile(optimizer=Adam(learning_rate=2e-3), run_eagerly=(mode == "eager"), jit_compile=(mode == "xla"))
+                vq_vae_trainer.build((None, input_dim))
+                vq_vae_trainer.fit(x_train[:4*batch_size], epochs=1, batch_size=batch_size, verbose=0)
+
+                start_time = time.perf_counter()
+                vq_vae_trainer.fit(x_train, epochs=1, batch_size=batch_size, verbose=0)
+                steps_per_second = num_steps / (time.perf_counter() - start_time)
+                results[(trainer_type, model_type, mode)] = steps_per_second
+                print(f"{trainer_type:>14s} {model_type:>5s} {mode:>5s}: {steps_per_second:8.1f} steps/s")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_training_modes()
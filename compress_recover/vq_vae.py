@@ -3,8 +3,7 @@ import matplotlib.pyplot as plt
 import tensorflow as tf
 import os
 import h5py
-
-tf.config.run_functions_eagerly(True)
+import weakref
 
 import sys 
 sys.path.append("/home/zhu/Codes/Fed_Link_Adaptation")
@@ -20,17 +19,31 @@ from tensorflow.keras.callbacks import EarlyStopping
 from sklearn.metrics import mean_squared_error
 
 from Interference_prediction import data_preprocessing
+from Interference_prediction.online_data import OnlineSINRWindowSource, prepare_vq_vae_data
 from Re_initialization.kmpp import kmeans_plusplus_initialization
 from Re_initialization.pca_splitting_initialization import pca_split_initialization
 from compress_recover.auto_encoder import create_dense_encoder, create_dense_decoder, create_lstm_encoder, create_lstm_decoder
 from compress_recover.entropy_callbacks import LatentEntropyCallback
+from compress_recover.codebook_search import count_codeword_usage, find_nearest_codewords, lookup_codewords
+from compress_recover.residual_vq import ResidualVectorQuantizer
+from compress_recover.codeword_index import create_codeword_index, get_index_path, load_codeword_index, reset_compiled_functions, \
+    save_codeword_index, search_codeword_index
+from compress_recover.product_vq import ProductVectorQuantizer
 
 
 class VectorQuantizer(Layer):
-    def __init__(self, num_embeddings, embedding_dim, beta=0.25, **kwargs):
+    def __init__(self, num_embeddings, embedding_dim, beta=0.25, search_tile_size=None, **kwargs):
         super().__init__(**kwargs)
         self.embedding_dim = embedding_dim
         self.num_embeddings = num_embeddings
+        # number of codewords per tile of the nearest codeword search, None searches the whole codebook at once
+        self.search_tile_size = search_tile_size
+        # nearest codeword index for inference, see build_search_index
+        self.search_index = None
+        # models built around the layer, their traced functions are reset when the search index changes
+        self.owning_models = weakref.WeakSet()
+        self.latents = None
+        self.encoding_indices = None
 
         # The `beta` parameter is best kept between [0.25, 2] as per the paper.
         self.beta = beta
@@ -53,37 +66,10 @@ class VectorQuantizer(Layer):
             name="embedding_sample_accumulative_count")
         
     
-    def set_auxiliary_trainable_true(self):
-        self.embedding_sample_count = tf.Variable(
-            initial_value=self.embedding_sample_count,
-            trainable=True,
-            name = "embedding_sample_count"
-        )
-        self.embedding_sample_accumulative_count = tf.Variable(
-            initial_value=self.embedding_sample_accumulative_count,
-            trainable=True,
-            name="embedding_sample_accumualtive_count"
-        )
-    
-    
-    def set_auxiliary_trainable_false(self):
-        self.embedding_sample_count = tf.Variable(
-            initial_value=self.embedding_sample_count,
-            trainable=False,
-            name = "embedding_sample_count"
-        )
-        self.embedding_sample_accumulative_count = tf.Variable(
-            initial_value=self.embedding_sample_accumulative_count,
-            trainable=False,
-            name="embedding_sample_accumualtive_count"
-        )
-    
-    
     def calculate_data_points_number_per_centorid(self, x):
         flattened = tf.reshape(x, [-1, self.embedding_dim])
         encoding_indices = self.get_code_indices(flattened)
-        encodings = tf.one_hot(encoding_indices, self.num_embeddings)
-        data_points_number_per_centorid = tf.reduce_sum(encodings, axis=0)
+        data_points_number_per_centorid = count_codeword_usage(encoding_indices, self.num_embeddings)
         return data_points_number_per_centorid
 
 
@@ -95,8 +81,12 @@ class VectorQuantizer(Layer):
 
         # Quantization.
         encoding_indices = self.get_code_indices(flattened)
-        encodings = tf.one_hot(encoding_indices, self.num_embeddings)
-        quantized = tf.matmul(encodings, self.embeddings, transpose_b=True)
+        quantized = lookup_codewords(self.embeddings, encoding_indices)
+
+        # keep the latents and indices of the forward pass, so the trainers reuse them instead of running the
+        # encoder and the search again
+        self.latents = flattened
+        self.encoding_indices = encoding_indices
 
         # Reshape the quantized values back to the original input shape
         quantized = tf.reshape(quantized, input_shape)
@@ -117,32 +107,60 @@ class VectorQuantizer(Layer):
         return quantized
     
     
-    def track_embedding_space(self, x):
-        input_shape = tf.shape(x)
-        flattened = tf.reshape(x, [-1, self.embedding_dim])
-
-        # Quantization.
-        encoding_indices = self.get_code_indices(flattened)
-        encodings = tf.one_hot(encoding_indices, self.num_embeddings)
+    def track_embedding_space(self, x=None, encoding_indices=None):
+        # Quantization, unless the indices of the forward pass are given.
+        if encoding_indices is None:
+            flattened = tf.reshape(x, [-1, self.embedding_dim])
+            encoding_indices = self.get_code_indices(flattened)
         
         # Count how many samples will be assigned to which embeddings.
-        count = tf.reduce_sum(encodings, 0)
+        count = count_codeword_usage(encoding_indices, self.num_embeddings)
         self.embedding_sample_count.assign(count)
         self.embedding_sample_accumulative_count.assign(self.embedding_sample_accumulative_count + count)
          
 
-    def get_code_indices(self, flattened_inputs):
+    def get_code_indices(self, flattened_inputs, embedding_norms=None):
+        # the index of build_search_index replaces the exact search at inference
+        if self.search_index is not None:
+            return search_codeword_index(self.search_index, flattened_inputs)
         # Calculate L2-normalized distance between the inputs and the codes.
-        similarity = tf.matmul(flattened_inputs, self.embeddings)
-        distances = (
-            tf.reduce_sum(flattened_inputs**2, axis=1, keepdims=True)
-            + tf.reduce_sum(self.embeddings**2, axis=0)
-            - 2 * similarity
-        )
+        return find_nearest_codewords(flattened_inputs, self.embeddings, embedding_norms, self.search_tile_size)
+
+
+    def build_search_index(self, backend:str="ivf", **index_kwargs):
+        """Build a nearest codeword index of the trained embeddings for inference, see create_codeword_index.
+
+        get_code_indices uses the index until clear_search_index is called, so build it after the training, the index
+        does not follow later updates of the embeddings.
+        """
+        self.search_index = create_codeword_index(tf.transpose(self.embeddings).numpy(), backend, **index_kwargs)
+        self.reset_owning_models()
+        return self.search_index
+
+
+    def load_search_index(self, file_path:str):
+        self.search_index = load_codeword_index(file_path)
+        self.reset_owning_models()
+
 
-        # Derive the indices for minimum distances.
-        encoding_indices = tf.argmin(distances, axis=1)
-        return encoding_indices
+    def clear_search_index(self):
+        self.search_index = None
+        self.reset_owning_models()
+
+
+    def register_owning_model(self, model):
+        self.owning_models.add(model)
+
+
+    def reset_owning_models(self):
+        # get_code_indices checks search_index in Python, the check is fixed in the traced functions of the models
+        for model in self.owning_models:
+            reset_compiled_functions(model)
+
+
+    def initialize_embeddings(self, latent_space, initialization_function):
+        """Assign the codewords of initialization_function(data, k), e.g. kmeans_plusplus_initialization, fitted to the latents."""
+        self.embeddings.assign(initialization_function(data=latent_space, k=self.num_embeddings))
     
         
     def get_config(self):
@@ -150,6 +168,7 @@ class VectorQuantizer(Layer):
         config.update({
             'num_embeddings': self.num_embeddings,
             'embedding_dim': self.embedding_dim,
+            'search_tile_size': self.search_tile_size,
             'embedding_sample_count': self.embedding_sample_count.numpy().tolist(),
             'embedding_sample_accumulative_count': self.embedding_sample_accumulative_count.numpy().tolist(),
         })
@@ -157,7 +176,7 @@ class VectorQuantizer(Layer):
 
     
 def create_quantized_autoencoder(type:str, input_dim, latent_dim, output_dim, num_embeddings:int=128, \
-    with_batch_normalization:bool=False, print_model:str=False):
+    with_batch_normalization:bool=False, print_model:str=False, search_tile_size:int=None, num_stages:int=1, num_subspaces:int=1):
     if type == "dense":
         encoder = create_dense_encoder(input_dim, latent_dim)
         decoder = create_dense_decoder(output_dim, latent_dim)
@@ -165,7 +184,18 @@ def create_quantized_autoencoder(type:str, input_dim, latent_dim, output_dim, nu
         encoder = create_lstm_encoder(input_dim, latent_dim)
         decoder = create_lstm_decoder(input_dim, latent_dim)
     
-    quantizer = VectorQuantizer(num_embeddings=num_embeddings, embedding_dim=latent_dim)
+    if num_stages > 1 and num_subspaces > 1:
+        raise ValueError("Residual (num_stages > 1) and product (num_subspaces > 1) quantization can not be combined.")
+    if num_stages > 1:
+        # residual quantization with num_stages codebooks of num_embeddings codewords
+        quantizer = ResidualVectorQuantizer(num_embeddings=num_embeddings, embedding_dim=latent_dim, num_stages=num_stages, \
+            codebook_update="loss", search_tile_size=search_tile_size)
+    elif num_subspaces > 1:
+        # product quantization with a codebook of num_embeddings codewords per sub-space
+        quantizer = ProductVectorQuantizer(num_embeddings=num_embeddings, embedding_dim=latent_dim, num_subspaces=num_subspaces, \
+            codebook_update="loss", search_tile_size=search_tile_size)
+    else:
+        quantizer = VectorQuantizer(num_embeddings=num_embeddings, embedding_dim=latent_dim, search_tile_size=search_tile_size)
     batch_norm_layer = BatchNormalization()
     
     if print_model:
@@ -181,18 +211,26 @@ def create_quantized_autoencoder(type:str, input_dim, latent_dim, output_dim, nu
     decoder_output = decoder(encoder_outputs_quantized)
     
     vector_quant_autoencoder = Model(inputs=inputs, outputs=decoder_output, name="vector_quantized_autoencoder")
+    if isinstance(quantizer, VectorQuantizer):
+        quantizer.register_owning_model(vector_quant_autoencoder)
     return vector_quant_autoencoder
 
 
 class VQVAETrainer(Model):
-    def __init__(self, model_type, train_variance, input_dim, latent_dim=10, num_embeddings=128, with_bn_layer:bool=False, **kwargs):
+    def __init__(self, model_type, train_variance, input_dim, latent_dim=10, num_embeddings=128, with_bn_layer:bool=False, \
+        search_tile_size:int=None, num_stages:int=1, num_subspaces:int=1, **kwargs):
         super().__init__(**kwargs)
         self.train_variance = train_variance
         self.latent_dim = latent_dim
         self.input_dim = input_dim
         self.num_embeddings = num_embeddings
+        self.num_stages = num_stages
+        self.num_subspaces = num_subspaces
 
-        self.vqvae = create_quantized_autoencoder(model_type, self.input_dim, self.latent_dim, self.input_dim, self.num_embeddings, with_bn_layer)
+        self.vqvae = create_quantized_autoencoder(model_type, self.input_dim, self.latent_dim, self.input_dim, self.num_embeddings, with_bn_layer, \
+            search_tile_size=search_tile_size, num_stages=num_stages, num_subspaces=num_subspaces)
+        if isinstance(self.vqvae.layers[2], VectorQuantizer):
+            self.vqvae.layers[2].register_owning_model(self)
         self.vqvae.summary()
 
         self.total_loss_tracker = keras.metrics.Mean(name="total_loss")
@@ -239,9 +277,9 @@ class VQVAETrainer(Model):
         grads = tape.gradient(total_loss, self.vqvae.trainable_variables)
         self.optimizer.apply_gradients(zip(grads, self.vqvae.trainable_variables))
         
-        # track latent variable and embedding space
-        latent_var = self.get_latent_vector(x)
-        self.vqvae.layers[2].track_embedding_space(latent_var)
+        # track the embedding space with the indices of the forward pass
+        quantizer = self.vqvae.layers[2]
+        quantizer.track_embedding_space(encoding_indices=quantizer.encoding_indices)
 
         # Loss tracking.
         self.total_loss_tracker.update_state(total_loss)
@@ -264,8 +302,10 @@ class VQVAETrainer(Model):
     
     
     def save_model_weights(self, file_path):
-        self.vqvae.layers[2].set_auxiliary_trainable_true()
         self.vqvae.save_weights(file_path)
+        # a nearest codeword index is saved next to the weights, see get_index_path
+        if getattr(self.vqvae.layers[2], "search_index", None) is not None:
+            save_codeword_index(self.vqvae.layers[2].search_index, get_index_path(file_path))
 
 
 
@@ -282,19 +322,16 @@ class CountActivdeEmbeddings(keras.callbacks.Callback):
         
     
 def train_vq_vae(model_type:str, inputs_dims:int, latent_dims:int, num_embeddings:int, embedding_init:str="random",\
-    num_epochs:int=300, plot_figure:bool=True, optimizer:str="adam", init_epochs:int=100, re_init_interval:int=20, simulation_index:int=None):
-    
-    x_train, _, x_test, _, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
-    x_train = np.squeeze(x_train)
-    x_test = np.squeeze(x_test)
-    
-    x_train = np.array(x_train)
-    x_test = np.array(x_test)
+    num_epochs:int=300, plot_figure:bool=True, optimizer:str="adam", init_epochs:int=100, re_init_interval:int=20, simulation_index:int=None, \
+        online_source:OnlineSINRWindowSource=None, steps_per_epoch:int=1000, num_reference_windows:int=80000, \
+        window_samplers:tuple=None, jit_compile:bool=False, num_stages:int=1, num_subspaces:int=1):
     
-    variance = np.var(x_train)
+    train_reference, x_test, variance, fit_arguments = prepare_vq_vae_data(batch_size=64, online_source=online_source, \
+        steps_per_epoch=steps_per_epoch, num_reference_windows=num_reference_windows, window_samplers=window_samplers)
     
-    vq_vae_trainer = VQVAETrainer(model_type, variance, inputs_dims, latent_dims, num_embeddings=num_embeddings)
-    vq_vae_trainer.compile(optimizer=optimizer)
+    vq_vae_trainer = VQVAETrainer(model_type, variance, inputs_dims, latent_dims, num_embeddings=num_embeddings, num_stages=num_stages, \
+        num_subspaces=num_subspaces)
+    vq_vae_trainer.compile(optimizer=optimizer, jit_compile=jit_compile)
     
     vq_vae_trainer.build((None, inputs_dims))
     
@@ -313,7 +350,7 @@ def train_vq_vae(model_type:str, inputs_dims:int, latent_dims:int, num_embedding
     
     early_stopping = EarlyStopping(monitor="val_total_loss", patience=20, mode="min")
     if embedding_init == "random":
-        history = vq_vae_trainer.fit(x=x_train, validation_split=0.2, epochs=num_epochs, batch_size=64, \
+        history = vq_vae_trainer.fit(**fit_arguments, epochs=num_epochs, \
             callbacks=[LearningRateTracker(), active_embedding_tracker, latent_entropy_callback])
         
     elif embedding_init == "kmpp" or "pca":
@@ -323,7 +360,7 @@ def train_vq_vae(model_type:str, inputs_dims:int, latent_dims:int, num_embedding
         
         for epoch in range(num_epochs):
             print(f"Training epochs: {epoch}/{num_epochs}:")
-            history_single_epoch = vq_vae_trainer.fit(x=x_train, validation_split=0.2, epochs=1, batch_size=64, \
+            history_single_epoch = vq_vae_trainer.fit(**fit_arguments, epochs=1, \
                 callbacks=[LearningRateTracker(), active_embedding_tracker, latent_entropy_callback])
             if epoch == 0:              # initialize history object
                 history = history_single_epoch
@@ -335,19 +372,21 @@ def train_vq_vae(model_type:str, inputs_dims:int, latent_dims:int, num_embedding
                 # assign updates weights to encoder
                 encoder_model.set_weights(vq_vae_trainer.vqvae.layers[1].get_weights())
                 # use new latent variable to renitialize centriods using kmpp
-                latent_space = encoder_model.predict(x_train)
+                latent_space = encoder_model.predict(train_reference)
                 if embedding_init == "kmpp":
-                    kmpp_centroids = kmeans_plusplus_initialization(data=latent_space, k=num_embeddings)
-                    vq_vae_trainer.vqvae.layers[2].embeddings.assign(kmpp_centroids)
+                    vq_vae_trainer.vqvae.layers[2].initialize_embeddings(latent_space, kmeans_plusplus_initialization)
                 elif embedding_init == "pca":
-                    pca_centroids = pca_split_initialization(data=latent_space, k=num_embeddings)
-                    vq_vae_trainer.vqvae.layers[2].embeddings.assign(pca_centroids)
+                    vq_vae_trainer.vqvae.layers[2].initialize_embeddings(latent_space, pca_split_initialization)
     num_active_embeddings_list = active_embedding_tracker.num_active_embeddings_list
     latent_entropy_list = latent_entropy_callback.entropy_values_list
     
     
     # save training history and weights
     file_name = f"{model_type}_vq_vae_input_{inputs_dims}_latent_{latent_dims}_num_embeddings_{num_embeddings}_init_{embedding_init}_{optimizer}"
+    if num_stages > 1:
+        file_name = file_name + "_stages_" + str(num_stages)
+    if num_subspaces > 1:
+        file_name = file_name + "_subspaces_" + str(num_subspaces)
     if simulation_index != None:
         file_name = file_name + "_index_" + str(simulation_index)
     file_name = file_name + '.h5'
@@ -393,7 +432,7 @@ def test_vq_vae(inputs_dims:int, latent_dims:int, num_embeddings, plot_figure:bo
     vq_vae = create_quantized_autoencoder(inputs_dims, latent_dims, inputs_dims)
     vq_vae.load_weights("models/vq_vae_models/vq_vae_input_40_latent_10_num_embeddings_128.h5")
     
-    _, _, x_test, _, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+    _, _, x_test, _, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, shuffle_samples=False)
     x_test = np.squeeze(x_test)
     x_test_recover = vq_vae.predict(x_test)
     mse = mean_squared_error(x_test, x_test_recover)
@@ -12,14 +12,18 @@ from tensorflow.keras import backend as K
 from sklearn.metrics import mean_squared_error
 
 from Interference_prediction import data_preprocessing
+from compress_recover.codebook_search import calculate_embedding_norms, count_codeword_usage, find_nearest_codewords, lookup_codewords, \
+    sum_codeword_inputs
 
 
 
 class VectorQuantizer_cluster(Layer):
-    def __init__(self, num_embeddings, embedding_dim, beta=0.25, **kwargs):
+    def __init__(self, num_embeddings, embedding_dim, beta=0.25, search_tile_size=None, **kwargs):
         super().__init__(**kwargs)
         self.embedding_dim = embedding_dim
         self.num_embeddings = num_embeddings
+        # number of codewords per tile of the nearest codeword search, None searches the whole codebook at once
+        self.search_tile_size = search_tile_size
 
         # The `beta` parameter is best kept between [0.25, 2] as per the paper.
         self.beta = beta
@@ -56,16 +60,16 @@ class VectorQuantizer_cluster(Layer):
         input_shape = tf.shape(x)
         flattened = tf.reshape(x, [-1, self.embedding_dim])
 
-        # Quantization.
-        encoding_indices = self.get_code_indices(flattened)
-        encodings = tf.one_hot(encoding_indices, self.num_embeddings)
-        quantized = tf.matmul(encodings, self.embeddings, transpose_b=True)
+        # Quantization, the codeword norms are reused by the cluster update of the same inputs.
+        embedding_norms = calculate_embedding_norms(self.embeddings)
+        encoding_indices = self.get_code_indices(flattened, embedding_norms)
+        quantized = lookup_codewords(self.embeddings, encoding_indices)
 
         # Reshape the quantized values back to the original input shape
         quantized = tf.reshape(quantized, input_shape)
         
         if self.is_training_cluster:
-            self.update_cluster_embeddings(x)
+            self.update_cluster_embeddings(x, embedding_norms)
 
         # Calculate vector quantization loss and add that to the layer. You can learn more
         # about adding losses to different layers here:
@@ -80,21 +84,20 @@ class VectorQuantizer_cluster(Layer):
         return quantized
 
 
-    def update_cluster_embeddings(self, inputs):
+    def update_cluster_embeddings(self, inputs, embedding_norms=None):
         flattened_inputs = tf.reshape(inputs, [-1, self.embedding_dim])
 
-        # Calculate the encoding indices based on the flattened inputs
-        encoding_indices = self.get_code_indices(flattened_inputs)
-        encodings = tf.one_hot(encoding_indices, self.num_embeddings)
+        # Calculate the encoding indices based on the flattened inputs, embedding_norms are the norms of the current embeddings or None
+        encoding_indices = self.get_code_indices(flattened_inputs, embedding_norms)
         
         # Calculate the count of each codebook vector based on the encoding indices
-        count = tf.reduce_sum(encodings, 0)
+        count = count_codeword_usage(encoding_indices, self.num_embeddings)
 
         # Update the clustering count
         self.sample_count.assign(self.sample_count + count)
 
         # Calculate the sum of embeddings
-        embeddings_sum = tf.matmul(flattened_inputs, encodings, transpose_a=True)
+        embeddings_sum = sum_codeword_inputs(flattened_inputs, encoding_indices, self.num_embeddings)
         updated_embeddings_sum = self.embeddings_sum + embeddings_sum
 
         # Normalize the updated codebook embeddings using the count
@@ -118,25 +121,17 @@ class VectorQuantizer_cluster(Layer):
 
 
 
-    def get_code_indices(self, flattened_inputs):
+    def get_code_indices(self, flattened_inputs, embedding_norms=None):
         # Calculate L2-normalized distance between the inputs and the codes.
-        similarity = tf.matmul(flattened_inputs, self.embeddings)
-        distances = (
-            tf.reduce_sum(flattened_inputs**2, axis=1, keepdims=True)
-            + tf.reduce_sum(self.embeddings**2, axis=0)
-            - 2 * similarity
-        )
-
-        # Derive the indices for minimum distances.
-        encoding_indices = tf.argmin(distances, axis=1)
-        return encoding_indices
+        return find_nearest_codewords(flattened_inputs, self.embeddings, embedding_norms, self.search_tile_size)
     
     
     def get_config(self):
         config = super(VectorQuantizer_cluster, self).get_config()
         config.update({
             'num_embeddings': self.num_embeddings,
-            'embedding_dim': self.embedding_dim
+            'embedding_dim': self.embedding_dim,
+            'search_tile_size': self.search_tile_size
         })
         return config 
 
@@ -178,10 +173,11 @@ def create_decoder(latent_dim, output_dim):
     return decoder
     
     
-def create_quantized_autoencoder_cluster(input_dim, latent_dim, output_dim, num_embeddings:int=128, with_batch_normalization:bool=False):
+def create_quantized_autoencoder_cluster(input_dim, latent_dim, output_dim, num_embeddings:int=128, with_batch_normalization:bool=False, \
+    search_tile_size:int=None):
     encoder = create_encoder(input_dim, latent_dim)
     decoder = create_decoder(latent_dim, output_dim)
-    quantizer = VectorQuantizer_cluster(num_embeddings=num_embeddings, embedding_dim=latent_dim)
+    quantizer = VectorQuantizer_cluster(num_embeddings=num_embeddings, embedding_dim=latent_dim, search_tile_size=search_tile_size)
     bn_layer = BatchNormalization()
     
     quantizer.enable_training_cluster()
@@ -313,7 +309,7 @@ def test_vq_vae(inputs_dims:int, latent_dims:int, num_embeddings, plot_figure:bo
     vq_cluster_layer.disable_training_cluster()
     
     # prepare dat
-    _, _, x_test, _, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+    _, _, x_test, _, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, shuffle_samples=False)
     x_test_recover = vq_vae_cluster.predict(x_test)
     
     if plot_figure:
@@ -2,12 +2,9 @@
 import sys 
 sys.path.append("/home/zhu/Codes/Fed_Link_Adaptation")
 
-import numpy as np
 import matplotlib.pyplot as plt
 import tensorflow as tf
 
-tf.config.run_functions_eagerly(True)
-
 import logging
 tf.get_logger().setLevel(logging.ERROR)
 
@@ -15,6 +12,7 @@ from tensorflow.keras import backend as K
 
 import os
 import h5py
+import weakref
 
 from tensorflow import keras
 from tensorflow.keras.models import Model
@@ -26,25 +24,42 @@ from tensorflow.keras.optimizers import RMSprop, Adam
 from sklearn.metrics import mean_squared_error
 
 from Interference_prediction import data_preprocessing
+from Interference_prediction.online_data import OnlineSINRWindowSource, prepare_vq_vae_data
 from Re_initialization.kmpp import kmeans_plusplus_initialization
 from Re_initialization.pca_splitting_initialization import pca_split_initialization
 from compress_recover.auto_encoder import create_dense_encoder, create_dense_decoder, \
     create_lstm_encoder, create_lstm_decoder
 from compress_recover.entropy_callbacks import LatentEntropyCallback
+from compress_recover.codebook_search import count_codeword_usage, find_nearest_codewords, laplace_smoothing, lookup_codewords, \
+    sum_codeword_inputs
+from compress_recover.residual_vq import ResidualVectorQuantizer
+from compress_recover.codeword_index import create_codeword_index, get_index_path, load_codeword_index, reset_compiled_functions, \
+    save_codeword_index, search_codeword_index
+from compress_recover.product_vq import ProductVectorQuantizer
     
     
 import pdb
 
 
 class VectorQuantizer_EMA(Layer):
-    def __init__(self, num_embeddings, embedding_dim, beta=1, ema_decay=0.85, **kwargs):
+    def __init__(self, num_embeddings, embedding_dim, beta=1, ema_decay=0.85, search_tile_size=None, laplace_epsilon=None, **kwargs):
         super().__init__(**kwargs)
         self.embedding_dim = embedding_dim
         self.num_embeddings = num_embeddings
+        # number of codewords per tile of the nearest codeword search, None searches the whole codebook at once
+        self.search_tile_size = search_tile_size
+        # nearest codeword index for inference, see build_search_index
+        self.search_index = None
+        # models built around the layer, their traced functions are reset when the search index changes
+        self.owning_models = weakref.WeakSet()
+        self.latents = None
+        self.encoding_indices = None
 
         # The `beta` parameter is best kept between [0.25, 2] as per the paper.
         self.beta = beta
         self.ema_decay = ema_decay
+        # Laplace smoothing of ema_count when the codewords are normalized, None for no smoothing
+        self.laplace_epsilon = laplace_epsilon
         
         self.is_training_ema = True
 
@@ -86,8 +101,7 @@ class VectorQuantizer_EMA(Layer):
     def calculate_data_points_number_per_centorid(self, x):
         flattened = tf.reshape(x, [-1, self.embedding_dim])
         encoding_indices = self.get_code_indices(flattened)
-        encodings = tf.one_hot(encoding_indices, self.num_embeddings)
-        data_points_number_per_centorid = tf.reduce_sum(encodings, axis=0)
+        data_points_number_per_centorid = count_codeword_usage(encoding_indices, self.num_embeddings)
         return data_points_number_per_centorid
         
 
@@ -99,8 +113,12 @@ class VectorQuantizer_EMA(Layer):
 
         # Quantization.
         encoding_indices = self.get_code_indices(flattened)
-        encodings = tf.one_hot(encoding_indices, self.num_embeddings)
-        quantized = tf.matmul(encodings, self.embeddings, transpose_b=True)
+        quantized = lookup_codewords(self.embeddings, encoding_indices)
+
+        # keep the latents and indices of the forward pass, so the trainers reuse them instead of running the
+        # encoder and the search again
+        self.latents = flattened
+        self.encoding_indices = encoding_indices
 
         # Reshape the quantized values back to the original input shape
         quantized = tf.reshape(quantized, input_shape)
@@ -121,16 +139,16 @@ class VectorQuantizer_EMA(Layer):
         return quantized
 
 
-    def update_ema_embeddings(self, inputs):
-        flattened_inputs = tf.reshape(inputs, [-1, self.embedding_dim])\
+    def update_ema_embeddings(self, inputs, encoding_indices=None):
+        flattened_inputs = tf.reshape(inputs, [-1, self.embedding_dim])
         
-        # Calculate the encoding indices based on the flattened inputs
-        encoding_indices = self.get_code_indices(flattened_inputs)
-        encodings = tf.one_hot(encoding_indices, self.num_embeddings)
+        # Calculate the encoding indices based on the flattened inputs, unless the indices of the forward pass are given
+        if encoding_indices is None:
+            encoding_indices = self.get_code_indices(flattened_inputs)
         
         # Calculate the count of each codebook vector based on the encoding indices
         # count here should be a 1-d vector of length num_embeedings, i-th element indicates the number of usages for i-th codework in embedding space.
-        count = tf.reduce_sum(encodings, 0)   
+        count = count_codeword_usage(encoding_indices, self.num_embeddings)
         non_zero_mask = tf.not_equal(count, 0)
 
         # Update the EMA count using the decay factor
@@ -156,17 +174,20 @@ class VectorQuantizer_EMA(Layer):
         
         # Equations from original paper    
         # Calculate the EMA of the codebook embeddings
-        current_embeddings_sum = tf.matmul(flattened_inputs, encodings, transpose_a=True)
+        current_embeddings_sum = sum_codeword_inputs(flattened_inputs, encoding_indices, self.num_embeddings)
         updated_embeddings_sum = tf.where(
             condition=non_zero_mask,
             x=self.ema_decay * self.embeddings_sum + (1-self.ema_decay) * current_embeddings_sum,
             y=self.embeddings_sum
         )
 
-        # Normalize the updated codebook embeddings using the count
+        # Normalize the updated codebook embeddings using the count, Laplace smoothed if laplace_epsilon is set
+        normalizing_count = updated_ema_count
+        if self.laplace_epsilon is not None:
+            normalizing_count = laplace_smoothing(updated_ema_count, self.laplace_epsilon)
         updated_embeddings = tf.where(
             condition=non_zero_mask,
-            x=updated_embeddings_sum / updated_ema_count,
+            x=updated_embeddings_sum / normalizing_count,
             y=updated_embeddings_sum
         )
 
@@ -179,30 +200,64 @@ class VectorQuantizer_EMA(Layer):
         self.embedding_sample_accumulative_count.assign(self.embedding_sample_accumulative_count + count)
         
 
-    def get_code_indices(self, flattened_inputs):
+    def get_code_indices(self, flattened_inputs, embedding_norms=None):
+        # the index of build_search_index replaces the exact search at inference
+        if self.search_index is not None:
+            return search_codeword_index(self.search_index, flattened_inputs)
         # Calculate L2-normalized distance between the inputs and the codes.
-        similarity = tf.matmul(flattened_inputs, self.embeddings)
-        distances = (
-            tf.reduce_sum(flattened_inputs**2, axis=1, keepdims=True)
-            + tf.reduce_sum(self.embeddings**2, axis=0)
-            - 2 * similarity
-        )
-        # Derive the indices for minimum distances.
-        encoding_indices = tf.argmin(distances, axis=1)
-        return encoding_indices
+        return find_nearest_codewords(flattened_inputs, self.embeddings, embedding_norms, self.search_tile_size)
+
+
+    def build_search_index(self, backend:str="ivf", **index_kwargs):
+        """Build a nearest codeword index of the trained embeddings for inference, see create_codeword_index.
+
+        get_code_indices uses the index until clear_search_index is called, so build it after the training, the index
+        does not follow later updates of the embeddings.
+        """
+        self.search_index = create_codeword_index(tf.transpose(self.embeddings).numpy(), backend, **index_kwargs)
+        self.reset_owning_models()
+        return self.search_index
+
+
+    def load_search_index(self, file_path:str):
+        self.search_index = load_codeword_index(file_path)
+        self.reset_owning_models()
+
+
+    def clear_search_index(self):
+        self.search_index = None
+        self.reset_owning_models()
+
+
+    def register_owning_model(self, model):
+        self.owning_models.add(model)
+
+
+    def reset_owning_models(self):
+        # get_code_indices checks search_index in Python, the check is fixed in the traced functions of the models
+        for model in self.owning_models:
+            reset_compiled_functions(model)
+
+
+    def initialize_embeddings(self, latent_space, initialization_function):
+        """Assign the codewords of initialization_function(data, k), e.g. kmeans_plusplus_initialization, fitted to the latents."""
+        self.embeddings.assign(initialization_function(data=latent_space, k=self.num_embeddings))
     
     
     def get_config(self):
         config = super(VectorQuantizer_EMA, self).get_config()
         config.update({
             'num_embeddings': self.num_embeddings,
-            'embedding_dim': self.embedding_dim
+            'embedding_dim': self.embedding_dim,
+            'search_tile_size': self.search_tile_size,
+            'laplace_epsilon': self.laplace_epsilon
         })
         return config 
     
     
 def create_quantized_autoencoder_EMA(model_type, input_dim, latent_dim, output_dim, num_embeddings:int=128,\
-    ema_decay:float=0.99, commitment_factor:float=0.25):
+    ema_decay:float=0.99, commitment_factor:float=0.25, search_tile_size:int=None, laplace_epsilon:float=None, num_stages:int=1, \
+    num_subspaces:int=1):
     if model_type == "dense":
         encoder = create_dense_encoder(input_dim, latent_dim)
         decoder = create_dense_decoder(output_dim, latent_dim)
@@ -210,8 +265,19 @@ def create_quantized_autoencoder_EMA(model_type, input_dim, latent_dim, output_d
         encoder = create_lstm_encoder(input_dim, latent_dim)
         decoder = create_lstm_decoder(output_dim, latent_dim)
         
-    quantizer = VectorQuantizer_EMA(num_embeddings=num_embeddings, embedding_dim=latent_dim, \
-        ema_decay=ema_decay, beta=commitment_factor)
+    if num_stages > 1 and num_subspaces > 1:
+        raise ValueError("Residual (num_stages > 1) and product (num_subspaces > 1) quantization can not be combined.")
+    if num_stages > 1:
+        # residual quantization with num_stages codebooks of num_embeddings codewords
+        quantizer = ResidualVectorQuantizer(num_embeddings=num_embeddings, embedding_dim=latent_dim, num_stages=num_stages, \
+            codebook_update="ema", beta=commitment_factor, ema_decay=ema_decay, search_tile_size=search_tile_size, laplace_epsilon=laplace_epsilon)
+    elif num_subspaces > 1:
+        # product quantization with a codebook of num_embeddings codewords per sub-space
+        quantizer = ProductVectorQuantizer(num_embeddings=num_embeddings, embedding_dim=latent_dim, num_subspaces=num_subspaces, \
+            codebook_update="ema", beta=commitment_factor, ema_decay=ema_decay, search_tile_size=search_tile_size, laplace_epsilon=laplace_epsilon)
+    else:
+        quantizer = VectorQuantizer_EMA(num_embeddings=num_embeddings, embedding_dim=latent_dim, \
+            ema_decay=ema_decay, beta=commitment_factor, search_tile_size=search_tile_size, laplace_epsilon=laplace_epsilon)
     bn_layer = BatchNormalization()
     
     quantizer.enable_training_ema()
@@ -227,6 +293,8 @@ def create_quantized_autoencoder_EMA(model_type, input_dim, latent_dim, output_d
     decoder_output = decoder(encoder_outputs_quantized)
     
     vector_quant_autoencoder = Model(inputs=inputs, outputs=decoder_output, name="vector_quantized_autoencoder")
+    if isinstance(quantizer, VectorQuantizer_EMA):
+        quantizer.register_owning_model(vector_quant_autoencoder)
     return vector_quant_autoencoder
 
 
@@ -238,7 +306,8 @@ class EmbeedingUpdateCallback(Callback):
 class VQVAETrainerEMA(Model):
     def __init__(self, model_type:str, train_variance:float, input_dim:int, latent_dim:int=10,\
         num_embeddings:int=1, ema_decay:float=0.99,\
-        commitment_factor:float=0.25, **kwargs):
+        commitment_factor:float=0.25, search_tile_size:int=None, laplace_epsilon:float=None, num_stages:int=1, \
+        num_subspaces:int=1, **kwargs):
         super().__init__(**kwargs)
         self.train_variance = train_variance
         self.latent_dim = latent_dim
@@ -246,9 +315,14 @@ class VQVAETrainerEMA(Model):
         self.num_embeddings = num_embeddings
         self.commitment_factor = commitment_factor
         self.model_type = model_type
+        self.num_stages = num_stages
+        self.num_subspaces = num_subspaces
         
         self.vqvae = create_quantized_autoencoder_EMA(model_type, self.input_dim, self.latent_dim, self.input_dim,\
-            self.num_embeddings, ema_decay, commitment_factor=commitment_factor)
+            self.num_embeddings, ema_decay, commitment_factor=commitment_factor, search_tile_size=search_tile_size, \
+                laplace_epsilon=laplace_epsilon, num_stages=num_stages, num_subspaces=num_subspaces)
+        if isinstance(self.vqvae.layers[2], VectorQuantizer_EMA):
+            self.vqvae.layers[2].register_owning_model(self)
         
         self.learning_rates_list = list()
 
@@ -271,10 +345,13 @@ class VQVAETrainerEMA(Model):
     
     def disable_ema_embeddings_update(self):
         self.update_ema_embeddings = False
+        # the flag is fixed when train_step is traced, so the next fit has to trace it again
+        self.train_function = None
         
     
     def enable_ema_embeddings_update(self):
-        self.update_ema_embeddings = False
+        self.update_ema_embeddings = True
+        self.train_function = None
     
     
     def get_latent_vector(self, x):
@@ -303,10 +380,10 @@ class VQVAETrainerEMA(Model):
         reconstruction_loss_grads = tape.gradient(reconstruction_loss, self.vqvae.trainable_variables)
         self.optimizer.apply_gradients(zip(reconstruction_loss_grads, self.vqvae.trainable_variables))
             
-        # Update embedding vectors
+        # Update embedding vectors with the latents and indices of the forward pass
         if self.update_ema_embeddings:
-            latent_var = self.get_latent_vector(x)
-            self.vqvae.layers[2].update_ema_embeddings(latent_var)
+            quantizer = self.vqvae.layers[2]
+            quantizer.update_ema_embeddings(quantizer.latents, quantizer.encoding_indices)
 
         # Backpropoagation w.r.t. commitment loss
         commitment_loss_grad = tape.gradient(self.vqvae.losses, self.vqvae.layers[1].trainable_variables) # need change the varible
@@ -331,6 +408,9 @@ class VQVAETrainerEMA(Model):
     
     def save_model_weights(self, file_path):
         self.vqvae.save_weights(file_path)
+        # a nearest codeword index is saved next to the weights, see get_index_path
+        if getattr(self.vqvae.layers[2], "search_index", None) is not None:
+            save_codeword_index(self.vqvae.layers[2].search_index, get_index_path(file_path))
 
 
 class LearningRateCallback(Callback):
@@ -354,29 +434,26 @@ class LearningRateCallback(Callback):
 
 def train_vq_vae_ema(model_type:str, inputs_dims:int, latent_dims:int, num_embeddings:int, embedding_init:str="random", num_epochs:int=300, \
     commitment_factor:float=0.25, ema_decay:float=0.99, plot_figure:bool=True, optimizer:str="adam", init_epochs:int=100, re_init_interval:int=20, \
-        simulation_index:int=None):
-    
-    x_train, _, x_test, _, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
-    x_train = np.squeeze(x_train)
-    x_test = np.squeeze(x_test)
+        simulation_index:int=None, online_source:OnlineSINRWindowSource=None, steps_per_epoch:int=1000, num_reference_windows:int=80000, \
+        window_samplers:tuple=None, jit_compile:bool=False, laplace_epsilon:float=None, num_stages:int=1, num_subspaces:int=1):
     
-    x_train = np.array(x_train)
-    x_test = np.array(x_test)
-    variance = np.var(x_train)
+    train_reference, x_test, variance, fit_arguments = prepare_vq_vae_data(batch_size=128, online_source=online_source, \
+        steps_per_epoch=steps_per_epoch, num_reference_windows=num_reference_windows, window_samplers=window_samplers)
     
     vq_vae_trainer = VQVAETrainerEMA(model_type, variance, inputs_dims, latent_dims, \
-        num_embeddings=num_embeddings, ema_decay=ema_decay, commitment_factor=commitment_factor)
+        num_embeddings=num_embeddings, ema_decay=ema_decay, commitment_factor=commitment_factor, laplace_epsilon=laplace_epsilon, \
+            num_stages=num_stages, num_subspaces=num_subspaces)
     if optimizer.lower() == "rmsprop":
-        vq_vae_trainer.compile(optimizer=RMSprop(learning_rate=2e-3))
+        vq_vae_trainer.compile(optimizer=RMSprop(learning_rate=2e-3), jit_compile=jit_compile)
     if optimizer.lower() == "adam":
-        vq_vae_trainer.compile(optimizer=Adam(learning_rate=2e-3))
+        vq_vae_trainer.compile(optimizer=Adam(learning_rate=2e-3), jit_compile=jit_compile)
     vq_vae_trainer.build((None, inputs_dims))
     
     learning_rate_callback = LearningRateCallback(vq_vae_trainer.vqvae)
     latent_entropy_callback = LatentEntropyCallback(vq_vae_trainer.vqvae, validation_data=x_test, input_dim=40)
     
     if embedding_init == "random":
-        history = vq_vae_trainer.fit(x=x_train, validation_split=0.2, epochs=num_epochs, batch_size=128, \
+        history = vq_vae_trainer.fit(**fit_arguments, epochs=num_epochs, \
             callbacks=[learning_rate_callback, latent_entropy_callback], verbose=2)
     elif embedding_init == "kmpp" or "pca":
          # here define the encoder and assign new weights during the training process    
@@ -386,7 +463,7 @@ def train_vq_vae_ema(model_type:str, inputs_dims:int, latent_dims:int, num_embed
                 
         for epoch in range(num_epochs):
             print(f"Training epochs: {epoch}/{num_epochs}:")
-            history_single_epoch = vq_vae_trainer.fit(x=x_train, validation_split=0.2, epochs=1, batch_size=128, \
+            history_single_epoch = vq_vae_trainer.fit(**fit_arguments, epochs=1, \
                 callbacks=[learning_rate_callback, latent_entropy_callback], verbose=2)
             if epoch == 0:                  # initialize history object
                 history = history_single_epoch
@@ -398,19 +475,21 @@ def train_vq_vae_ema(model_type:str, inputs_dims:int, latent_dims:int, num_embed
                 # assign updates weights to encoder
                 encoder_model.set_weights(vq_vae_trainer.vqvae.layers[1].get_weights())
                 # use new latent variable to renitialize centriods using kmpp
-                latent_space = encoder_model.predict(x_train)
+                latent_space = encoder_model.predict(train_reference)
                 if embedding_init == "kmpp":
-                    kmpp_centroids = kmeans_plusplus_initialization(data=latent_space, k=num_embeddings)
-                    vq_vae_trainer.vqvae.layers[2].embeddings.assign(kmpp_centroids)
+                    vq_vae_trainer.vqvae.layers[2].initialize_embeddings(latent_space, kmeans_plusplus_initialization)
                 elif embedding_init == "pca":
-                    pca_centorids = pca_split_initialization(data=latent_space, k=num_embeddings)
-                    vq_vae_trainer.vqvae.layers[2].embeddings.assign(pca_centorids)
+                    vq_vae_trainer.vqvae.layers[2].initialize_embeddings(latent_space, pca_split_initialization)
                 
     learning_rate_list = learning_rate_callback.learning_rates_list
     num_active_embeddings_list = learning_rate_callback.num_active_embeddings_list
     latent_entropy_list = latent_entropy_callback.entropy_values_list
         
     file_name = f"{model_type}_vq_vae_ema_input_{inputs_dims}_latent_{latent_dims}_num_embeddings_{num_embeddings}_init_{embedding_init}_{optimizer}_ema_decay_{ema_decay}_beta_{commitment_factor}"
+    if num_stages > 1:
+        file_name = file_name + "_stages_" + str(num_stages)
+    if num_subspaces > 1:
+        file_name = file_name + "_subspaces_" + str(num_subspaces)
     if simulation_index != None:
         file_name = file_name + "_index_" + str(simulation_index)
     file_name = file_name + ".h5"
@@ -463,7 +542,7 @@ def test_vq_vae_ema(inputs_dims:int, latent_dims:int, num_embeddings, plot_figur
     vq_ema_layer.disable_training_ema()
     
     # prepare data
-    _, _, x_test, _, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10)
+    _, _, x_test, _, _ = data_preprocessing.prepare_data(num_inputs=40, num_outputs=10, shuffle_samples=False)
     x_test_recover = vq_vae_ema.predict(x_test)
     
     if plot_figure:
@@ -34,7 +34,7 @@ def train_e2e_AE_LSTM_model():
 def test_e2e_AE_LSTM_model():
     e2e_model_path = "models/e2e_models/e2e_ae_lstm.h5"
     e2e_model = load_model(e2e_model_path)
-    _, _, x_test, y_test, _ = prepare_data(num_inputs=40, num_outputs=10)
+    _, _, x_test, y_test, _ = prepare_data(num_inputs=40, num_outputs=10, shuffle_samples=False)
     y_pred = e2e_model.predict(x_test)
     y_pred_1d = y_pred.flatten()
     y_test_1d = y_test.flatten()